@@ -5,9 +5,28 @@ import json
 import threading
 from threading import Thread
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, flash, url_for, jsonify, send_from_directory
-from models import db, SyncJob, SyncJobHistory, ScheduledJob, UserSettings, Notification
+from flask import Flask, render_template, request, redirect, flash, url_for, jsonify, send_from_directory, stream_template, Response
+from models import db, SyncJob, SyncJobHistory, SyncJobHistoryArchive, ScheduledJob, UserSettings, Notification, JobQueueEntry
 from utils.rclone_handler import RCloneHandler
+from utils.process_table import process_table
+from utils.rc_client import RcClient
+from utils.log_classifier import classify_history_log
+from utils.log_index import log_index
+from utils.remote_capabilities import remote_capabilities
+from utils.remote_inventory import remote_inventory
+from utils.log_search import log_search, build_pattern, highlight_pattern
+from utils.event_bus import event_bus
+from utils.reconciler import reconciler, WAKE_EVENTS as RECONCILER_WAKE_EVENTS
+from utils.db_migrations import ensure_schema, ensure_indexes, configure_sqlite
+from utils.history_fts import ensure_history_fts, substring_filter
+from utils.db_writer import db_writer, WRITE_TIMEOUT
+from utils.history_archive import (paginate_history, get_history_job, read_log_bytes, archive_reached, run_archiver,
+                                   history_counts, get_retention_settings, LOG_POLICIES)
+from utils.job_queue import job_queue, get_queue_limits
+from utils import autotune
+from utils.bandwidth import (bandwidth_manager, parse_rate, parse_remote_budgets, parse_schedule,
+                             format_remote_budgets, format_schedule)
+from utils.job_stats import pair_stats, daily_stats, ensure_rollups, DEFAULT_STATS_DAYS
 from utils.scheduler import JobScheduler
 from utils.notification_manager import get_notifications, mark_notification_read, mark_all_read, add_notification
 from utils.notification_manager import notify_job_started, notify_job_completed, get_user_settings, update_settings
@@ -30,10 +49,15 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize database
 db.init_app(app)
+db_writer.init_app(app, db)  # Unico thread che scrive stati, notifiche e history
 
 # Create database tables if they don't exist
 with app.app_context():
+    configure_sqlite(db.engine)  # WAL e PRAGMA di tuning su ogni connessione
     db.create_all()
+    ensure_schema(db)  # Colonne aggiunte ai modelli dopo la creazione del database
+    ensure_indexes(db)  # Indici aggiunti ai modelli dopo la creazione del database
+    ensure_history_fts(db, [SyncJobHistory, SyncJobHistoryArchive])  # Indice trigram per i filtri di testo
 
 # Initialize RClone handler - use current directory for logs in Replit environment
 RCLONE_CONFIG_PATH = os.environ.get("RCLONE_CONFIG_PATH", "./data/rclone_scheduled.conf")
@@ -44,7 +68,17 @@ os.makedirs(os.path.dirname(RCLONE_CONFIG_PATH), exist_ok=True)
 os.makedirs(LOG_DIR, exist_ok=True)
 
 # Initialize the rclone handler
-rclone_handler = RCloneHandler(RCLONE_CONFIG_PATH, LOG_DIR)
+# Se RCLONE_RC_URL è impostata i job vengono eseguiti nel daemon `rclone rcd`
+rclone_handler = RCloneHandler(RCLONE_CONFIG_PATH, LOG_DIR, rc_client=RcClient.from_env())
+
+# Indice a trigrammi dei log usato da /search_logs (database separato nella instance folder)
+log_index.open(os.path.join(app.instance_path, 'log_index.db'))
+
+# Remote definiti in rclone.conf (riletto solo quando il file cambia)
+remote_inventory.open(rclone_handler.main_config_path)
+
+# Cache degli hash supportati dai remote (condivisa con lo scheduler, invalidata dalle modifiche a rclone.conf)
+remote_capabilities.open(os.path.join(app.instance_path, 'remote_capabilities.json'), rclone_handler.main_config_path)
 
 # Initialize job scheduler with the Flask app
 job_scheduler = JobScheduler(rclone_handler, LOG_DIR, app=app)
@@ -54,6 +88,8 @@ logger.info("=== RCLONE Configuration Paths ===")
 logger.info(f"Jobs Config: {RCLONE_CONFIG_PATH}")
 logger.info(f"Main Config: {rclone_handler.main_config_path}")
 logger.info(f"Log Directory: {LOG_DIR}")
+if rclone_handler.rc_client is not None:
+    logger.info(f"Execution engine: rclone rcd at {rclone_handler.rc_client.url}")
 logger.info("==================================")
 
 # Lo scheduler viene avviato esternamente:
@@ -116,25 +152,18 @@ def check_orphaned_jobs(only_update_inactive=True, inactive_hours=3):
                     # Cerchiamo di controllare il log file per determinare il risultato
                     if job.log_file and os.path.exists(job.log_file):
                         try:
-                            with open(job.log_file, 'r') as f:
-                                log_content = f.read()
-                                # Cerca indicazioni di errore nel log
-                                # Controlliamo i messaggi di errore in diversi formati comuni
-                                if ((" ERROR " in log_content.upper() or " ERROR:" in log_content.upper()) or 
-                                    (" FATAL " in log_content.upper() or " FATAL:" in log_content.upper()) or 
-                                    "NOTICE: Failed" in log_content or
-                                    ("Errors:" in log_content and "0)" not in log_content.split("Errors:")[1].split("\n")[0])):
-                                    
-                                    # Escludiamo il caso "nothing to transfer"
-                                    if "There was nothing to transfer" in log_content:
-                                        job.status = "completed"
-                                        logger.info(f"Job {job.id} completed successfully (nothing to transfer)")
-                                    else:
-                                        job.status = "error"
-                                        logger.info(f"Job {job.id} terminated with errors")
-                                else:
-                                    job.status = "completed"
-                                    logger.info(f"Job {job.id} completed successfully")
+                            # Classificatore condiviso: riprende dallo stato salvato sulla riga
+                            scan = classify_history_log(job)
+                            if scan.verdict == "error":
+                                job.status = "error"
+                                logger.info(f"Job {job.id} terminated with errors")
+                            elif scan.has_errors:
+                                # Escludiamo il caso "nothing to transfer"
+                                job.status = "completed"
+                                logger.info(f"Job {job.id} completed successfully (nothing to transfer)")
+                            else:
+                                job.status = "completed"
+                                logger.info(f"Job {job.id} completed successfully")
                         except Exception as e:
                             logger.error(f"Error reading log file: {str(e)}")
                             job.status = "error"  # Assumiamo errore se non possiamo leggere il log
@@ -156,7 +185,7 @@ def check_orphaned_jobs(only_update_inactive=True, inactive_hours=3):
                     
                     logger.info(f"Updated orphaned job status: {job.id} {job.source} → {job.target}")
             
-            db.session.commit()
+            db_writer.commit_changes(db.session).result(timeout=WRITE_TIMEOUT)
     except Exception as e:
         logger.error(f"Error checking orphaned jobs: {str(e)}")
 
@@ -211,29 +240,18 @@ def force_cleanup_jobs(only_stale_jobs=True, inactive_hours=3):
                 # Determina lo stato corretto in base ai log e all'exit_code
                 if job.log_file and os.path.exists(job.log_file):
                     try:
-                        with open(job.log_file, 'r') as f:
-                            log_content = f.read()
-                            # Cerca indicazioni di errore nel log
-                            # Controlliamo i messaggi di errore in diversi formati comuni
-                            # Usiamo criteri più restrittivi per evitare falsi positivi
-                            if (
-                                (" ERROR " in log_content.upper() or " ERROR:" in log_content.upper()) or 
-                                (" FATAL " in log_content.upper() or " FATAL:" in log_content.upper()) or
-                                "NOTICE: Failed" in log_content or
-                                ("Errors:" in log_content and "0)" not in log_content.split("Errors:")[1].split("\n")[0])
-                            ):
-                                # Manteniamo il job come successo se non ci sono veri errori o
-                                # se il job ha riguardato 0 file (nothing to transfer)
-                                if "There was nothing to transfer" in log_content:
-                                    # Non consideriamo un errore il caso "nothing to transfer"
-                                    job.status = "completed"
-                                    logger.info(f"Forced cleanup job {job.id} marked as completed (nothing to transfer)")
-                                else:
-                                    job.status = "error"
-                                    logger.info(f"Forced cleanup job {job.id} marked as error based on log content")
-                            else:
-                                job.status = "completed"
-                                logger.info(f"Forced cleanup job {job.id} marked as completed")
+                        # Classificatore condiviso: riprende dallo stato salvato sulla riga
+                        scan = classify_history_log(job)
+                        if scan.verdict == "error":
+                            job.status = "error"
+                            logger.info(f"Forced cleanup job {job.id} marked as error based on log content")
+                        elif scan.has_errors:
+                            # Non consideriamo un errore il caso "nothing to transfer"
+                            job.status = "completed"
+                            logger.info(f"Forced cleanup job {job.id} marked as completed (nothing to transfer)")
+                        else:
+                            job.status = "completed"
+                            logger.info(f"Forced cleanup job {job.id} marked as completed")
                     except Exception as e:
                         logger.error(f"Error reading log file for forced cleanup job {job.id}: {str(e)}")
                         # In caso di errore di lettura, assumiamo completato con errore
@@ -293,55 +311,18 @@ def force_cleanup_jobs(only_stale_jobs=True, inactive_hours=3):
                     # Se non abbiamo terminato il processo, cerca processi rclone con gli stessi parametri
                     if not process_terminated:
                         try:
-                            import subprocess
-                            import re
-                            
-                            ps_output = subprocess.check_output(['ps', 'aux'], universal_newlines=True)
-                            lines = ps_output.split('\n')
+                            import signal
                             
-                            source_pattern = re.escape(job.source)
-                            target_pattern = re.escape(job.target)
-                            
-                            # Utilizziamo un filtro ancora più restrittivo: vogliamo solo i veri comandi rclone sync/copy/etc
-                            rclone_lines = []
-                            for line in lines:
-                                parts = line.split()
-                                if len(parts) > 10:
-                                    command = ' '.join(parts[10:])
-                                    
-                                    # Verifichiamo che sia un vero comando rclone (non un comando che contiene la parola rclone)
-                                    is_rclone_command = False
-                                    
-                                    # Caso 1: Il comando è esattamente 'rclone'
-                                    if parts[10] == 'rclone' and len(parts) > 11:
-                                        # Verifichiamo che ci sia un'operazione rclone valida (sync, copy, check, etc.)
-                                        rclone_operations = ['sync', 'copy', 'move', 'check', 'ls', 'lsd', 'lsl', 'md5sum', 'sha1sum', 'size', 'delete', 'mkdir', 'rmdir', 'rcat', 'cat', 'copyto', 'moveto', 'copyurl', 'mount', 'about', 'cleanup', 'dedupe', 'version', 'touch', 'serve']
-                                        if parts[11] in rclone_operations:
-                                            is_rclone_command = True
-                                            
-                                    # Caso 2: Il comando è un percorso a rclone (come /usr/bin/rclone)
-                                    elif ('/rclone' in parts[10]) and len(parts) > 11:
-                                        if parts[10].endswith('/rclone') and parts[11] in ['sync', 'copy', 'move', 'check', 'ls', 'lsd', 'lsl', 'md5sum', 'sha1sum', 'size', 'delete', 'mkdir', 'rmdir', 'rcat', 'cat', 'copyto', 'moveto', 'copyurl', 'mount', 'about', 'cleanup', 'dedupe', 'version', 'touch', 'serve']:
-                                            is_rclone_command = True
-                                    
-                                    if is_rclone_command:
-                                        rclone_lines.append(line)
-                            
-                            # Ora cerchiamo solo nei processi rclone reali
-                            pattern = f"{source_pattern}.*{target_pattern}"
-                            for line in rclone_lines:
-                                if re.search(pattern, line):
-                                    parts = line.split()
-                                    if len(parts) > 1:
-                                        try:
-                                            pid = int(parts[1])
-                                            import signal
-                                            # Log aggiuntivo per debug
-                                            logger.info(f"Found potential rclone process to terminate: PID={pid}, command: {' '.join(parts[10:60])}")
-                                            os.kill(pid, signal.SIGTERM)
-                                            logger.info(f"Force cleanup: found and terminated rclone process with PID {pid} for job {job.id}")
-                                        except Exception as e:
-                                            logger.error(f"Error terminating found process during force cleanup: {str(e)}")
+                            # Cerchiamo solo nei processi rclone reali (sync/copy/etc) dello snapshot condiviso
+                            for proc in process_table.find_job(job.source, job.target, loose=False):
+                                try:
+                                    # Log aggiuntivo per debug
+                                    logger.info(f"Found potential rclone process to terminate: PID={proc.pid}, command: {proc.command[:300]}")
+                                    os.kill(proc.pid, signal.SIGTERM)
+                                    logger.info(f"Force cleanup: found and terminated rclone process with PID {proc.pid} for job {job.id}")
+                                except Exception as e:
+                                    logger.error(f"Error terminating found process during force cleanup: {str(e)}")
+                            process_table.invalidate()
                         except Exception as e:
                             logger.error(f"Error searching for orphaned rclone processes during force cleanup: {str(e)}")
                 except Exception as e:
@@ -352,7 +333,7 @@ def force_cleanup_jobs(only_stale_jobs=True, inactive_hours=3):
                 cleaned_jobs.append(job)
             
             # Commit delle modifiche ai job history
-            db.session.commit()
+            db_writer.commit_changes(db.session).result(timeout=WRITE_TIMEOUT)
             
             # Ora che abbiamo pulito i job, aggiorniamo le date di prossima esecuzione
             # per tutti i job pianificati che potrebbero corrispondere ai job terminati
@@ -389,7 +370,7 @@ def force_cleanup_jobs(only_stale_jobs=True, inactive_hours=3):
                     
                     # Commit delle modifiche ai job pianificati
                     if updated_schedules > 0:
-                        db.session.commit()
+                        db_writer.commit_changes(db.session).result(timeout=WRITE_TIMEOUT)
                         logger.info(f"Updated {updated_schedules} scheduled jobs after cleaning stale jobs")
                 
                 except Exception as e:
@@ -400,6 +381,109 @@ def force_cleanup_jobs(only_stale_jobs=True, inactive_hours=3):
         logger.error(f"Error in force cleanup: {str(e)}")
         return 0
 
+def fix_ghost_jobs():
+    """Close the jobs marked as running in the DB that have neither an active job nor a lock file
+    
+    Returns:
+        int: Number of jobs fixed
+    """
+    fixed_count = 0
+    try:
+        with app.app_context():
+            active_keys = {(job.get("source"), job.get("target")) for job in rclone_handler.get_active_jobs()}
+            running_jobs = SyncJobHistory.query.filter_by(status="running").all()
+            for job in running_jobs:
+                # Se è presente negli active jobs è realmente in esecuzione
+                if (job.source, job.target) in active_keys:
+                    continue
+                
+                # Il job non è attivo ma è segnato come running: verifica se il lock file esiste
+                tag = rclone_handler._generate_tag(job.source, job.target)
+                lock_file = f"{LOG_DIR}/sync_{tag}.lock"
+                if os.path.exists(lock_file):
+                    continue
+                
+                # Verifica se il job ha prodotto errori dal log file
+                if job.log_file and os.path.exists(job.log_file):
+                    try:
+                        # Classificatore condiviso: riprende dallo stato salvato sulla riga
+                        scan = classify_history_log(job)
+                        if scan.verdict == "error":
+                            job.status = "error"
+                            logger.info(f"Ghost job {job.id} marked as error based on log content")
+                        elif scan.has_errors:
+                            # Escludiamo il caso "nothing to transfer"
+                            job.status = "completed"
+                            logger.info(f"Ghost job {job.id} marked as completed (nothing to transfer)")
+                        else:
+                            job.status = "completed"
+                            logger.info(f"Ghost job {job.id} marked as completed")
+                    except Exception as e:
+                        logger.error(f"Error reading log file for ghost job {job.id}: {str(e)}")
+                        # In caso di errore nella lettura del log, assumiamo completato con errore
+                        job.status = "error"
+                else:
+                    # Se non abbiamo log file, controlliamo se il job ha un exit_code
+                    if job.exit_code is not None and job.exit_code != 0:
+                        job.status = "error"
+                        logger.info(f"Ghost job {job.id} marked as error based on exit code {job.exit_code}")
+                    else:
+                        job.status = "completed"
+                        logger.info(f"Ghost job {job.id} marked as completed (no log file)")
+                
+                job.end_time = datetime.now() if not job.end_time else job.end_time
+                logger.info(f"Auto-fixed ghost job: {job.id} {job.source} → {job.target}")
+                fixed_count += 1
+            
+            if fixed_count:
+                db_writer.commit_changes(db.session).result(timeout=WRITE_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Error checking ghost jobs: {str(e)}")
+    return fixed_count
+
+def sync_scheduled_job_times():
+    """Align last_run/next_run of the scheduled jobs that are currently running
+    
+    Così sia la pagina history che schedule mostrano lo stesso orario di avvio, e
+    next_run resta successivo alla fine prevista del job in corso.
+    """
+    try:
+        with app.app_context():
+            running = {}
+            for job in SyncJobHistory.query.filter_by(status="running").order_by(SyncJobHistory.start_time):
+                running.setdefault((job.source, job.target), job)
+            if not running:
+                return
+            
+            snapshot = process_table.snapshot()
+            now = datetime.now()
+            updated = 0
+            stats = pair_stats(pairs=list(running.keys()))
+            for job in ScheduledJob.query.all():
+                history_job = running.get((job.source, job.target))
+                if history_job is None:
+                    continue
+                if not rclone_handler.is_job_running(job.source, job.target, snapshot=snapshot, db_running=True):
+                    continue
+                
+                # Durata stimata: p95 dei job completati della coppia negli ultimi giorni
+                # (30 minuti se non ci sono statistiche). Il "next run" viene spostato
+                # a dopo l'ora stimata di completamento + 5 minuti buffer
+                estimated_duration = (stats.get((job.source, job.target), {}).get('duration_p95')
+                                      or 1800)
+                next_time = now + timedelta(seconds=(estimated_duration + 300))
+                next_run = job_scheduler._calculate_next_run(job.cron_expression, next_time)
+                if job.last_run != history_job.start_time or job.next_run != next_run:
+                    job.last_run = history_job.start_time
+                    job.next_run = next_run
+                    updated += 1
+                    logger.info(f"Job schedulato ID {job.id}: aggiornato last_run e next_run per job attivo")
+            
+            if updated:
+                db_writer.commit_changes(db.session).result(timeout=WRITE_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Errore durante l'aggiornamento degli orari dei job schedulati: {str(e)}")
+
 # Funzione per pulire gli spazi nei percorsi
 def clean_path_whitespace():
     """Rimuove gli spazi extra nei percorsi salvati nel database"""
@@ -461,6 +545,177 @@ def clean_path_whitespace():
     except Exception as e:
         logger.error(f"Errore durante la pulizia degli spazi nei percorsi: {str(e)}")
 
+
+def archive_history(force=False):
+    """Move the job history older than the retention period to the archive table
+
+    Eseguita dal reconciler (al massimo una volta ogni ARCHIVE_INTERVAL) e dal
+    pulsante "Archivia ora" delle impostazioni.
+    """
+    try:
+        with app.app_context():
+            return run_archiver(get_user_settings().settings, force=force)
+    except Exception as e:
+        logger.error(f"Errore durante l'archiviazione della cronologia: {str(e)}")
+        return None
+
+def update_job_stats():
+    """Populate the run statistics rollups of an existing database (only if they are empty)"""
+    try:
+        with app.app_context():
+            ensure_rollups()
+    except Exception as e:
+        logger.error(f"Errore durante il calcolo delle statistiche dei job: {str(e)}")
+
+def prewarm_remote_capabilities():
+    """Probe in background the hash capabilities of the configured remotes missing from the cache"""
+    try:
+        remote_capabilities.prewarm(remote_inventory.names(), rclone_handler.probe_hash_capabilities)
+    except Exception as e:
+        logger.error(f"Errore durante l'interrogazione delle capacità dei remote: {str(e)}")
+
+def launch_queued_job(job):
+    """Start a job taken from the queue: rclone process, history entry and notification
+
+    Args:
+        job: JobQueueEntry claimed by the dispatcher
+
+    Returns:
+        int: id of the SyncJobHistory entry
+    """
+    transfers, checkers = scheduled_job_parallelism(job.scheduled_job_id)
+    job_info = rclone_handler.run_custom_job(job.source, job.target, job.dry_run,
+                                             transfers=transfers, checkers=checkers)
+    with app.app_context():
+        history_id = db_writer.insert(
+            SyncJobHistory,
+            source=job.source,
+            target=job.target,
+            status="running",
+            dry_run=job.dry_run,
+            start_time=datetime.now(),
+            log_file=job_info.get("log_file"),
+            transfers=job_info.get("transfers"),
+            checkers=job_info.get("checkers"),
+            bwlimit=job_info.get("bwlimit")
+        ).result(timeout=WRITE_TIMEOUT)
+        notify_job_started(history_id, job.source, job.target, is_scheduled=job.is_scheduled, dry_run=job.dry_run)
+    return history_id
+
+def scheduled_job_parallelism(scheduled_job_id):
+    """Return the (transfers, checkers) forced by a scheduled job, None where autotuned"""
+    if scheduled_job_id is None:
+        return None, None
+    with app.app_context():
+        try:
+            job = db.session.get(ScheduledJob, scheduled_job_id)
+            return (job.transfers, job.checkers) if job is not None else (None, None)
+        finally:
+            db.session.remove()
+
+def running_job_pairs():
+    """Return the (source, target) of the jobs running in every process (from the history)"""
+    with app.app_context():
+        try:
+            return db.session.query(SyncJobHistory.source, SyncJobHistory.target).filter(
+                SyncJobHistory.status == "running").all()
+        finally:
+            db.session.remove()
+
+def current_queue_limits():
+    """Return the concurrency limits of the job queue from the user settings"""
+    with app.app_context():
+        try:
+            return get_queue_limits(get_user_settings().settings)
+        finally:
+            db.session.remove()
+
+def current_settings():
+    """Return the UserSettings.settings dictionary (for the background threads)"""
+    with app.app_context():
+        try:
+            return dict(get_user_settings().settings or {})
+        finally:
+            db.session.remove()
+
+def queued_job_failed(job, message):
+    """Report a job that waited in the queue and then failed to start"""
+    with app.app_context():
+        add_notification("Avvio del job non riuscito",
+                         f"Il job in coda {job.source} → {job.target} non è stato avviato: {message}",
+                         level="error")
+
+def update_log_index():
+    """Bring the search index up to date with the log files of the job history
+
+    Eseguita in background all'avvio: indicizza i log nuovi o cresciuti e
+    rimuove dall'indice i file che non esistono più.
+    """
+    try:
+        with app.app_context():
+            paths = [row.log_file for row in
+                     db.session.query(SyncJobHistory.log_file).filter(SyncJobHistory.log_file.isnot(None))]
+        removed = log_index.remove_missing(set(paths))
+        start = time.time()
+        indexed = log_index.update_all(paths)
+        if indexed or removed:
+            logger.info(f"Log index updated: {indexed / 1024 / 1024:.1f} MB indexed, {removed} files removed "
+                        f"in {time.time() - start:.1f}s")
+    except Exception as e:
+        logger.error(f"Errore durante l'aggiornamento dell'indice dei log: {str(e)}")
+
+def watch_external_changes(interval=3):
+    """Publish on the event bus the job and notification changes made by other processes
+
+    I job avviati dallo scheduler (scheduler_runner.py) girano in un altro
+    processo e non pubblicano sul bus di questo: una sola query ogni
+    `interval` secondi, eseguita solo se ci sono client collegati, rileva i
+    job iniziati/terminati e le nuove notifiche. Gli eventi già pubblicati da
+    questo processo vengono scartati grazie alle chiavi di deduplicazione.
+    """
+    running = None
+    last_notification_id = None
+    while True:
+        time.sleep(interval)
+        if not event_bus.subscriber_count:
+            # Nessun client: lo stato verrà riletto da capo alla prossima connessione
+            running = None
+            last_notification_id = None
+            continue
+        try:
+            with app.app_context():
+                current = {row.id: row for row in db.session.query(
+                    SyncJobHistory.id, SyncJobHistory.source, SyncJobHistory.target, SyncJobHistory.dry_run
+                ).filter(SyncJobHistory.status == "running")}
+                
+                if running is not None:
+                    for job_id in current.keys() - running.keys():
+                        row = current[job_id]
+                        event_bus.publish('job_started', {
+                            'job_id': job_id, 'source': row.source, 'target': row.target,
+                            'is_scheduled': None, 'dry_run': row.dry_run
+                        }, key=('job_started', job_id))
+                    for job_id in running.keys() - current.keys():
+                        job = db.session.get(SyncJobHistory, job_id)
+                        if job is None:
+                            continue
+                        event_bus.publish('job_cancelled' if job.status == "cancelled" else 'job_completed', {
+                            'job_id': job_id, 'source': job.source, 'target': job.target,
+                            'status': job.status, 'duration': job.duration
+                        }, key=('job_finished', job_id))
+                running = current
+                
+                query = Notification.query
+                if last_notification_id is not None:
+                    for notification in query.filter(Notification.id > last_notification_id).order_by(Notification.id):
+                        event_bus.publish('notification', notification.to_dict(),
+                                          key=('notification', notification.id))
+                        last_notification_id = notification.id
+                else:
+                    last_notification_id = db.session.query(db.func.max(Notification.id)).scalar() or 0
+        except Exception as e:
+            logger.error(f"Errore durante il controllo delle modifiche per /api/events: {str(e)}")
+
 # Esegui il controllo all'avvio
 with app.app_context():
     db.create_all()
@@ -469,81 +724,32 @@ with app.app_context():
     check_orphaned_jobs(only_update_inactive=True, inactive_hours=3)  # Controllo iniziale all'avvio
     clean_path_whitespace()  # Pulizia spazi nei percorsi
 
+# L'indicizzazione iniziale dei log può richiedere tempo: non blocca l'avvio
+# Coda globale dei job: route e scheduler accodano, il dispatcher avvia nel rispetto dei limiti
+job_queue.open(os.path.join(app.instance_path, 'job_queue'), launch=launch_queued_job,
+               running=running_job_pairs, limits=current_queue_limits, on_error=queued_job_failed)
+job_queue.start()
+
+# Budget di banda divisi tra i job in esecuzione e riapplicati con core/bwlimit
+bandwidth_manager.open(os.path.join(app.instance_path, 'bandwidth'), running=running_job_pairs,
+                       settings=current_settings, daemon=rclone_handler.rc_client)
+bandwidth_manager.start()
+
+Thread(target=update_log_index, daemon=True, name="log-index").start()
+Thread(target=update_job_stats, daemon=True, name="job-stats").start()
+Thread(target=prewarm_remote_capabilities, daemon=True, name="remote-capabilities").start()
+Thread(target=watch_external_changes, daemon=True, name="event-watcher").start()
+
 
 @app.route("/")
 def index():
     """Home page with options to create new jobs or run existing ones"""
-    # NON chiama check_orphaned_jobs() che potrebbe terminare job validi
-    # I job saranno aggiornati in modo sicuro dall'API AJAX che usa only_stale_jobs=True
-    active_jobs = rclone_handler.get_active_jobs()
-    
-    # Controllo aggiuntivo: verifica se esistono job in stato "running" nel DB 
-    # che non compaiono nella lista degli active jobs
-    running_jobs_count = 0
-    try:
-        with app.app_context():
-            running_jobs = SyncJobHistory.query.filter_by(status="running").all()
-            for job in running_jobs:
-                # Se non è presente negli active jobs ma è segnato come running nel DB
-                is_active = False
-                for active_job in active_jobs:
-                    if active_job.get("source") == job.source and active_job.get("target") == job.target:
-                        is_active = True
-                        break
-                
-                if not is_active:
-                    # Il job non è attivo ma è segnato come running: verifica se il lock file esiste
-                    tag = rclone_handler._generate_tag(job.source, job.target)
-                    lock_file = f"{LOG_DIR}/sync_{tag}.lock"
-                    if not os.path.exists(lock_file):
-                        # Verifica se il job ha prodotto errori dal log file
-                        if job.log_file and os.path.exists(job.log_file):
-                            try:
-                                with open(job.log_file, 'r') as f:
-                                    log_content = f.read()
-                                    # Cerca indicazioni di errore nel log
-                                    # Controlliamo i messaggi di errore in diversi formati comuni
-                                    # Utilizziamo gli stessi criteri più restrittivi
-                                    if (
-                                        (" ERROR " in log_content.upper() or " ERROR:" in log_content.upper()) or 
-                                        (" FATAL " in log_content.upper() or " FATAL:" in log_content.upper()) or
-                                        "NOTICE: Failed" in log_content or
-                                        ("Errors:" in log_content and "0)" not in log_content.split("Errors:")[1].split("\n")[0])
-                                    ):
-                                        # Escludiamo il caso "nothing to transfer"
-                                        if "There was nothing to transfer" in log_content:
-                                            job.status = "completed"
-                                            logger.info(f"Ghost job {job.id} marked as completed (nothing to transfer)")
-                                        else:
-                                            job.status = "error"
-                                            logger.info(f"Ghost job {job.id} marked as error based on log content")
-                                    else:
-                                        job.status = "completed"
-                                        logger.info(f"Ghost job {job.id} marked as completed")
-                            except Exception as e:
-                                logger.error(f"Error reading log file for ghost job {job.id}: {str(e)}")
-                                # In caso di errore nella lettura del log, assumiamo completato con errore
-                                job.status = "error"
-                        else:
-                            # Se non abbiamo log file, controlliamo se il job ha un exit_code
-                            if job.exit_code is not None and job.exit_code != 0:
-                                job.status = "error"
-                                logger.info(f"Ghost job {job.id} marked as error based on exit code {job.exit_code}")
-                            else:
-                                job.status = "completed"
-                                logger.info(f"Ghost job {job.id} marked as completed (no log file)")
-                        
-                        job.end_time = datetime.now() if not job.end_time else job.end_time
-                        db.session.commit()
-                        logger.info(f"Auto-fixed ghost job: {job.id} {job.source} → {job.target}")
-                        running_jobs_count += 1
-    except Exception as e:
-        logger.error(f"Error checking ghost jobs: {str(e)}")
-    
-    if running_jobs_count > 0:
-        flash(f"Aggiornati {running_jobs_count} job fantasma che risultavano in esecuzione ma erano terminati", "info")
-    
-    return render_template("index.html", active_jobs=active_jobs, rclone_handler=rclone_handler)
+    # Lo stato viene riparato dal reconciler in background: la pagina legge solo lo snapshot
+    snapshot = active_jobs_snapshot()
+    now = time.time()
+    active_jobs = [dict(job, duration=max(0.0, now - job["start_timestamp"])) for job in snapshot["active_jobs"]]
+    return render_template("index.html", active_jobs=active_jobs, rclone_handler=rclone_handler,
+                           queued_jobs=job_queue.queued_jobs())
 
 
 @app.route("/jobs")
@@ -565,33 +771,37 @@ def run_job():
         flash("No job selected", "danger")
         return redirect(url_for("jobs"))
     
-    try:
-        job = rclone_handler.run_configured_job(job_id, dry_run)
-        
-        # Create history entry
-        with app.app_context():
-            history = SyncJobHistory(
-                source=job.get("source"),
-                target=job.get("target"),
-                status="running",
-                dry_run=dry_run,
-                start_time=datetime.now(),
-                log_file=job.get("log_file")
-            )
-            db.session.add(history)
-            db.session.commit()
-            
-            # Notifica l'avvio del job
-            notify_job_started(history.id, job.get("source"), job.get("target"), is_scheduled=False, dry_run=dry_run)
-            
-        flash(f"Job started successfully: {job_id}", "success")
-    except Exception as e:
-        logger.error(f"Error running job: {str(e)}")
-        flash(f"Error running job: {str(e)}", "danger")
+    job = rclone_handler.job_config.get(job_id)
+    if job is None:
+        flash(f"Invalid job ID: {job_id} (the configuration may have changed)", "danger")
+        return redirect(url_for("jobs"))
+
+    flash_submitted(job_queue.submit(job["source"], job["target"], dry_run, origin='configured'),
+                    f"Job started successfully: {job_id}")
     
     return redirect(url_for("jobs"))
 
 
+def flash_submitted(queued, started_message):
+    """Flash the outcome of job_queue.submit: started, queued or failed"""
+    if queued.status == 'running':
+        flash(started_message, "success")
+    elif queued.status in ('pending', 'claimed'):
+        flash(f"Job in coda: {queued.source} → {queued.target} (in attesa: {queued.blocked_by or 'avvio'})", "info")
+    else:
+        logger.error(f"Error running job: {queued.error}")
+        flash(f"Error running job: {queued.error}", "danger")
+
+
+def validate_job_paths(source, target):
+    """Return an error message if source or target use a remote missing from rclone.conf"""
+    for label, path in (("Source", source), ("Target", target)):
+        error = remote_inventory.validate_path(path)
+        if error:
+            return f"{label}: {error}"
+    return None
+
+
 @app.route("/create_job", methods=["POST"])
 def create_job():
     """Create and run a new sync job"""
@@ -602,34 +812,21 @@ def create_job():
     if not source or not target:
         flash("Source and target are required", "danger")
         return redirect(url_for("jobs"))
+
+    error = validate_job_paths(source, target)
+    if error:
+        flash(error, "danger")
+        return redirect(url_for("jobs"))
     
-    try:
-        job = rclone_handler.run_custom_job(source, target, dry_run)
-        
-        # Create history entry
-        with app.app_context():
-            history = SyncJobHistory(
-                source=source,
-                target=target,
-                status="running",
-                dry_run=dry_run,
-                start_time=datetime.now(),
-                log_file=job.get("log_file")
-            )
-            db.session.add(history)
-            db.session.commit()
-            
-            # Notifica l'avvio del job
-            notify_job_started(history.id, source, target, is_scheduled=False, dry_run=dry_run)
-            
-        flash("Job started successfully", "success")
-    except Exception as e:
-        logger.error(f"Error creating job: {str(e)}")
-        flash(f"Error creating job: {str(e)}", "danger")
+    flash_submitted(job_queue.submit(source, target, dry_run), "Job started successfully")
     
     return redirect(url_for("jobs"))
 
 
+# Righe massime per pagina della cronologia
+MAX_HISTORY_PER_PAGE = 200
+
+
 @app.route("/history")
 def history():
     """View history of executed jobs with filtering and pagination"""
@@ -637,56 +834,69 @@ def history():
     # Gli stati dei job vengono aggiornati tramite le API AJAX con il parametro only_stale_jobs=True
     
     # Parametri di filtro
-    page = request.args.get('page', 1, type=int)
+    # Paginazione a cursore: after/before sono i token restituiti dalla pagina precedente
+    after = request.args.get('after', '')
+    before = request.args.get('before', '')
+    with_count = request.args.get('count') == '1'
     per_page = request.args.get('per_page', 10, type=int)
+    if not per_page or per_page < 1 or per_page > MAX_HISTORY_PER_PAGE:
+        per_page = 10
     id_filter = request.args.get('id', '')
     source_filter = request.args.get('source', '')
     target_filter = request.args.get('target', '')
+    log_filter = request.args.get('log', '')
     status_filter = request.args.get('status', '')
     mode_filter = request.args.get('mode', '')
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
     
-    # Costruzione della query con filtri
-    query = SyncJobHistory.query
-    
-    if id_filter:
-        query = query.filter(SyncJobHistory.id == id_filter)
-    if source_filter:
-        query = query.filter(SyncJobHistory.source.ilike(f'%{source_filter}%'))
-    if target_filter:
-        query = query.filter(SyncJobHistory.target.ilike(f'%{target_filter}%'))
-    if status_filter:
-        query = query.filter(SyncJobHistory.status == status_filter)
-    if mode_filter:
-        if mode_filter.lower() == 'dry':
-            query = query.filter(SyncJobHistory.dry_run == True)
-        elif mode_filter.lower() == 'live':
-            query = query.filter(SyncJobHistory.dry_run == False)
-    
-    # Filtro per data
+    # Filtri applicati sia alla tabella principale che all'archivio
+    date_from_obj = None
+    date_to_obj = None
     if date_from:
         try:
             date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-            query = query.filter(SyncJobHistory.start_time >= date_from_obj)
         except ValueError:
             # Ignora se il formato della data non è valido
             pass
-    
     if date_to:
         try:
-            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d')
             # Aggiunge un giorno per inclusività
-            date_to_obj = date_to_obj + timedelta(days=1)
-            query = query.filter(SyncJobHistory.start_time <= date_to_obj)
+            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
         except ValueError:
             # Ignora se il formato della data non è valido
             pass
     
-    # Ordinamento e paginazione
-    paginated_history = query.order_by(SyncJobHistory.start_time.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    def apply_filters(model, query, indexed=True):
+        if id_filter:
+            query = query.filter(model.id == id_filter)
+        # Filtri per sottostringa tramite l'indice trigram (ilike se indexed=False)
+        if source_filter:
+            query = query.filter(substring_filter(model, 'source', source_filter, indexed))
+        if target_filter:
+            query = query.filter(substring_filter(model, 'target', target_filter, indexed))
+        if log_filter:
+            query = query.filter(substring_filter(model, 'log_file', log_filter, indexed))
+        if status_filter:
+            query = query.filter(model.status == status_filter)
+        if mode_filter:
+            if mode_filter.lower() == 'dry':
+                query = query.filter(model.dry_run == True)
+            elif mode_filter.lower() == 'live':
+                query = query.filter(model.dry_run == False)
+        if date_from_obj:
+            query = query.filter(model.start_time >= date_from_obj)
+        if date_to_obj:
+            query = query.filter(model.start_time <= date_to_obj)
+        return query
+    
+    # Ordinamento e paginazione a cursore su (start_time, id): ogni pagina costa
+    # come la prima. Il totale esatto è calcolato solo se richiesto (count=1)
+    text_filtered = bool(source_filter or target_filter or log_filter)
+    filtered = text_filtered or any([id_filter, status_filter, mode_filter, date_from_obj, date_to_obj])
+    paginated_history = paginate_history(apply_filters, per_page, after=after, before=before,
+                                         date_from=date_from_obj, with_count=with_count,
+                                         filtered=filtered, text_filtered=text_filtered)
     
     # Opzioni per i filtri dropdown
     status_options = ['running', 'completed', 'error', 'pending']
@@ -702,46 +912,164 @@ def history():
             'id': id_filter,
             'source': source_filter,
             'target': target_filter,
+            'log': log_filter,
             'status': status_filter,
             'mode': mode_filter,
             'date_from': date_from,
             'date_to': date_to,
-            'page': page,
-            'per_page': per_page
+            'per_page': per_page,
+            'count': '1' if with_count else ''
         }
     )
 
 
 @app.route("/job_log/<int:job_id>")
 def job_log(job_id):
-    """View log for a specific job (JSON endpoint)"""
-    job = SyncJobHistory.query.get_or_404(job_id)
+    """View log for a specific job (JSON endpoint)
+
+    Con ?since=<offset> restituisce solo i byte scritti dopo offset (al massimo
+    LOG_TAIL_CHUNK per richiesta) e il nuovo offset da usare alla richiesta
+    successiva, così il polling di un job in esecuzione costa quanto i byte nuovi.
+    Senza since restituisce l'intero log come prima.
+    """
+    job = get_history_job(job_id)
+    since = request.args.get('since', type=int)
     
-    log_content = "Log file not found or empty."
+    if since is None:
+        log_content = "Log file not found or empty."
+        offset = 0
+        if job.log_file and os.path.exists(job.log_file):
+            try:
+                data = read_log_bytes(job.log_file)
+                offset = len(data)
+                log_content = data.decode('utf-8', 'replace')
+            except Exception as e:
+                logger.error(f"Error reading log file: {str(e)}")
+                log_content = f"Error reading log file: {str(e)}"
+        return jsonify({"log": log_content, "offset": offset})
     
-    if job.log_file and os.path.exists(job.log_file):
-        try:
-            with open(job.log_file, 'r') as f:
-                log_content = f.read()
-        except Exception as e:
-            logger.error(f"Error reading log file: {str(e)}")
-            log_content = f"Error reading log file: {str(e)}"
+    if not job.log_file or not os.path.exists(job.log_file):
+        return jsonify({"log": "", "offset": 0, "size": 0, "complete": True, "reset": False,
+                        "running": job.status == "running", "missing": True})
     
-    return jsonify({"log": log_content})
+    try:
+        if job.archived:
+            # Log archiviato (eventualmente compresso): offset sui byte decompressi
+            data, offset, size, reset, complete = slice_log_bytes(read_log_bytes(job.log_file), max(0, since))
+        else:
+            data, offset, size, reset, complete = read_log_tail(job.log_file, max(0, since),
+                                                                running=job.status == "running")
+    except Exception as e:
+        logger.error(f"Error reading log file: {str(e)}")
+        return jsonify({"error": f"Error reading log file: {str(e)}"}), 500
+    
+    return jsonify({
+        "log": data.decode('utf-8', 'replace'),
+        "offset": offset,
+        "size": size,
+        "complete": complete,
+        "reset": reset,
+        "running": job.status == "running"
+    })
+
+
+# Byte massimi restituiti da una singola richiesta /job_log?since=
+LOG_TAIL_CHUNK = 1024 * 1024
+
+# Un log modificato da meno di questi secondi è considerato ancora in scrittura
+LOG_GROWING_WINDOW = 60
+
+
+def read_log_tail(path, since, limit=LOG_TAIL_CHUNK, running=False):
+    """Read the bytes of a log file written after since
+
+    Args:
+        path: Log file path
+        since: Offset already received by the client
+        limit: Maximum number of bytes to return
+        running: The job is still running (the file may still grow)
+
+    Returns:
+        tuple: (data, new offset, file size, reset, complete) where reset is True
+            if the file is shorter than since (truncated or replaced) and data
+            starts again from the beginning, and complete is True if there is
+            nothing more to read for now
+    """
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        reset = since > size
+        if reset:
+            since = 0
+        f.seek(since)
+        data = f.read(min(limit, size - since))
+
+    more = since + len(data) < size
+    if more:
+        # Ci sono altri dati: tagliamo all'ultima riga completa se possibile
+        cut = data.rfind(b'\n') + 1
+        if cut:
+            data = data[:cut]
+    # Non spezzare un carattere UTF-8 multibyte: il resto arriva con la richiesta
+    # successiva se è già nel file o se il job sta ancora scrivendo il log.
+    # Altrimenti la sequenza è troncata e viene decodificata con 'replace'
+    growing = running and time.time() - stat.st_mtime < LOG_GROWING_WINDOW
+    held_back = 0
+    if more or growing:
+        for back in range(1, min(4, len(data)) + 1):
+            byte = data[-back]
+            if byte & 0xC0 != 0x80:
+                # Primo byte della sequenza: la sequenza è completa?
+                expected = 1 if byte < 0x80 else 2 if byte >= 0xC0 and byte < 0xE0 else 3 if byte < 0xF0 else 4
+                if expected > back and (growing or back < len(data)):
+                    held_back = back
+                break
+    if held_back:
+        data = data[:-held_back]
+    offset = since + len(data)
+    return data, offset, size, reset, offset >= size or (not more and held_back > 0)
+
+
+def slice_log_bytes(content, since, limit=LOG_TAIL_CHUNK):
+    """Return the part of a complete log (e.g. a decompressed archived one) after since
+
+    Come read_log_tail per un file che non cresce più: al massimo limit byte,
+    tagliati all'ultima riga completa se ne restano altri, e un offset che
+    cade dentro un carattere UTF-8 viene spostato al carattere successivo.
+
+    Returns:
+        tuple: (data, new offset, size, reset, complete) as read_log_tail
+    """
+    size = len(content)
+    reset = since > size
+    if reset:
+        since = 0
+    while since < size and content[since] & 0xC0 == 0x80:
+        since += 1
+    data = content[since:since + limit]
+    if since + len(data) < size:
+        cut = data.rfind(b'\n') + 1
+        if cut:
+            data = data[:cut]
+        else:
+            # Riga più lunga di limit: non spezzare l'ultimo carattere
+            while len(data) > 1 and content[since + len(data)] & 0xC0 == 0x80:
+                data = data[:-1]
+    offset = since + len(data)
+    return data, offset, size, reset, offset >= size
 
 
 @app.route("/view_log/<int:job_id>")
 def view_log(job_id):
     """View log file for a specific job with search capability"""
-    job = SyncJobHistory.query.get_or_404(job_id)
+    job = get_history_job(job_id)
     
     log_content = "Log file not found or empty."
     log_filename = "N/A"
     
     if job.log_file and os.path.exists(job.log_file):
         try:
-            with open(job.log_file, 'r') as f:
-                log_content = f.read()
+            log_content = read_log_bytes(job.log_file).decode('utf-8', 'replace')
             log_filename = os.path.basename(job.log_file)
         except Exception as e:
             logger.error(f"Error reading log file: {str(e)}")
@@ -766,75 +1094,67 @@ def view_log(job_id):
 
 @app.route("/logs/<path:filename>")
 def log_file(filename):
-    """Serve log files from the log directory"""
-    return send_from_directory(LOG_DIR, filename)
+    """Serve log files from the log directory
+
+    Le richieste con header Range ricevono solo l'intervallo richiesto (206),
+    così un client può scaricare solo la parte nuova di un log in crescita.
+    """
+    return send_from_directory(LOG_DIR, filename, conditional=True, max_age=0)
+
+
+# Durata massima di una connessione SSE: il browser si riconnette da solo con
+# Last-Event-ID, così i thread del server non restano occupati indefinitamente
+SSE_MAX_DURATION = 300
+
+
+@app.route("/api/events")
+def api_events():
+    """Server-Sent Events stream of job state, progress and notifications"""
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is None:
+        last_event_id = request.args.get('last_event_id', type=int)
+    subscriber = event_bus.subscribe(last_event_id=last_event_id)
+    response = Response(event_bus.stream(subscriber, max_duration=SSE_MAX_DURATION),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disattiva il buffering di nginx
+    return response
 
 
 @app.route("/api/active_jobs")
 def api_active_jobs():
-    """Restituisce i job attivi in formato JSON per aggiornamenti AJAX"""
-    # Esegui una pulizia forzata SOLO dei job stale/inattivi (non di quelli realmente attivi)
-    # Usiamo solo_stale_jobs=True per assicurarci di non interrompere job validi
-    # I job con log inattivo da più di 3 ore vengono considerati stale e terminati
-    force_cleanup_jobs(only_stale_jobs=True, inactive_hours=3)
-    
-    # Controlla e aggiorna eventuali job orfani prima di restituire i dati
-    # Usiamo only_update_inactive=True per assicurarci di non interrompere job ancora attivi
-    # I job con log inattivo da più di 3 ore vengono considerati stale e terminati
-    check_orphaned_jobs(only_update_inactive=True, inactive_hours=3)
-    
-    # Verifica processi attivi sul sistema ma non tracciati
+    """Restituisce i job attivi in formato JSON per aggiornamenti AJAX
+    
+    Serve lo snapshot pubblicato dal reconciler; l'ETag è il digest del suo
+    contenuto, quindi un client che invia If-None-Match riceve 304 finché non
+    cambia nulla (anche se la richiesta arriva a un altro worker).
+    """
+    snapshot = active_jobs_snapshot()
+    response = app.response_class(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def active_jobs_snapshot():
+    """Return the latest active jobs snapshot, building one in-request only if none exists yet"""
+    snapshot = reconciler.snapshot(timeout=5)
+    if snapshot is None:
+        snapshot = reconciler.run_once(repair=False)
+    return snapshot
+
+
+def build_active_jobs_snapshot():
+    """Collect the active jobs and the untracked rclone processes (called by the reconciler)
+    
+    Returns:
+        dict: active_jobs (formatted for the client) and untracked_processes
+    """
+    # Snapshot condiviso della tabella processi (niente più ps aux ad ogni richiesta)
     active_processes = []
-    untracked_count = 0
     try:
-        import subprocess
-        import re
-        # Ottieni i processi rclone attivi
-        ps_output = subprocess.check_output(['ps', 'aux'], universal_newlines=True)
-        
-        # Migliorato il filtro per evitare falsi positivi
-        # Ora cerchiamo solo i processi con il comando rclone effettivo, non quelli che lo contengono in qualche parametro
-        rclone_processes = []
-        for line in ps_output.split('\n'):
-            parts = line.split()
-            if len(parts) > 10:
-                command = ' '.join(parts[10:])
-                # Verifichiamo che sia un vero comando rclone (non un comando che contiene la parola rclone)
-                is_rclone_command = False
-                
-                # Caso 1: Il comando è esattamente 'rclone'
-                if parts[10] == 'rclone' and len(parts) > 11:
-                    # Verifichiamo che ci sia un'operazione rclone valida (sync, copy, check, etc.)
-                    rclone_operations = ['sync', 'copy', 'move', 'check', 'ls', 'lsd', 'lsl', 'md5sum', 'sha1sum', 'size', 'delete', 'mkdir', 'rmdir', 'rcat', 'cat', 'copyto', 'moveto', 'copyurl', 'mount', 'about', 'cleanup', 'dedupe', 'version', 'touch', 'serve']
-                    if parts[11] in rclone_operations:
-                        is_rclone_command = True
-                        
-                # Caso 2: Il comando è un percorso a rclone (come /usr/bin/rclone)
-                elif ('/rclone' in parts[10]) and len(parts) > 11:
-                    if parts[10].endswith('/rclone') and parts[11] in ['sync', 'copy', 'move', 'check', 'ls', 'lsd', 'lsl', 'md5sum', 'sha1sum', 'size', 'delete', 'mkdir', 'rmdir', 'rcat', 'cat', 'copyto', 'moveto', 'copyurl', 'mount', 'about', 'cleanup', 'dedupe', 'version', 'touch', 'serve']:
-                        is_rclone_command = True
-                
-                if is_rclone_command:
-                    rclone_processes.append(line)
-        
-        # Stampa info diagnostiche sui processi rclone trovati
-        if rclone_processes:
-            logger.info(f"Found {len(rclone_processes)} active rclone processes:")
-            for i, proc in enumerate(rclone_processes):
-                parts = proc.split()
-                if len(parts) > 10:
-                    pid = parts[1]
-                    command = ' '.join(parts[10:])
-                    logger.info(f"  - Process {i+1}: PID={pid}, CMD={command[:100]}...")
-                    active_processes.append(pid)
-                    
-                    # Verifica origine della sessione per diagnosticare job duplicati
-                    # Estrai i parametri per tracciare meglio l'origine
-                    if 'source' in command and 'target' in command:
-                        logger.debug(f"Analyzing process {pid} command: {command[:150]}")
-            
-            # Log del numero totale di processi rclone attivi            
-            logger.info(f"Total active rclone processes: {len(active_processes)}")
+        for proc in process_table.rclone_processes():
+            active_processes.append(str(proc.pid))
     except Exception as e:
         logger.error(f"Error checking rclone processes: {str(e)}")
     
@@ -855,89 +1175,250 @@ def api_active_jobs():
             'source': job.get('source'),
             'target': job.get('target'),
             'start_time': job.get('start_time').strftime('%Y-%m-%d %H:%M:%S'),
-            'duration': job.get('duration'),
-            'duration_formatted': format_duration(job.get('duration')),
+            # Niente durata: cambierebbe ad ogni ricostruzione, la calcola il client
+            'start_timestamp': job.get('start_time').timestamp(),
             'dry_run': job.get('dry_run'),
             'log_file': job.get('log_file'),
             'from_scheduler': job.get('from_scheduler', False),
             'recovered': job.get('recovered', False),  # Aggiungiamo il flag per i processi recuperati
-            'pid': pid  # Aggiungiamo il PID se disponibile
+            'pid': pid,  # Aggiungiamo il PID se disponibile
+            'progress': job.get('progress')  # Ultimo campione delle statistiche rclone (se disponibile)
         }
         formatted_jobs.append(formatted_job)
     
     # Controlla se ci sono processi non tracciati
     untracked_pids = [pid for pid in active_processes if pid not in tracked_pids]
     if untracked_pids:
-        logger.warning(f"Found {len(untracked_pids)} untracked rclone processes: {', '.join(untracked_pids)}")
+        logger.debug(f"Found {len(untracked_pids)} untracked rclone processes: {', '.join(untracked_pids)}")
     
-    return jsonify({
+    return {
         "active_jobs": formatted_jobs,
-        "untracked_processes": len(untracked_pids),
-        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    })
+        "untracked_processes": len(untracked_pids)
+    }
 
 
-def format_duration(seconds):
-    """Formatta una durata in secondi in un formato leggibile"""
-    if seconds < 60:
-        return f"{seconds:.1f}s"
-    elif seconds < 3600:
-        return f"{seconds/60:.1f}m"
-    else:
-        return f"{seconds/3600:.1f}h"
+# Granularità (punti percentuali) dell'avanzamento considerata nella versione dello snapshot:
+# i valori esatti arrivano al client con gli eventi job_progress
+PROGRESS_VERSION_STEP = 5
+
+
+def active_jobs_version_key(data):
+    """Part of the active jobs snapshot that decides its version
+
+    L'avanzamento conta solo a passi di PROGRESS_VERSION_STEP punti percentuali
+    (o per ordine di grandezza dei byte se il totale non è ancora noto):
+    altrimenti ogni ricostruzione produrrebbe una nuova versione e l'ETag non
+    eviterebbe mai di rimandare lo snapshot.
+    """
+    jobs = []
+    for job in data.get('active_jobs', []):
+        job = dict(job)
+        progress = job.pop('progress', None) or {}
+        if progress.get('percent') is not None:
+            job['progress_step'] = int(progress['percent']) // PROGRESS_VERSION_STEP
+        elif progress.get('bytes'):
+            job['progress_step'] = f"{int(progress['bytes']).bit_length()}b"
+        jobs.append(job)
+    return dict(data, active_jobs=jobs)
 
 
 @app.route("/job_status/<int:job_id>")
 def job_status(job_id):
     """Get the status of a specific job"""
     job = SyncJobHistory.query.get_or_404(job_id)
+    status = refresh_job_status(job)
+    db_writer.commit_changes(db.session).result(timeout=WRITE_TIMEOUT)
     
-    # Check if job is still running
-    if job.status == "running":
-        if rclone_handler.is_job_running(job.source, job.target):
-            status = "running"
-        else:
-            # Job finished, check log for errors
-            if job.log_file and os.path.exists(job.log_file):
-                try:
-                    with open(job.log_file, 'r') as f:
-                        log_content = f.read()
-                        # Check for error indicators
-                        if "ERROR" in log_content.upper() or "FATAL" in log_content.upper():
-                            status = "error"
-                            job.status = status
-                            logger.info(f"Job {job.id} marked as error")
-                            
-                            # Invia notifica di completamento con errore
-                            notify_job_completed(job.id, job.source, job.target, success=False, duration=job.duration)
-                        else:
-                            status = "completed"
-                            job.status = status
-                            logger.info(f"Job {job.id} marked as completed")
-                            
-                            # Invia notifica di completamento con successo
-                            notify_job_completed(job.id, job.source, job.target, success=True, duration=job.duration)
-                except Exception as e:
-                    logger.error(f"Error reading log file: {str(e)}")
-                    status = "error"
-                    job.status = status
+    # Restituisci anche la durata aggiornata e altre informazioni utili
+    return jsonify(job_status_dict(job, status))
+
+
+# Numero massimo di job per richiesta a /api/job_status
+MAX_STATUS_IDS = 500
+
+
+@app.route("/api/job_status")
+def api_job_status():
+    """Get the status of several jobs at once
+    
+    Query string: ids=1,2,3. Una sola query sul database e un solo snapshot della
+    tabella dei processi per tutti i job, invece di una richiesta a /job_status
+    per ogni riga.
+    """
+    try:
+        ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma separated list of integers"}), 400
+    ids = ids[:MAX_STATUS_IDS]
+    
+    jobs = SyncJobHistory.query.filter(SyncJobHistory.id.in_(ids)).all() if ids else []
+    snapshot = process_table.snapshot()
+    result = {}
+    for job in jobs:
+        status = refresh_job_status(job, snapshot=snapshot)
+        result[str(job.id)] = job_status_dict(job, status)
+    db_writer.commit_changes(db.session).result(timeout=WRITE_TIMEOUT)
+    
+    return jsonify({"jobs": result})
+
+
+# Giorni massimi richiedibili a /api/stats
+MAX_STATS_DAYS = 366
+
+
+@app.route("/api/stats")
+def api_stats():
+    """Run statistics per source/target pair from the rollups
+
+    Parametri: days (default 30), source e target opzionali (corrispondenza esatta).
+    """
+    days = request.args.get('days', DEFAULT_STATS_DAYS, type=int)
+    if days is None or days < 1 or days > MAX_STATS_DAYS:
+        return jsonify({"error": f"days must be between 1 and {MAX_STATS_DAYS}"}), 400
+    source = request.args.get('source')
+    target = request.args.get('target')
+    pairs = [(source, target)] if source and target else None
+    
+    stats = pair_stats(days=days, pairs=pairs)
+    result = [dict(summary, source=pair_source, target=pair_target)
+              for (pair_source, pair_target), summary in stats.items()
+              if not source or pair_source == source
+              if not target or pair_target == target]
+    result.sort(key=lambda item: item['last_run'] or '', reverse=True)
+    return jsonify({"days": days, "pairs": result})
+
+
+@app.route("/api/stats/daily")
+def api_stats_daily():
+    """Daily run statistics of a source/target pair"""
+    source = request.args.get('source')
+    target = request.args.get('target')
+    if not source or not target:
+        return jsonify({"error": "source and target are required"}), 400
+    days = request.args.get('days', DEFAULT_STATS_DAYS, type=int)
+    if days is None or days < 1 or days > MAX_STATS_DAYS:
+        return jsonify({"error": f"days must be between 1 and {MAX_STATS_DAYS}"}), 400
+    return jsonify({"source": source, "target": target, "days": days,
+                    "daily": daily_stats(source, target, days=days)})
+
+
+def refresh_job_status(job, snapshot=None):
+    """Return the current status of a history job, finalizing it if its process ended
+    
+    Se il job risulta "running" nel database ma non è più in esecuzione, lo stato
+    viene ricavato dal log e il job viene chiuso (il commit è a carico del chiamante).
+    
+    Args:
+        job: SyncJobHistory instance
+        snapshot: Optional ProcessSnapshot shared by several jobs
+    
+    Returns:
+        str: Job status
+    """
+    if job.status != "running":
+        return job.status
+    
+    # La riga stessa è "running": la query sul database di is_job_running non serve
+    if rclone_handler.is_job_running(job.source, job.target, snapshot=snapshot, db_running=True):
+        return "running"
+    
+    # Job finished, check log for errors
+    if job.log_file and os.path.exists(job.log_file):
+        try:
+            # Stessi criteri degli altri controlli (classificatore condiviso)
+            if classify_history_log(job).verdict == "error":
+                job.status = "error"
+                logger.info(f"Job {job.id} marked as error")
+                
+                # Invia notifica di completamento con errore
+                notify_job_completed(job.id, job.source, job.target, success=False, duration=job.duration)
             else:
-                status = "completed"
-                job.status = status
+                job.status = "completed"
+                logger.info(f"Job {job.id} marked as completed")
                 
-            job.end_time = datetime.now()
-            db.session.commit()
+                # Invia notifica di completamento con successo
+                notify_job_completed(job.id, job.source, job.target, success=True, duration=job.duration)
+        except Exception as e:
+            logger.error(f"Error reading log file: {str(e)}")
+            job.status = "error"
     else:
-        status = job.status
-    
-    # Restituisci anche la durata aggiornata e altre informazioni utili
-    return jsonify({
+        job.status = "completed"
+        
+    job.end_time = datetime.now()
+    return job.status
+
+
+def job_status_dict(job, status):
+    """Status payload returned by /job_status and /api/job_status"""
+    return {
         "status": status,
         "duration": job.duration_formatted,  # Questa è una property, non un metodo
         "end_time": job.end_time.strftime('%Y-%m-%d %H:%M:%S') if job.end_time else None
+    }
+
+
+@app.route("/api/queue")
+def api_queue():
+    """Jobs waiting in the execution queue (of every process) and the concurrency limits"""
+    max_jobs, max_per_remote, max_per_bucket = get_queue_limits(get_user_settings().settings)
+    return jsonify({
+        "jobs": job_queue.queued_jobs(),
+        "limits": {"max_jobs": max_jobs, "max_per_remote": max_per_remote, "max_per_bucket": max_per_bucket}
     })
 
 
+@app.route("/api/queue", methods=["POST"])
+def api_queue_submit():
+    """Enqueue a job: JSON or form with source, target and optional dry_run"""
+    data = request.get_json(silent=True) or request.form
+    source = (data.get("source") or "").strip()
+    target = (data.get("target") or "").strip()
+    dry_run = data.get("dry_run") in (True, "true", "on", "1", 1)
+    if not source or not target:
+        return jsonify({"error": "Source and target are required"}), 400
+    error = validate_job_paths(source, target)
+    if error:
+        return jsonify({"error": error}), 400
+    entry = job_queue.submit(source, target, dry_run, origin='api')
+    return jsonify(entry.to_dict()), 202
+
+
+@app.route("/api/queue/<int:queue_id>")
+def api_queue_entry(queue_id):
+    """State of one queue entry (pending, claimed, running or done)"""
+    entry = db.session.get(JobQueueEntry, queue_id)
+    if entry is None:
+        return jsonify({"error": f"Queue entry not found: {queue_id}"}), 404
+    return jsonify(entry.to_dict())
+
+
+@app.route("/queue/cancel/<int:queue_id>", methods=["POST"])
+def cancel_queued_job(queue_id):
+    """Remove a job from the execution queue before it starts"""
+    if job_queue.cancel(queue_id):
+        flash("Job rimosso dalla coda", "success")
+    else:
+        flash("Job non trovato nella coda (potrebbe essere già stato avviato)", "warning")
+    return redirect(url_for("index"))
+
+
+@app.route("/api/remotes")
+def api_remotes():
+    """Remotes defined in rclone.conf with type and main options (secret values omitted)"""
+    return jsonify(remote_inventory.to_dict())
+
+
+@app.route("/api/remotes/<name>")
+def api_remote(name):
+    """One remote of rclone.conf, with the backend type resolved through alias/crypt remotes"""
+    remote = remote_inventory.get(name)
+    if remote is None:
+        return jsonify({"error": f"Remote not found: {name}"}), 404
+    result = remote.to_dict()
+    result['resolved_type'] = remote_inventory.remote_type(name, resolve=True)
+    return jsonify(result)
+
+
 @app.route("/force_cleanup", methods=["POST"])
 @app.route("/clean_all_jobs")
 def clean_all_jobs():
@@ -948,6 +1429,7 @@ def clean_all_jobs():
     try:
         # Per il comando esplicito di pulizia, forziamo la pulizia di TUTTI i job (anche quelli attivi)
         cleaned_count = force_cleanup_jobs(only_stale_jobs=False)
+        reconciler.wake()
         
         if clean_paths_too:
             # Esegui la pulizia degli spazi nei percorsi
@@ -1028,7 +1510,11 @@ def cancel_job(job_id):
             # Update job status
             job.status = "cancelled"
             job.end_time = datetime.now()
-            db.session.commit()
+            db_writer.save(job).result(timeout=WRITE_TIMEOUT)
+            event_bus.publish('job_cancelled', {
+                'job_id': job.id, 'source': job.source, 'target': job.target, 'status': 'cancelled',
+                'duration': job.duration
+            }, key=('job_finished', job.id))
             
             # FASE 1: Check if the job is in active_jobs and try to terminate it
             job_key = f"{job.source}|{job.target}"
@@ -1067,6 +1553,22 @@ def cancel_job(job_id):
                     except Exception:
                         pass
                 
+                # Job eseguito nel daemon rclone rcd: il lock contiene "rc:<jobid>:<PID del daemon>".
+                # Dopo un riavvio del daemon lo stesso id può essere di un altro job: si ferma
+                # solo se il lock è stato scritto dal daemon attuale
+                if lock_file_content and lock_file_content.startswith('rc:') and rclone_handler.rc_client is not None:
+                    try:
+                        rc_job_id = rclone_handler.rc_client.job_from_lock(lock_file_content)
+                        if rc_job_id is not None:
+                            rclone_handler.rc_client.job_stop(rc_job_id)
+                            logger.info(f"rc job {rc_job_id} for job {job_id} stopped via job/stop")
+                            process_terminated = True
+                        else:
+                            logger.warning(f"rc lock {lock_file_content} of job {job_id} belongs to a previous "
+                                           f"run of the daemon, job/stop not sent")
+                    except Exception as e:
+                        logger.error(f"Error stopping rc job {lock_file_content}: {str(e)}")
+                
                 # Se abbiamo trovato il contenuto, estrai il PID
                 if lock_file_content and lock_file_content.isdigit():
                     pid = int(lock_file_content)
@@ -1085,57 +1587,16 @@ def cancel_job(job_id):
             # FASE 3: Ultima risorsa - cerca tutti i processi rclone in esecuzione con gli stessi parametri
             if not process_terminated:
                 try:
-                    import subprocess
-                    import re
-                    
-                    # Stessa tecnica usata nella funzione _find_orphaned_processes
-                    ps_output = subprocess.check_output(['ps', 'aux'], universal_newlines=True)
-                    lines = ps_output.split('\n')
-                    
-                    # Crea pattern per trovare comandi rclone con lo stesso source e target
-                    source_pattern = re.escape(job.source)
-                    target_pattern = re.escape(job.target)
-                    
-                    # Utilizziamo un filtro ancora più restrittivo: vogliamo solo i veri comandi rclone sync/copy/etc
-                    rclone_lines = []
-                    for line in lines:
-                        parts = line.split()
-                        if len(parts) > 10:
-                            command = ' '.join(parts[10:])
-                            
-                            # Verifichiamo che sia un vero comando rclone (non un comando che contiene la parola rclone)
-                            is_rclone_command = False
-                            
-                            # Caso 1: Il comando è esattamente 'rclone'
-                            if parts[10] == 'rclone' and len(parts) > 11:
-                                # Verifichiamo che ci sia un'operazione rclone valida (sync, copy, check, etc.)
-                                rclone_operations = ['sync', 'copy', 'move', 'check', 'ls', 'lsd', 'lsl', 'md5sum', 'sha1sum', 'size', 'delete', 'mkdir', 'rmdir', 'rcat', 'cat', 'copyto', 'moveto', 'copyurl', 'mount', 'about', 'cleanup', 'dedupe', 'version', 'touch', 'serve']
-                                if parts[11] in rclone_operations:
-                                    is_rclone_command = True
-                                    
-                            # Caso 2: Il comando è un percorso a rclone (come /usr/bin/rclone)
-                            elif ('/rclone' in parts[10]) and len(parts) > 11:
-                                if parts[10].endswith('/rclone') and parts[11] in ['sync', 'copy', 'move', 'check', 'ls', 'lsd', 'lsl', 'md5sum', 'sha1sum', 'size', 'delete', 'mkdir', 'rmdir', 'rcat', 'cat', 'copyto', 'moveto', 'copyurl', 'mount', 'about', 'cleanup', 'dedupe', 'version', 'touch', 'serve']:
-                                    is_rclone_command = True
-                            
-                            if is_rclone_command:
-                                rclone_lines.append(line)
-                    
-                    # Cerca processi che corrispondono
-                    pattern = f"{source_pattern}.*{target_pattern}"
-                    for line in rclone_lines:
-                        if re.search(pattern, line):
-                            # Estrai il PID
-                            parts = line.split()
-                            if len(parts) > 1:
-                                try:
-                                    pid = int(parts[1])
-                                    import signal
-                                    os.kill(pid, signal.SIGTERM)
-                                    logger.info(f"Found and terminated orphaned rclone process with PID {pid} for job {job_id}")
-                                    process_terminated = True
-                                except Exception as e:
-                                    logger.error(f"Error terminating found process: {str(e)}")
+                    import signal
+                    # Stesso criterio dei vecchi filtri: source e target in ordine nella riga di comando
+                    for proc in process_table.find_job(job.source, job.target, loose=False):
+                        try:
+                            os.kill(proc.pid, signal.SIGTERM)
+                            logger.info(f"Found and terminated orphaned rclone process with PID {proc.pid} for job {job_id}")
+                            process_terminated = True
+                        except Exception as e:
+                            logger.error(f"Error terminating found process: {str(e)}")
+                    process_table.invalidate()
                 except Exception as e:
                     logger.error(f"Error searching for orphaned rclone processes: {str(e)}")
             
@@ -1201,48 +1662,7 @@ def save_main_config():
 @app.route("/schedule")
 def schedule():
     """View and manage scheduled jobs"""
-    
-    # Prima controlla se ci sono job orfani/running reali da aggiornare
-    check_orphaned_jobs()
-    
-    # Quando accediamo alla pagina di pianificazione, verifichiamo anche lo stato attuale
-    # dei job schedulati e correggiamo eventuali riferimenti obsoleti
-    try:
-        # Cerca job schedulati con un job attivo corrispondente
-        jobs = ScheduledJob.query.all()
-        now = datetime.now()
-        
-        for job in jobs:
-            # Verifica se questo job ha un processo attivo corrispondente
-            if rclone_handler.is_job_running(job.source, job.target):
-                # Cerca il processo reale e ottieni il suo start time reale
-                running_jobs = SyncJobHistory.query.filter_by(
-                    source=job.source, 
-                    target=job.target,
-                    status="running"
-                ).all()
-                
-                if running_jobs:
-                    # Usa lo stesso start time del job corrente nella history
-                    # Così sia la pagina history che schedule mostreranno lo stesso orario
-                    job.last_run = running_jobs[0].start_time
-                    
-                    # Assicurati che next_run sia aggiornato correttamente
-                    # (dovrebbe essere almeno successivo alla fine prevista di questo job)
-                    # Calcola un'ora di esecuzione stimata (minimo 30 minuti, massimo 12 ore)
-                    estimated_duration = 1800  # 30 minuti in secondi
-                    
-                    # Aggiorna il "next run" a dopo l'ora stimata di completamento + 5 minuti buffer
-                    next_time = now + timedelta(seconds=(estimated_duration + 300))
-                    job.next_run = job_scheduler._calculate_next_run(job.cron_expression, next_time)
-                    
-                    # Salva le modifiche
-                    db.session.commit()
-                    logger.info(f"Job schedulato ID {job.id}: aggiornato last_run e next_run per job attivo")
-    except Exception as e:
-        logger.error(f"Errore durante l'aggiornamento degli orari dei job schedulati: {str(e)}")
-    
-    # Ottiene il sommario aggiornato
+    # Job orfani e orari dei job in esecuzione sono aggiornati dal reconciler in background
     scheduled_jobs = job_scheduler.get_schedule_summary()
     return render_template("schedule.html", scheduled_jobs=scheduled_jobs)
 
@@ -1261,6 +1681,11 @@ def create_scheduled_job():
     if not name or not source or not target or not cron_expression:
         flash("Tutti i campi sono obbligatori", "danger")
         return redirect(url_for("schedule"))
+
+    error = validate_job_paths(source, target)
+    if error:
+        flash(error, "danger")
+        return redirect(url_for("schedule"))
     
     try:
         # Valida l'espressione cron
@@ -1322,6 +1747,23 @@ def update_scheduled_job(job_id):
     if not name or not source or not target or not cron_expression:
         flash("Tutti i campi sono obbligatori", "danger")
         return redirect(url_for("edit_scheduled_job", job_id=job_id))
+
+    # Parallelismo forzato: vuoto = autotuning
+    parallelism = {}
+    for key in ("transfers", "checkers"):
+        value = request.form.get(key, "").strip()
+        try:
+            parallelism[key] = int(value) if value else None
+        except ValueError:
+            parallelism[key] = 0
+        if parallelism[key] is not None and not 1 <= parallelism[key] <= 256:
+            flash("Transfers e checkers devono essere tra 1 e 256 (vuoto = automatico)", "danger")
+            return redirect(url_for("edit_scheduled_job", job_id=job_id))
+
+    error = validate_job_paths(source, target)
+    if error:
+        flash(error, "danger")
+        return redirect(url_for("edit_scheduled_job", job_id=job_id))
     
     try:
         # Valida l'espressione cron
@@ -1341,6 +1783,8 @@ def update_scheduled_job(job_id):
         job.enabled = enabled
         job.retry_on_error = retry_on_error
         job.max_retries = max_retries
+        job.transfers = parallelism["transfers"]
+        job.checkers = parallelism["checkers"]
         
         # Ricalcola il prossimo orario di esecuzione
         job.next_run = job_scheduler._calculate_next_run(cron_expression)
@@ -1415,28 +1859,14 @@ def run_scheduled_job_now(job_id):
             flash(f"Impossibile avviare il job: {source} → {target} ha già un job in esecuzione", "warning")
             return redirect(url_for("schedule"))
         
-        # Run the job
-        job_info = rclone_handler.run_custom_job(source, target, dry_run=False)
+        # Accoda il job e aggiorna last_run
+        queued = job_queue.submit(source, target, dry_run=False, origin='scheduled',
+                                  scheduled_job_id=job.id, name=job.name)
+        if queued.status != 'done':
+            job.last_run = datetime.now()
+            db_writer.save(job).result(timeout=WRITE_TIMEOUT)
         
-        # Create history entry
-        history = SyncJobHistory(
-            source=source,  # Usiamo i valori puliti
-            target=target,  # Usiamo i valori puliti
-            status="running",
-            dry_run=False,
-            start_time=datetime.now(),
-            log_file=job_info.get("log_file")
-        )
-        db.session.add(history)
-        
-        # Update last run time
-        job.last_run = datetime.now()
-        db.session.commit()
-        
-        # Crea notifica per l'avvio del job
-        notify_job_started(history.id, source, target, is_scheduled=True, dry_run=False)
-        
-        flash(f"Job pianificato '{job.name}' avviato manualmente", "success")
+        flash_submitted(queued, f"Job pianificato '{job.name}' avviato manualmente")
     except Exception as e:
         logger.error(f"Error running scheduled job now: {str(e)}")
         flash(f"Error running job: {str(e)}", "danger")
@@ -1491,7 +1921,109 @@ def user_settings():
         update_settings(notifications_enabled=notifications_enabled)
         flash("Impostazioni aggiornate con successo", "success")
     
-    return render_template("settings.html", settings=settings)
+    retention_days, archive_log_policy = get_retention_settings(settings.settings)
+    queue_max_jobs, queue_max_per_remote, queue_max_per_bucket = get_queue_limits(settings.settings)
+    return render_template("settings.html", settings=settings,
+                           queue_max_jobs=queue_max_jobs,
+                           queue_max_per_remote=queue_max_per_remote,
+                           queue_max_per_bucket=queue_max_per_bucket,
+                           bandwidth_global=settings.settings.get('bandwidth_global') or '',
+                           bandwidth_remotes=format_remote_budgets(settings.settings.get('bandwidth_remotes')),
+                           bandwidth_schedule=format_schedule(settings.settings.get('bandwidth_schedule')),
+                           retention_days=retention_days,
+                           archive_log_policy=archive_log_policy,
+                           log_policies=LOG_POLICIES,
+                           history_counts=history_counts())
+
+
+@app.route("/settings/history_retention", methods=["POST"])
+def history_retention():
+    """Update the retention policy of the job history"""
+    try:
+        retention_days = int(request.form.get("history_retention_days", "0"))
+    except ValueError:
+        flash("Numero di giorni non valido", "danger")
+        return redirect(url_for("user_settings"))
+    
+    # 0 disattiva l'archiviazione; massimo 10 anni
+    if retention_days < 0 or retention_days > 3650:
+        flash("Il periodo di conservazione deve essere tra 0 e 3650 giorni", "danger")
+        return redirect(url_for("user_settings"))
+    
+    log_policy = request.form.get("archive_log_policy", "")
+    if log_policy not in LOG_POLICIES:
+        flash("Politica dei log non valida", "danger")
+        return redirect(url_for("user_settings"))
+    
+    update_settings(other_settings={
+        'history_retention_days': retention_days,
+        'archive_log_policy': log_policy
+    })
+    flash("Politica di conservazione della cronologia aggiornata", "success")
+    return redirect(url_for("user_settings"))
+
+
+@app.route("/settings/job_queue", methods=["POST"])
+def job_queue_settings():
+    """Update the concurrency limits of the job queue"""
+    limits = {}
+    for key in ('queue_max_jobs', 'queue_max_per_remote', 'queue_max_per_bucket'):
+        try:
+            limits[key] = int(request.form.get(key, "0"))
+        except ValueError:
+            flash("Valori numerici non validi per i limiti della coda", "danger")
+            return redirect(url_for("user_settings"))
+        # 0 = nessun limite
+        if limits[key] < 0 or limits[key] > 1000:
+            flash("I limiti della coda devono essere tra 0 e 1000", "danger")
+            return redirect(url_for("user_settings"))
+    
+    update_settings(other_settings=limits)
+    job_queue.wake()
+    flash("Limiti di concorrenza aggiornati", "success")
+    return redirect(url_for("user_settings"))
+
+
+@app.route("/settings/bandwidth", methods=["POST"])
+def bandwidth_settings():
+    """Update the bandwidth budgets (global, per remote and time-of-day windows)"""
+    global_rate = request.form.get("bandwidth_global", "").strip()
+    try:
+        parse_rate(global_rate)
+        remotes = parse_remote_budgets(request.form.get("bandwidth_remotes", ""))
+        schedule = parse_schedule(request.form.get("bandwidth_schedule", ""))
+    except ValueError as e:
+        flash(f"Budget di banda non validi: {str(e)}", "danger")
+        return redirect(url_for("user_settings"))
+
+    update_settings(other_settings={
+        'bandwidth_global': global_rate,
+        'bandwidth_remotes': remotes,
+        'bandwidth_schedule': schedule,
+    })
+    bandwidth_manager.wake()
+    flash("Budget di banda aggiornati", "success")
+    return redirect(url_for("user_settings"))
+
+
+@app.route("/api/bandwidth")
+def api_bandwidth():
+    """Bandwidth budgets active now and the share of each running job"""
+    return jsonify(bandwidth_manager.snapshot())
+
+
+@app.route("/api/autotune")
+def api_autotune():
+    """Measured throughput per pair of remotes and parallelism, with the next autotuned choice"""
+    return jsonify(autotune.tuning_snapshot())
+
+
+@app.route("/settings/archive_history", methods=["POST"])
+def archive_history_now():
+    """Run the history archiving in background with the current settings"""
+    Thread(target=archive_history, kwargs={'force': True}, daemon=True, name="history-archive").start()
+    flash("Archiviazione della cronologia avviata in background", "info")
+    return redirect(url_for("user_settings"))
 
 
 @app.route("/clean_paths")
@@ -1510,10 +2042,14 @@ def clean_paths():
 
 @app.route("/search_logs")
 def search_logs():
-    """Search in log files"""
+    """Search in log files
+
+    I risultati vengono inviati al browser man mano che il motore di ricerca
+    parallelo li trova (risposta in streaming), nell'ordine di data dei job.
+    """
     import re
     import os
-    import glob
+    import itertools
     from datetime import datetime
     
     # Recupera parametri dalla request
@@ -1523,6 +2059,7 @@ def search_logs():
     context_lines = int(request.args.get('context_lines', 5))
     max_results = int(request.args.get('max_results', 1000))
     case_sensitive = request.args.get('case_sensitive') == 'on'
+    use_regex = request.args.get('regex') == 'on'
     
     # Flag per indicare se è stata effettuata una ricerca
     searched = bool(search_text or date_from or date_to)
@@ -1534,13 +2071,15 @@ def search_logs():
         'date_to': date_to,
         'context_lines': context_lines,
         'max_results': max_results,
-        'case_sensitive': case_sensitive
+        'case_sensitive': case_sensitive,
+        'regex': use_regex
     }
     
-    results = []
+    log_files = []
+    highlight = None
     
-    # Se almeno un filtro è attivo, procedi con la ricerca
-    if searched and (search_text or date_from or date_to):
+    # Se almeno un filtro è attivo, prepara la ricerca
+    if searched:
         try:
             # Converte le date in oggetti datetime
             date_from_obj = None
@@ -1554,117 +2093,98 @@ def search_logs():
                 # Aggiungi un giorno per inclusività
                 date_to_obj = date_to_obj + timedelta(days=1)
             
-            # Ottieni la lista di tutti i file di log
-            log_files = []
-            for job in SyncJobHistory.query.all():
-                if job.log_file and os.path.exists(job.log_file):
-                    # Estrai la data dal file
-                    try:
-                        file_date = job.start_time
-                        
-                        # Filtra per data se specificata
-                        if date_from_obj and file_date < date_from_obj:
-                            continue
-                        if date_to_obj and file_date > date_to_obj:
-                            continue
-                        
-                        log_files.append((job.id, job.log_file, file_date))
-                    except Exception as e:
-                        logger.error(f"Error parsing log file date: {str(e)}")
+            # Lista dei file di log in ordine di data (il filtro sulle date è fatto dal database).
+            # L'archivio (più vecchio) viene letto solo se l'intervallo lo comprende; i log
+            # archiviati compressi o eliminati non sono più ricercabili
+            models = [SyncJobHistory]
+            if archive_reached(date_from_obj):
+                models.insert(0, SyncJobHistoryArchive)
+            for model in models:
+                query = model.query.filter(model.log_file.isnot(None))
+                if date_from_obj:
+                    query = query.filter(model.start_time >= date_from_obj)
+                if date_to_obj:
+                    query = query.filter(model.start_time <= date_to_obj)
+                if model is SyncJobHistoryArchive:
+                    query = query.filter(model.log_state.is_(None))
+                for job in query.order_by(model.start_time, model.id):
+                    if os.path.exists(job.log_file):
+                        log_files.append((job.id, job.log_file, job.start_time))
             
-            # Prepara la regex per la ricerca
+            # Valida il pattern prima di iniziare lo streaming
             if search_text:
-                flags = 0 if case_sensitive else re.IGNORECASE
-                search_pattern = re.compile(re.escape(search_text), flags)
-            
-            # Cerca in ogni file di log
-            result_count = 0
-            for job_id, log_file, file_date in log_files:
-                if result_count >= max_results:
-                    break
-                
+                build_pattern(search_text, use_regex, case_sensitive)
+                highlight = highlight_pattern(search_text, use_regex, case_sensitive)
+        
+        except re.error as e:
+            flash(f"Espressione regolare non valida: {str(e)}", "danger")
+            searched = False
+        except Exception as e:
+            logger.error(f"Error in search_logs: {str(e)}")
+            flash(f"Si è verificato un errore durante la ricerca: {str(e)}", "danger")
+            searched = False
+    
+    def generate_results():
+        """Yield the results for the template as soon as they are found"""
+        if not searched:
+            return
+        
+        # Se non c'è testo da cercare, mostra l'inizio di ogni file
+        if not search_text:
+            for job_id, log_file, file_date in log_files[:max_results]:
                 try:
-                    with open(log_file, 'r') as f:
-                        lines = f.readlines()
+                    # Limita le linee mostrate per file (senza leggere tutto il log)
+                    with open(log_file, 'r', errors='replace') as f:
+                        lines = list(itertools.islice(f, 101))
+                    content = ''.join(lines[:100])
+                    if len(lines) > 100:
+                        content += '\n... (truncated, too many lines) ...'
                     
-                    # Se non c'è testo da cercare, mostra l'intero file
-                    if not search_text:
-                        # Limita le linee mostrate per file
-                        content = ''.join(lines[:100])
-                        if len(lines) > 100:
-                            content += '\n... (truncated, too many lines) ...'
-                        
-                        results.append({
-                            'job_id': job_id,
-                            'filename': os.path.basename(log_file),
-                            'date': file_date.strftime('%Y-%m-%d %H:%M:%S'),
-                            'content': content
-                        })
-                        
-                        result_count += 1
-                        continue
-                    
-                    # Cerca il testo nel file
-                    for i, line in enumerate(lines):
-                        if search_pattern.search(line):
-                            # Calcola l'intervallo di linee da mostrare
-                            start = max(0, i - context_lines)
-                            end = min(len(lines), i + context_lines + 1)
-                            
-                            # Estrai le linee con contesto
-                            content_lines = lines[start:end]
-                            
-                            # Evidenzia il testo cercato
-                            highlighted_content = []
-                            for j, content_line in enumerate(content_lines):
-                                line_num = start + j
-                                # Aggiungi numeri di riga
-                                prefix = f"{line_num + 1:4d} | "
-                                
-                                # Evidenzia la linea corrente
-                                if line_num == i:
-                                    # Evidenzia il testo cercato
-                                    if case_sensitive:
-                                        highlighted_line = content_line.replace(search_text, 
-                                                                           f'<mark class="bg-warning text-dark">{search_text}</mark>')
-                                    else:
-                                        # Per case insensitive, dobbiamo usare regex
-                                        highlighted_line = re.sub(f'({re.escape(search_text)})', 
-                                                             r'<mark class="bg-warning text-dark">\1</mark>', 
-                                                             content_line, 
-                                                             flags=re.IGNORECASE)
-                                    
-                                    highlighted_content.append(f"<strong>{prefix}{highlighted_line}</strong>")
-                                else:
-                                    highlighted_content.append(f"{prefix}{content_line}")
-                            
-                            content = ''.join(highlighted_content)
-                            
-                            results.append({
-                                'job_id': job_id,
-                                'filename': os.path.basename(log_file),
-                                'date': file_date.strftime('%Y-%m-%d %H:%M:%S'),
-                                'content': content
-                            })
-                            
-                            result_count += 1
-                            
-                            # Limita il numero di risultati per lo stesso file
-                            if result_count >= max_results:
-                                break
-                
+                    yield {
+                        'job_id': job_id,
+                        'filename': os.path.basename(log_file),
+                        'date': file_date.strftime('%Y-%m-%d %H:%M:%S'),
+                        'content': content
+                    }
                 except Exception as e:
                     logger.error(f"Error searching log file {log_file}: {str(e)}")
-                    continue
+            return
+        
+        # In modalità testo l'indice a trigrammi limita la scansione ai blocchi candidati
+        ranges_for = None
+        if not use_regex:
+            ranges_for = lambda path: log_index.candidate_ranges(path, search_text, case_sensitive)
         
+        try:
+            for match in log_search.search(log_files, search_text, regex=use_regex,
+                                           case_sensitive=case_sensitive, context_lines=context_lines,
+                                           max_results=max_results, ranges_for=ranges_for):
+                # Aggiungi numeri di riga ed evidenzia il testo cercato nella riga trovata
+                highlighted_content = []
+                first = match['line'] - len(match['before'])
+                for j, content_line in enumerate(match['before']):
+                    highlighted_content.append(f"{first + j + 1:4d} | {content_line}")
+                
+                highlighted_line = highlight.sub(lambda m: f'<mark class="bg-warning text-dark">{m.group(0)}</mark>',
+                                                 match['text'])
+                highlighted_content.append(f"<strong>{match['line'] + 1:4d} | {highlighted_line}</strong>")
+                
+                for j, content_line in enumerate(match['after']):
+                    highlighted_content.append(f"{match['line'] + j + 2:4d} | {content_line}")
+                
+                yield {
+                    'job_id': match['job_id'],
+                    'filename': os.path.basename(match['path']),
+                    'date': match['date'].strftime('%Y-%m-%d %H:%M:%S'),
+                    'content': ''.join(highlighted_content)
+                }
         except Exception as e:
             logger.error(f"Error in search_logs: {str(e)}")
-            flash(f"Si è verificato un errore durante la ricerca: {str(e)}", "danger")
     
-    return render_template(
+    return stream_template(
         "search_logs.html", 
         filters=filters,
-        results=results,
+        results=generate_results(),
         searched=searched
     )
 
@@ -1886,3 +2406,17 @@ def upload_backup():
         flash(f"Errore durante il caricamento del backup: {str(e)}", "danger")
     
     return redirect(url_for("backup"))
+
+
+# Tutte le riparazioni dello stato sono eseguite dal reconciler, non dalle richieste.
+# force_cleanup_jobs e check_orphaned_jobs considerano stale solo i job con log
+# inattivo da più di 3 ore, senza interrompere job validi. Il reconciler parte
+# in fondo al modulo, quando tutte le funzioni che usa sono definite
+reconciler.add_repair("stale jobs", lambda: force_cleanup_jobs(only_stale_jobs=True, inactive_hours=3))
+reconciler.add_repair("orphaned jobs", lambda: check_orphaned_jobs(only_update_inactive=True, inactive_hours=3))
+reconciler.add_repair("ghost jobs", fix_ghost_jobs)
+reconciler.add_repair("scheduled job times", sync_scheduled_job_times)
+reconciler.add_repair("history archive", archive_history)
+reconciler.set_builder(build_active_jobs_snapshot, version_key=active_jobs_version_key)
+event_bus.add_listener(lambda event: reconciler.wake(), types=RECONCILER_WAKE_EVENTS)
+reconciler.start()
@@ -2,6 +2,8 @@ from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 import json
 
+from utils.log_classifier import LogScan
+
 db = SQLAlchemy()
 
 
@@ -39,6 +41,11 @@ class Notification(db.Model):
     read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
+    # Conteggio delle non lette e lista ordinata per data
+    __table_args__ = (
+        db.Index('ix_notification_read_created_at', 'read', 'created_at'),
+    )
+    
     def to_dict(self):
         """Convert to dictionary for API"""
         return {
@@ -66,6 +73,9 @@ class ScheduledJob(db.Model):
     next_run = db.Column(db.DateTime, nullable=True)
     retry_on_error = db.Column(db.Boolean, default=False)
     max_retries = db.Column(db.Integer, default=0)
+    # Parallelismo forzato (--transfers/--checkers); None = valori dell'autotuning
+    transfers = db.Column(db.Integer, nullable=True)
+    checkers = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -88,8 +98,8 @@ class SyncJob(db.Model):
         return f"<SyncJob {self.name}>"
 
 
-class SyncJobHistory(db.Model):
-    """Model for job execution history"""
+class JobHistoryMixin:
+    """Columns and helpers shared by the job history and its archive"""
     id = db.Column(db.Integer, primary_key=True)
     source = db.Column(db.String(255), nullable=False)
     target = db.Column(db.String(255), nullable=False)
@@ -100,9 +110,62 @@ class SyncJobHistory(db.Model):
     end_time = db.Column(db.DateTime, nullable=True)
     log_file = db.Column(db.String(255), nullable=True)
     exit_code = db.Column(db.Integer, nullable=True)
+    # Parallelismo usato dal job (--transfers/--checkers), registrato per l'autotuning
+    transfers = db.Column(db.Integer, nullable=True)
+    checkers = db.Column(db.Integer, nullable=True)
+    # Quota di banda (--bwlimit) assegnata all'avvio: il throughput misura il
+    # budget e non il parallelismo, quindi il job non conta per l'autotuning
+    bwlimit = db.Column(db.String(32), nullable=True)
 
-    def __repr__(self):
-        return f"<SyncJobHistory {self.id}>"
+    # Risultato dell'ultima classificazione del log (vedi utils/log_classifier.py):
+    # permette di rileggere solo i byte aggiunti dopo log_scan_offset
+    log_verdict = db.Column(db.String(20), nullable=True)  # completed, error
+    log_scan_offset = db.Column(db.BigInteger, nullable=True)
+    log_size = db.Column(db.BigInteger, nullable=True)
+    log_mtime = db.Column(db.Float, nullable=True)
+    log_error_lines = db.Column(db.Integer, nullable=True)
+    log_fatal_lines = db.Column(db.Integer, nullable=True)
+    log_failed_notices = db.Column(db.Integer, nullable=True)
+    log_nothing_to_transfer = db.Column(db.Boolean, nullable=True)
+    log_errors_line = db.Column(db.String(255), nullable=True)
+    transferred_bytes = db.Column(db.BigInteger, nullable=True)
+    total_bytes = db.Column(db.BigInteger, nullable=True)
+    transferred_files = db.Column(db.Integer, nullable=True)
+    total_files = db.Column(db.Integer, nullable=True)
+
+    # Campo di LogScan -> colonna
+    LOG_SCAN_COLUMNS = {
+        'offset': 'log_scan_offset',
+        'size': 'log_size',
+        'mtime': 'log_mtime',
+        'error_lines': 'log_error_lines',
+        'fatal_lines': 'log_fatal_lines',
+        'failed_notices': 'log_failed_notices',
+        'nothing_to_transfer': 'log_nothing_to_transfer',
+        'errors_line': 'log_errors_line',
+        'transferred_bytes': 'transferred_bytes',
+        'total_bytes': 'total_bytes',
+        'transferred_files': 'transferred_files',
+        'total_files': 'total_files',
+    }
+
+    @property
+    def log_scan(self):
+        """Saved LogScan of the log file, or None if it was never classified"""
+        if self.log_scan_offset is None:
+            return None
+        values = {field: getattr(self, column) for field, column in self.LOG_SCAN_COLUMNS.items()}
+        return LogScan(**{k: v for k, v in values.items() if v is not None})
+
+    @log_scan.setter
+    def log_scan(self, scan):
+        """Persist a LogScan (None clears the saved state)"""
+        for field, column in self.LOG_SCAN_COLUMNS.items():
+            value = getattr(scan, field) if scan is not None else None
+            if field == 'errors_line' and value is not None:
+                value = value[:255]
+            setattr(self, column, value)
+        self.log_verdict = scan.verdict if scan is not None else None
 
     @property
     def duration(self):
@@ -123,3 +186,191 @@ class SyncJobHistory(db.Model):
             return f"{seconds/60:.1f}m"
         else:
             return f"{seconds/3600:.1f}h"
+
+
+class SyncJobHistory(JobHistoryMixin, db.Model):
+    """Model for job execution history"""
+
+    # Indici per i percorsi più frequenti: job in esecuzione (anche per source/target),
+    # ricerca per file di log e ordinamento per data. Per i database esistenti sono
+    # creati da utils/db_migrations.ensure_indexes
+    __table_args__ = (
+        db.Index('ix_sync_job_history_status_start_time', 'status', 'start_time'),
+        db.Index('ix_sync_job_history_source_target_status', 'source', 'target', 'status'),
+        db.Index('ix_sync_job_history_log_file', 'log_file'),
+        db.Index('ix_sync_job_history_start_time', 'start_time'),
+    )
+
+    archived = False
+
+    def __repr__(self):
+        return f"<SyncJobHistory {self.id}>"
+
+
+class SyncJobHistoryArchive(JobHistoryMixin, db.Model):
+    """Model for job history rows moved out of SyncJobHistory by the retention policy
+
+    Le righe mantengono l'id originale, quindi i link a /view_log e /job_log
+    continuano a funzionare (vedi utils/history_archive.py).
+    """
+    __tablename__ = 'sync_job_history_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    archived_at = db.Column(db.DateTime, nullable=True)
+    log_state = db.Column(db.String(20), nullable=True)  # None (invariato), compressed, deleted
+
+    __table_args__ = (
+        db.Index('ix_sync_job_history_archive_start_time', 'start_time'),
+        db.Index('ix_sync_job_history_archive_source_target', 'source', 'target'),
+        db.Index('ix_sync_job_history_archive_log_file', 'log_file'),
+    )
+
+    archived = True
+
+    def __repr__(self):
+        return f"<SyncJobHistoryArchive {self.id}>"
+
+
+class JobRunStats(db.Model):
+    """Daily run statistics of a source/target pair
+
+    Aggiornate in modo incrementale quando un job termina (vedi
+    utils/job_stats.py): le statistiche di una coppia si leggono con una
+    ricerca sull'indice (source, target, day) senza scandire la cronologia.
+    """
+    __tablename__ = 'job_run_stats'
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(255), nullable=False)
+    target = db.Column(db.String(255), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    runs = db.Column(db.Integer, default=0)
+    completed = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+    cancelled = db.Column(db.Integer, default=0)
+    # Durate dei job completati: istogramma logaritmico (JSON) da cui sono calcolati i percentili
+    duration_histogram = db.Column(db.Text, default='{}')
+    duration_total = db.Column(db.Float, default=0)
+    duration_p50 = db.Column(db.Float, nullable=True)
+    duration_p95 = db.Column(db.Float, nullable=True)
+    duration_max = db.Column(db.Float, nullable=True)
+    transferred_bytes = db.Column(db.BigInteger, default=0)
+    transferred_files = db.Column(db.Integer, default=0)
+    last_run = db.Column(db.DateTime, nullable=True)
+    last_status = db.Column(db.String(50), nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('source', 'target', 'day', name='uq_job_run_stats_source_target_day'),
+        db.Index('ix_job_run_stats_day', 'day'),
+    )
+
+    def __repr__(self):
+        return f"<JobRunStats {self.source} -> {self.target} {self.day}>"
+
+
+class JobQueueEntry(db.Model):
+    """Job submitted to the execution queue (see utils/job_queue.py)
+
+    Stati: pending (in attesa), claimed (preso in carico da un processo, con
+    lease), running (avviato, collegato alla riga della cronologia), done
+    (terminato, annullato o non avviato: vedi outcome).
+    """
+    __tablename__ = 'job_queue'
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(255), nullable=False)
+    target = db.Column(db.String(255), nullable=False)
+    dry_run = db.Column(db.Boolean, default=False)
+    origin = db.Column(db.String(20), default='manual')  # manual, configured, scheduled, api
+    scheduled_job_id = db.Column(db.Integer, nullable=True)
+    name = db.Column(db.String(255), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    outcome = db.Column(db.String(50), nullable=True)  # stato finale del job, cancelled o error
+    error = db.Column(db.Text, nullable=True)
+    blocked_by = db.Column(db.String(255), nullable=True)
+    attempts = db.Column(db.Integer, default=0)
+    claimed_by = db.Column(db.String(255), nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    history_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_job_queue_status_created_at', 'status', 'created_at'),
+        db.Index('ix_job_queue_source_target', 'source', 'target'),
+    )
+
+    @property
+    def is_scheduled(self):
+        return self.origin == 'scheduled'
+
+    def to_dict(self):
+        """Convert to dictionary for API"""
+        return {
+            'id': self.id,
+            'source': self.source,
+            'target': self.target,
+            'dry_run': self.dry_run,
+            'origin': self.origin,
+            'scheduled_job_id': self.scheduled_job_id,
+            'name': self.name,
+            'status': self.status,
+            'outcome': self.outcome,
+            'error': self.error,
+            'blocked_by': self.blocked_by,
+            'attempts': self.attempts,
+            'claimed_by': self.claimed_by,
+            'history_id': self.history_id,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S') if self.started_at else None,
+        }
+
+    def __repr__(self):
+        return f"<JobQueueEntry {self.id} {self.source} -> {self.target} {self.status}>"
+
+
+class TransferTuning(db.Model):
+    """Measured throughput of a parallelism setting for a pair of remotes
+
+    Una riga per (remote sorgente, remote destinazione, transfers, checkers),
+    aggiornata quando un job termina (vedi utils/autotune.py): l'autotuning
+    sceglie il parallelismo dei job successivi da queste misure.
+    """
+    __tablename__ = 'transfer_tuning'
+
+    id = db.Column(db.Integer, primary_key=True)
+    src_remote = db.Column(db.String(255), nullable=False)  # '' per i percorsi locali
+    dst_remote = db.Column(db.String(255), nullable=False)
+    transfers = db.Column(db.Integer, nullable=False)
+    checkers = db.Column(db.Integer, nullable=False)
+    runs = db.Column(db.Integer, default=0)  # job completati con abbastanza dati da misurare
+    errors = db.Column(db.Integer, default=0)
+    transferred_bytes = db.Column(db.BigInteger, default=0)
+    seconds = db.Column(db.Float, default=0)
+    throughput = db.Column(db.Float, nullable=True)  # media mobile esponenziale, byte/s
+    last_run = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('src_remote', 'dst_remote', 'transfers', 'checkers',
+                            name='uq_transfer_tuning_setting'),
+    )
+
+    def to_dict(self):
+        """Convert to dictionary for API"""
+        return {
+            'src_remote': self.src_remote,
+            'dst_remote': self.dst_remote,
+            'transfers': self.transfers,
+            'checkers': self.checkers,
+            'runs': self.runs,
+            'errors': self.errors,
+            'transferred_bytes': self.transferred_bytes,
+            'seconds': self.seconds,
+            'throughput': self.throughput,
+            'last_run': self.last_run.strftime('%Y-%m-%d %H:%M:%S') if self.last_run else None,
+        }
+
+    def __repr__(self):
+        return f"<TransferTuning {self.src_remote}->{self.dst_remote} {self.transfers}/{self.checkers}>"
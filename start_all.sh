@@ -8,6 +8,19 @@ LOG_DIR="$BASE_DIR/data/logs"
 # Assicurati che la cartella di log esista
 mkdir -p "$LOG_DIR"
 
+# Modalità opzionale: i job vengono eseguiti in un unico daemon `rclone rcd`
+# (RCLONE_RC_MODE=1 lo avvia qui; in alternativa impostare RCLONE_RC_URL verso un daemon esistente)
+if [ "${RCLONE_RC_MODE:-0}" = "1" ] && [ -z "$RCLONE_RC_URL" ]; then
+    RC_ADDR="${RCLONE_RC_ADDR:-127.0.0.1:5572}"
+    export RCLONE_RC_USER="rclone-manager"
+    export RCLONE_RC_PASS="$(head -c 32 /dev/urandom | base64 | tr -dc 'A-Za-z0-9')"
+    echo "🔌 Start rclone rcd on $RC_ADDR..."
+    nohup rclone rcd --rc-addr "$RC_ADDR" --rc-user "$RCLONE_RC_USER" --rc-pass "$RCLONE_RC_PASS" \
+        --log-file "$LOG_DIR/rcd.log" --log-level INFO --gcs-bucket-policy-only > /dev/null 2>&1 &
+    export RCLONE_RC_URL="http://$RC_ADDR/"
+    echo "✅ rclone rcd started with PID: $!"
+fi
+
 # Avvia lo scheduler in background
 echo "🚀 Start Scheduler..."
 nohup python "$BASE_DIR/scheduler_runner.py" > "$LOG_DIR/scheduler.log" 2>&1 &
@@ -24,6 +37,8 @@ fi
 
 # Avvia l'applicazione web
 echo "🌐 Start Web Application..."
-exec gunicorn --bind 0.0.0.0:5000 --reuse-port --reload --timeout 60 --graceful-timeout 60 --keep-alive 5 main:app \
+# Worker a thread (gthread): ogni client collegato a /api/events occupa un thread
+exec gunicorn --bind 0.0.0.0:5000 --reuse-port --reload --timeout 60 --graceful-timeout 60 --keep-alive 5 \
+  --threads "${GUNICORN_THREADS:-16}" main:app \
   --access-logfile "$LOG_DIR/access.log" \
   --error-logfile "$LOG_DIR/error.log"
@@ -119,6 +119,73 @@ window.JobProgressRing = {
     }
 };
 
+/**
+ * Modulo per gli eventi in tempo reale (Server-Sent Events da /api/events)
+ * Una sola connessione per pagina, condivisa da tutti i componenti; se SSE non è
+ * disponibile i componenti continuano a usare il polling
+ */
+window.RCloneEvents = {
+    source: null,
+    connected: false,
+    handlers: {},
+    stateHandlers: [],
+    
+    /**
+     * Registra un gestore per un tipo di evento
+     * @param {string} type - Tipo di evento (job_started, job_progress, job_completed, job_cancelled, notification)
+     * @param {Function} handler - Funzione chiamata con il payload dell'evento
+     */
+    on: function(type, handler) {
+        if (!this.handlers[type]) {
+            this.handlers[type] = [];
+            if (this.source) this.listen(type);
+        }
+        this.handlers[type].push(handler);
+        this.connect();
+    },
+    
+    /**
+     * Registra un gestore chiamato quando la connessione si apre o si chiude
+     * @param {Function} handler - Funzione chiamata con true/false
+     */
+    onStateChange: function(handler) {
+        this.stateHandlers.push(handler);
+    },
+    
+    listen: function(type) {
+        this.source.addEventListener(type, (event) => {
+            let data;
+            try {
+                data = JSON.parse(event.data);
+            } catch (e) {
+                console.error('Evento non valido:', event.data);
+                return;
+            }
+            (this.handlers[type] || []).forEach(handler => handler(data));
+        });
+    },
+    
+    setConnected: function(connected) {
+        if (this.connected === connected) return;
+        this.connected = connected;
+        this.stateHandlers.forEach(handler => handler(connected));
+    },
+    
+    connect: function() {
+        if (this.source || !('EventSource' in window)) return;
+        
+        // L'EventSource si riconnette da solo inviando Last-Event-ID
+        this.source = new EventSource('/api/events');
+        this.source.addEventListener('hello', () => this.setConnected(true));
+        this.source.onerror = () => this.setConnected(false);
+        Object.keys(this.handlers).forEach(type => this.listen(type));
+        
+        window.addEventListener('beforeunload', () => {
+            if (this.source) this.source.close();
+        });
+    }
+};
+
 /**
  * Inizializza la pagina dei job attivi con aggiornamenti in tempo reale
  * Gestisce la visualizzazione della tabella di job attivi e gli aggiornamenti AJAX
@@ -148,12 +215,19 @@ function initializeActiveJobsPage() {
     function initializeProgressRings() {
         const statusCells = document.querySelectorAll('.job-status-cell');
         statusCells.forEach(cell => {
+            // Le celle già inizializzate sono aggiornate da updateActiveJobsTable
+            if (cell.querySelector('.progress-ring-container')) return;
+            
             const status = cell.getAttribute('data-status') || 'running';
+            const realProgress = parseFloat(cell.getAttribute('data-progress'));
             
-            // Calcoliamo un valore per la progressione
-            const progress = status === 'running' ? 
-                Math.floor(Math.random() * 40) + 50 : // 50-90% per running
-                (status === 'completed' ? 100 : 0);   // 100% per completed, 0% per pending/error
+            // Usiamo la percentuale reale di rclone quando disponibile
+            let progress;
+            if (status === 'running') {
+                progress = isNaN(realProgress) ? 50 : realProgress;
+            } else {
+                progress = status === 'completed' ? 100 : 0;   // 100% per completed, 0% per pending/error
+            }
             
             JobProgressRing.create(cell, status, progress, status);
         });
@@ -172,6 +246,17 @@ function initializeActiveJobsPage() {
                 return response.json();
             })
             .then(data => {
+                // Stesso contenuto dello snapshot (risposta 304 servita dalla cache del
+                // browser): i dati non sono cambiati, aggiorniamo solo durate e orario.
+                // Si confronta il digest: il numero di versione è diverso in ogni processo
+                if (window.apiData && window.apiData.digest === data.digest) {
+                    if (window.apiData.active_jobs) {
+                        updateActiveJobsTable(window.apiData.active_jobs);
+                    }
+                    updateLastUpdateTime();
+                    return;
+                }
+                
                 // Salva i dati per usi futuri
                 window.apiData = data;
                 
@@ -305,7 +390,7 @@ function initializeActiveJobsPage() {
             if (row) {
                 // Aggiorna la durata del job esistente
                 const durationCell = row.querySelector('.job-duration');
-                durationCell.textContent = job.duration_formatted;
+                durationCell.innerHTML = formatDurationCell(job);
             } else {
                 // Crea una nuova riga per il job
                 row = document.createElement('tr');
@@ -329,7 +414,7 @@ function initializeActiveJobsPage() {
                     </td>
                     <td><code>${job.target}</code></td>
                     <td>${job.start_time}</td>
-                    <td class="job-duration">${job.duration_formatted}</td>
+                    <td class="job-duration">${formatDurationCell(job)}</td>
                     <td>
                         ${job.dry_run ? 
                          '<span class="badge bg-warning">Dry Run</span>' : 
@@ -369,17 +454,20 @@ function initializeActiveJobsPage() {
                 // Assicuriamoci che l'attributo data-status sia impostato correttamente
                 statusCell.setAttribute('data-status', status);
                 
-                // Calcola un progresso basato sulla durata
+                // Usa la percentuale reale letta dalle statistiche di rclone;
+                // in sua assenza (job recuperati o del database) stima dalla durata
                 let progress = 0;
-                if (job.duration < 60) {
+                if (job.progress && job.progress.available && job.progress.percent !== null) {
+                    progress = job.progress.percent;
+                } else if (jobDuration(job) < 60) {
                     // Se meno di un minuto, progresso 50-60%
-                    progress = 50 + (job.duration / 60 * 10);
-                } else if (job.duration < 3600) {
+                    progress = 50 + (jobDuration(job) / 60 * 10);
+                } else if (jobDuration(job) < 3600) {
                     // Se meno di un'ora, progresso 60-80%
-                    progress = 60 + (job.duration / 3600 * 20);
+                    progress = 60 + (jobDuration(job) / 3600 * 20);
                 } else {
                     // Se più di un'ora, progresso 80-90%
-                    progress = 80 + Math.min(10, job.duration / 7200 * 10);
+                    progress = 80 + Math.min(10, jobDuration(job) / 7200 * 10);
                 }
                 
                 // Aggiorna il cerchio di progresso con animazione
@@ -391,6 +479,39 @@ function initializeActiveJobsPage() {
         initializeProgressRings();
     }
     
+    /**
+     * Durata in secondi di un job attivo, calcolata dall'orario di avvio
+     * (lo snapshot non la contiene, così la sua versione non cambia ad ogni ricostruzione)
+     * @param {Object} job - Job restituito da /api/active_jobs
+     */
+    function jobDuration(job) {
+        return Math.max(0, Date.now() / 1000 - job.start_timestamp);
+    }
+    
+    /**
+     * Formatta una durata in secondi (es. 12.5s, 3.2m, 1.5h)
+     * @param {number} seconds - Durata in secondi
+     */
+    function formatDuration(seconds) {
+        if (seconds < 60) return `${seconds.toFixed(1)}s`;
+        if (seconds < 3600) return `${(seconds / 60).toFixed(1)}m`;
+        return `${(seconds / 3600).toFixed(1)}h`;
+    }
+    
+    /**
+     * Contenuto della cella durata: durata e, se disponibile, throughput reale
+     * @param {Object} job - Job restituito da /api/active_jobs
+     */
+    function formatDurationCell(job) {
+        let html = formatDuration(jobDuration(job));
+        const progress = job.progress;
+        if (progress && progress.available) {
+            const percent = progress.percent !== null ? `${progress.percent}% · ` : '';
+            html += `<br><small class="text-muted job-throughput">${percent}${progress.bytes_formatted} / ${progress.total_bytes_formatted} · ${progress.speed_formatted}</small>`;
+        }
+        return html;
+    }
+    
     /**
      * Mostra una modale con il contenuto del file di log
      * @param {string} logFile - Percorso del file di log
@@ -468,12 +589,41 @@ function initializeActiveJobsPage() {
     initializeProgressRings();
     refreshActiveJobs();
     
-    // Aggiornamento automatico
-    const autoRefreshInterval = setInterval(refreshActiveJobs, 15000);
+    // Aggiornamenti in tempo reale: l'avvio o la fine di un job ricarica la lista
+    // (una sola richiesta per raffica di eventi), l'avanzamento aggiorna la riga
+    let refreshTimeout = null;
+    function scheduleRefresh() {
+        clearTimeout(refreshTimeout);
+        refreshTimeout = setTimeout(refreshActiveJobs, 500);
+    }
+    ['job_started', 'job_completed', 'job_cancelled'].forEach(type => RCloneEvents.on(type, scheduleRefresh));
+    
+    RCloneEvents.on('job_progress', function(data) {
+        const jobs = window.apiData && window.apiData.active_jobs;
+        if (!jobs) return;
+        const job = jobs.find(j => j.source === data.source && j.target === data.target);
+        if (!job) {
+            scheduleRefresh();
+            return;
+        }
+        job.progress = data.progress;
+        updateActiveJobsTable(jobs);
+        updateLastUpdateTime();
+    });
+    
+    // Aggiornamento automatico: ogni 15 secondi senza eventi in tempo reale,
+    // ogni 60 secondi (solo per durate e processi non tracciati) con eventi attivi
+    let autoRefreshInterval = setInterval(refreshActiveJobs, 15000);
+    RCloneEvents.onStateChange(function(connected) {
+        clearInterval(autoRefreshInterval);
+        autoRefreshInterval = setInterval(refreshActiveJobs, connected ? 60000 : 15000);
+        if (!connected) refreshActiveJobs();
+    });
     
     // Pulizia risorse
     window.addEventListener('beforeunload', function() {
         clearInterval(autoRefreshInterval);
+        clearTimeout(refreshTimeout);
     });
 }
 
@@ -960,12 +1110,18 @@ function initNotificationSystem() {
     
     // Polling per nuove notifiche
     function startNotificationPolling() {
-        // Controlla nuove notifiche ogni 60 secondi
+        // Controlla nuove notifiche ogni 60 secondi, solo se gli eventi in tempo reale non sono attivi
         setInterval(() => {
-            loadNotifications();
+            if (!RCloneEvents.connected) loadNotifications();
         }, 60000);
     }
     
+    // Nuove notifiche in tempo reale
+    RCloneEvents.on('notification', function(notification) {
+        loadNotifications();
+        sendBrowserNotification(notification.title, notification.message);
+    });
+    
     // Setup degli event listeners
     if (markAllReadBtn) {
         markAllReadBtn.addEventListener('click', function(e) {
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark del database SQLite (PRAGMA e indici di utils/db_migrations.py).
+
+Crea un database con --rows righe di storico (e --notifications notifiche)
+senza indici e con le impostazioni di default di SQLite, misura le query dei
+percorsi più frequenti e una serie di commit singoli; poi applica la stessa
+migrazione dell'app (configure_sqlite + ensure_indexes) e ripete le misure.
+
+Uso:
+    python tools/bench_db.py --rows 1000000 --dir /tmp/rclone_db_bench
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.dialects import sqlite  # noqa: E402
+from sqlalchemy.schema import CreateTable  # noqa: E402
+
+from models import db  # noqa: E402
+from utils.db_migrations import configure_sqlite, ensure_indexes  # noqa: E402
+
+PAIRS = 200
+RUNNING = 20
+START = datetime(2020, 1, 1)
+
+
+def populate(path, rows, notifications):
+    """Create the tables with the models' schema (without indexes) and fill them"""
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    for table in db.metadata.sorted_tables:
+        conn.execute(str(CreateTable(table).compile(dialect=sqlite.dialect())))
+
+    rng = random.Random(42)
+    start = START
+
+    def history_rows():
+        for n in range(rows):
+            pair = rng.randrange(PAIRS)
+            status = 'running' if n >= rows - RUNNING else ('error' if rng.random() < 0.05 else 'completed')
+            started = start + timedelta(seconds=n * 90)
+            yield (f"remote{pair % 17}:data/{pair}", f"backup{pair % 11}:bucket/{pair}", status,
+                   rng.random() < 0.1, started, started + timedelta(seconds=rng.randrange(3600)),
+                   f"./data/logs/sync_{pair}_{n}.log", 0)
+
+    conn.executemany("INSERT INTO sync_job_history (source, target, status, dry_run, start_time, end_time, "
+                     "log_file, exit_code) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", history_rows())
+    conn.executemany("INSERT INTO notification (title, message, level, read, created_at) VALUES (?, ?, ?, ?, ?)",
+                     ((f"Job {n}", "message", "info", n < notifications - 30, start + timedelta(minutes=n))
+                      for n in range(notifications)))
+    conn.commit()
+    conn.close()
+
+
+def queries(rows):
+    pair = 42
+    log_file = f"./data/logs/sync_{pair}_{rows // 2}.log"
+    return (
+        ("running jobs", "SELECT * FROM sync_job_history WHERE status = 'running'", {}),
+        ("running by source/target",
+         "SELECT * FROM sync_job_history WHERE source = :s AND target = :t AND status = 'running'",
+         {'s': f"remote{pair % 17}:data/{pair}", 't': f"backup{pair % 11}:bucket/{pair}"}),
+        ("by log_file", "SELECT * FROM sync_job_history WHERE log_file = :f", {'f': log_file}),
+        ("history page 1", "SELECT * FROM sync_job_history ORDER BY start_time DESC LIMIT 10", {}),
+        ("history page 500", "SELECT * FROM sync_job_history ORDER BY start_time DESC LIMIT 10 OFFSET 5000", {}),
+        ("history page 50000", "SELECT * FROM sync_job_history ORDER BY start_time DESC LIMIT 10 OFFSET 500000", {}),
+        # Paginazione a cursore (start_time, id) di /history: il cursore è la riga ~500000
+        ("history keyset deep page",
+         "SELECT * FROM sync_job_history WHERE (start_time, id) < (:t, :i) "
+         "ORDER BY start_time DESC, id DESC LIMIT 10",
+         {'t': (START + timedelta(seconds=(rows // 2) * 90)).strftime('%Y-%m-%d %H:%M:%S.%f'), 'i': rows // 2 + 1}),
+        ("errors page 1",
+         "SELECT * FROM sync_job_history WHERE status = 'error' ORDER BY start_time DESC LIMIT 10", {}),
+        ("unread notifications", "SELECT count(*) FROM notification WHERE read = 0", {}),
+    )
+
+
+def measure(app, rows, repeat, writes):
+    results = {}
+    with app.app_context():
+        with db.engine.connect() as conn:
+            mode = conn.execute(text("PRAGMA journal_mode")).scalar()
+            sync = conn.execute(text("PRAGMA synchronous")).scalar()
+            for name, sql, params in queries(rows):
+                conn.execute(text(sql), params).fetchall()  # cache calda
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    conn.execute(text(sql), params).fetchall()
+                results[name] = (time.perf_counter() - start) / repeat
+
+            # Commit singoli come quelli degli aggiornamenti di stato dei job
+            ids = [row[0] for row in conn.execute(text(
+                "SELECT id FROM sync_job_history WHERE status = 'running'")).fetchall()]
+            start = time.perf_counter()
+            for n in range(writes):
+                conn.execute(text("UPDATE sync_job_history SET exit_code = :c WHERE id = :i"),
+                             {'c': n, 'i': ids[n % len(ids)]})
+                conn.commit()
+            results['single-row commit'] = (time.perf_counter() - start) / writes
+    return mode, sync, results
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    db.init_app(app)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SQLite pragmas and indexes")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--notifications', type=int, default=100000)
+    parser.add_argument('--dir', default='/tmp/rclone_db_bench')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--writes', type=int, default=500)
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    path = os.path.join(args.dir, 'rclone_manager.db')
+    print(f"Populating {args.rows} history rows and {args.notifications} notifications...")
+    start = time.perf_counter()
+    populate(path, args.rows, args.notifications)
+    print(f"  done in {time.perf_counter() - start:.1f}s, {os.path.getsize(path) / 1024 / 1024:.0f} MB")
+
+    before_app = make_app(path)
+    mode, sync, before = measure(before_app, args.rows, args.repeat, args.writes)
+    print(f"before: journal_mode={mode} synchronous={sync}")
+    with before_app.app_context():
+        db.engine.dispose()
+
+    after_app = make_app(path)
+    with after_app.app_context():
+        configure_sqlite(db.engine)
+        start = time.perf_counter()
+        created = ensure_indexes(db)
+        print(f"migration: {len(created)} indexes created in {time.perf_counter() - start:.1f}s")
+    mode, sync, after = measure(after_app, args.rows, args.repeat, args.writes)
+    print(f"after:  journal_mode={mode} synchronous={sync}")
+
+    print(f"{'':28} {'before':>12} {'after':>12} {'speedup':>9}")
+    for name in before:
+        speedup = before[name] / after[name] if after[name] else float('inf')
+        print(f"{name:28} {before[name] * 1000:10.3f}ms {after[name] * 1000:10.3f}ms {speedup:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
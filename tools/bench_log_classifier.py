@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark del classificatore dei log su un log rclone sintetico.
+
+Genera (se non esiste) un log di --size MB con righe INFO, statistiche
+periodiche e qualche errore, poi confronta:
+- il vecchio controllo (read() + .upper() ripetuti + split su "Errors:")
+- classify_log a freddo (intero file)
+- classify_log ripreso da un offset dopo l'aggiunta di nuove righe
+
+Uso:
+    python tools/bench_log_classifier.py --size 1024 --path /tmp/rclone_bench.log
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.log_classifier import classify_log  # noqa: E402
+
+STATS_BLOCK = (
+    "2024/05/01 10:00:00 INFO  : \n"
+    "Transferred:   \t  1.234 GiB / 10.000 GiB, 12%, 10.000 MiB/s, ETA 15m0s\n"
+    "Checks:              1000 / 1000, 100%\n"
+    "Transferred:          100 / 1000, 10%\n"
+    "Elapsed time:       1m0.0s\n"
+)
+
+
+def generate(path, size_mb):
+    """Write a synthetic rclone log of about size_mb megabytes"""
+    target = size_mb * 1024 * 1024
+    line = "2024/05/01 10:00:00 INFO  : backups/2024/05/01/some/deep/path/file_{:08d}.dat: Copied (new)\n"
+    written = 0
+    i = 0
+    with open(path, 'w') as f:
+        while written < target:
+            lines = [line.format(i + j) for j in range(10000)]
+            lines.append(STATS_BLOCK)
+            if i % 500000 == 0:
+                lines.append(f"2024/05/01 10:00:00 ERROR : file_{i:08d}.dat: Failed to copy: connection reset\n")
+            chunk = ''.join(lines)
+            f.write(chunk)
+            written += len(chunk)
+            i += 10000
+
+
+def old_check(path):
+    """The check previously copy-pasted in app.py and rclone_handler.py"""
+    with open(path, 'r') as f:
+        log_content = f.read()
+    if ((" ERROR " in log_content.upper() or " ERROR:" in log_content.upper()) or
+            (" FATAL " in log_content.upper() or " FATAL:" in log_content.upper()) or
+            "NOTICE: Failed" in log_content or
+            ("Errors:" in log_content and "0)" not in log_content.split("Errors:")[1].split("\n")[0])):
+        return 'completed' if "There was nothing to transfer" in log_content else 'error'
+    return 'completed'
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming log classifier")
+    parser.add_argument('--size', type=int, default=1024, help="Log size in MB")
+    parser.add_argument('--path', default='/tmp/rclone_bench.log')
+    parser.add_argument('--skip-old', action='store_true', help="Do not run the old full-read check")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path) or os.path.getsize(args.path) < args.size * 1024 * 1024:
+        print(f"Generating {args.size} MB synthetic log at {args.path}...")
+        generate(args.path, args.size)
+    size_mb = os.path.getsize(args.path) / 1024 / 1024
+
+    start = time.perf_counter()
+    scan = classify_log(args.path)
+    elapsed = time.perf_counter() - start
+    print(f"classify_log (full):    {elapsed:7.2f}s  {size_mb / elapsed:8.1f} MB/s  "
+          f"verdict={scan.verdict} errors={scan.error_lines} peak RSS={peak_rss_mb():.0f} MB")
+
+    # Simula un log che cresce: aggiunge un blocco di statistiche e riprende dall'offset
+    with open(args.path, 'a') as f:
+        f.write(STATS_BLOCK * 10)
+    start = time.perf_counter()
+    resumed = classify_log(args.path, scan)
+    elapsed = time.perf_counter() - start
+    print(f"classify_log (resumed): {elapsed * 1000:7.2f}ms for {resumed.offset - scan.offset} new bytes, "
+          f"verdict={resumed.verdict}")
+
+    if not args.skip_old:
+        start = time.perf_counter()
+        verdict = old_check(args.path)
+        elapsed = time.perf_counter() - start
+        print(f"old full-read check:    {elapsed:7.2f}s  {size_mb / elapsed:8.1f} MB/s  "
+              f"verdict={verdict} peak RSS={peak_rss_mb():.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark dell'indice a trigrammi dei log (utils/log_index.py).
+
+Genera --files log sintetici da --size MB ciascuno (stesso formato di
+bench_log_classifier.py), li indicizza e confronta per alcune ricerche:
+- la scansione completa riga per riga (il vecchio /search_logs)
+- candidate_ranges + verifica dei soli blocchi candidati
+Infine misura l'aggiornamento incrementale dopo l'aggiunta di righe a un log.
+
+Uso:
+    python tools/bench_log_index.py --files 4 --size 256 --dir /tmp/rclone_index_bench
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.log_index import LogIndex  # noqa: E402
+from tools.bench_log_classifier import generate, STATS_BLOCK  # noqa: E402
+
+QUERIES = ('connection reset', 'file_00123456.dat', 'no such text anywhere', 'Copied (new)')
+
+# Byte letti per volta durante la verifica dei blocchi candidati
+READ_CHUNK = 1024 * 1024
+
+
+def brute_force(paths, text, max_results):
+    pattern = re.compile(re.escape(text), re.IGNORECASE)
+    found = 0
+    for path in paths:
+        with open(path, 'r', errors='replace') as f:
+            for line in f:
+                if pattern.search(line):
+                    found += 1
+                    if found >= max_results:
+                        return found
+    return found
+
+
+def read_ranges(path, ranges, chunk_size=READ_CHUNK):
+    """Yield the lines of the (start, end, first_line) ranges of path, in pieces of complete lines"""
+    with open(path, 'rb') as f:
+        for start, end, _ in ranges:
+            f.seek(start)
+            remaining = end - start
+            carry = b''
+            while remaining > 0:
+                block = f.read(min(chunk_size, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                data = carry + block
+                cut = len(data) if remaining <= 0 else data.rfind(b'\n') + 1
+                carry = data[cut:]
+                if cut:
+                    yield data[:cut].decode('utf-8', 'replace').split('\n')
+            if carry:
+                yield carry.decode('utf-8', 'replace').split('\n')
+
+
+def indexed(index, paths, text, max_results):
+    pattern = re.compile(re.escape(text), re.IGNORECASE)
+    found = 0
+    for path in paths:
+        for lines in read_ranges(path, index.candidate_ranges(path, text)):
+            for line in lines:
+                if pattern.search(line):
+                    found += 1
+                    if found >= max_results:
+                        return found
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the trigram log index")
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--size', type=int, default=256, help="Size of each log in MB")
+    parser.add_argument('--dir', default='/tmp/rclone_index_bench')
+    parser.add_argument('--max-results', type=int, default=1000)
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    paths = []
+    for n in range(args.files):
+        path = os.path.join(args.dir, f"sync_{n}.log")
+        if not os.path.exists(path) or os.path.getsize(path) < args.size * 1024 * 1024:
+            print(f"Generating {args.size} MB synthetic log at {path}...")
+            generate(path, args.size)
+        paths.append(path)
+    total_mb = sum(os.path.getsize(p) for p in paths) / 1024 / 1024
+
+    db_path = os.path.join(args.dir, 'log_index.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    index = LogIndex(db_path)
+    start = time.perf_counter()
+    index.update_all(paths)
+    elapsed = time.perf_counter() - start
+    index_mb = sum(os.path.getsize(db_path + suffix) for suffix in ('', '-wal')
+                   if os.path.exists(db_path + suffix)) / 1024 / 1024
+    print(f"initial indexing:  {elapsed:7.2f}s  {total_mb / elapsed:6.1f} MB/s  "
+          f"index size={index_mb:.1f} MB  {index.stats()}")
+
+    for text in QUERIES:
+        start = time.perf_counter()
+        old = brute_force(paths, text, args.max_results)
+        old_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        new = indexed(index, paths, text, args.max_results)
+        new_elapsed = time.perf_counter() - start
+        print(f"{text!r:28} brute force {old_elapsed * 1000:9.1f}ms  indexed {new_elapsed * 1000:9.1f}ms  "
+              f"matches {old}/{new}")
+
+    with open(paths[0], 'a') as f:
+        f.write(STATS_BLOCK * 100)
+    start = time.perf_counter()
+    added = index.update_file(paths[0])
+    print(f"incremental update: {(time.perf_counter() - start) * 1000:.1f}ms for {added} new bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark del motore di ricerca parallelo (utils/log_search.py).
+
+Usa gli stessi log sintetici di bench_log_index.py e confronta, per una
+ricerca senza indice (regex) e una ricerca di testo raro:
+- la scansione riga per riga in un solo processo (il vecchio /search_logs)
+- LogSearch con 1 worker e con --workers worker
+riportando tempo totale e tempo al primo risultato.
+
+Uso:
+    python tools/bench_log_search.py --files 4 --size 256 --workers 4
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.log_search import LogSearch  # noqa: E402
+from tools.bench_log_classifier import generate  # noqa: E402
+
+SEARCHES = (
+    ('connection reset', False),
+    (r'file_0+12345\d\.dat', True),
+    ('no such text anywhere', False),
+)
+
+
+def line_by_line(paths, text, regex, max_results):
+    pattern = re.compile(text if regex else re.escape(text), re.IGNORECASE)
+    found = 0
+    first = None
+    start = time.perf_counter()
+    for path in paths:
+        with open(path, 'r', errors='replace') as f:
+            for line in f:
+                if pattern.search(line):
+                    found += 1
+                    first = first or time.perf_counter() - start
+                    if found >= max_results:
+                        return found, first
+    return found, first
+
+
+def engine(search, files, text, regex, max_results):
+    found = 0
+    first = None
+    start = time.perf_counter()
+    for _ in search.search(files, text, regex=regex, context_lines=5, max_results=max_results):
+        found += 1
+        first = first or time.perf_counter() - start
+    return found, first
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parallel log search")
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--size', type=int, default=256, help="Size of each log in MB")
+    parser.add_argument('--dir', default='/tmp/rclone_index_bench')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-results', type=int, default=1000)
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    paths = []
+    for n in range(args.files):
+        path = os.path.join(args.dir, f"sync_{n}.log")
+        if not os.path.exists(path) or os.path.getsize(path) < args.size * 1024 * 1024:
+            print(f"Generating {args.size} MB synthetic log at {path}...")
+            generate(path, args.size)
+        paths.append(path)
+    files = [(n, path, n) for n, path in enumerate(paths)]
+
+    serial = LogSearch(workers=1)
+    parallel = LogSearch(workers=args.workers)
+    try:
+        for text, regex in SEARCHES:
+            for label, run in (('line by line', lambda: line_by_line(paths, text, regex, args.max_results)),
+                               ('1 worker', lambda: engine(serial, files, text, regex, args.max_results)),
+                               (f'{args.workers} workers', lambda: engine(parallel, files, text, regex,
+                                                                          args.max_results))):
+                start = time.perf_counter()
+                found, first = run()
+                elapsed = time.perf_counter() - start
+                first_ms = f"{first * 1000:8.1f}ms" if first is not None else "       -  "
+                print(f"{text!r:26} {label:12} total {elapsed * 1000:9.1f}ms  first result {first_ms}  "
+                      f"matches {found}")
+    finally:
+        parallel.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Stand-in HTTP server for the rclone rc endpoints used by utils/rc_client.py.
+
+Simula `rclone rcd` senza rclone: i job sync/sync avanzano linearmente per
+--duration secondi (un srcFs che contiene "fail" termina con errore), con
+statistiche per gruppo su core/stats. Serve per provare la modalità rcd di
+RCloneHandler e per verificare il client.
+
+Uso:
+    python tools/fake_rcd.py --port 5572              # server in foreground
+    RCLONE_RC_URL=http://127.0.0.1:5572/ ./start_all.sh
+    python tools/fake_rcd.py --self-test              # esercita RcClient e termina
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeRcd:
+    """In-memory implementation of the rc endpoints used by the application"""
+
+    def __init__(self, host='127.0.0.1', port=0, duration=5.0, total_bytes=100 * 1024 ** 2,
+                 hashes=('md5', 'sha1'), user=None, password=None):
+        self.duration = duration
+        self.total_bytes = total_bytes
+        self.hashes = list(hashes)
+        self.user = user
+        self.password = password
+        self.jobs = {}
+        self.deleted_groups = set()
+        self.pid = os.getpid()
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        """Serve in a background thread and return the base URL"""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def restart(self):
+        """Simulate a daemon restart: jobs forgotten, ids from 1 again, new PID"""
+        with self._lock:
+            self.jobs = {}
+            self.deleted_groups = set()
+            self._next_id = 1
+            self.pid += 1
+
+    # --- Stato dei job ---
+
+    def _job_state(self, job):
+        elapsed = time.time() - job['start']
+        if job['stopped_at'] is not None:
+            elapsed = job['stopped_at'] - job['start']
+        fraction = min(1.0, elapsed / self.duration) if self.duration else 1.0
+        finished = job['stopped_at'] is not None or fraction >= 1.0
+        error = ''
+        if job['stopped_at'] is not None:
+            error = 'context canceled'
+        elif finished and 'fail' in job['srcFs']:
+            error = 'directory not found'
+        return elapsed, fraction, finished, error
+
+    def _stats(self, job):
+        elapsed, fraction, finished, error = self._job_state(job)
+        transferred = int(self.total_bytes * (0.5 if error else fraction))
+        return {
+            'bytes': transferred,
+            'totalBytes': self.total_bytes,
+            'speed': transferred / elapsed if elapsed > 0 else 0,
+            'eta': None if finished else max(0, int(self.duration - elapsed)),
+            'checks': 10 if finished else int(10 * fraction),
+            'totalChecks': 10,
+            'errors': 1 if error and error != 'context canceled' else 0,
+            'transfers': 5 if finished and not error else int(5 * fraction),
+            'totalTransfers': 5,
+            'elapsedTime': elapsed,
+            'lastError': error,
+        }
+
+    def handle(self, path, params):
+        """Dispatch one rc call, returning (http status, response dict)"""
+        with self._lock:
+            if path == 'rc/noop':
+                return 200, params
+
+            if path == 'core/pid':
+                return 200, {'pid': self.pid}
+
+            if path == 'sync/sync':
+                if 'srcFs' not in params or 'dstFs' not in params:
+                    return 400, {'error': 'Didn\'t find key "srcFs" in input', 'status': 400}
+                jobid = self._next_id
+                self._next_id += 1
+                self.jobs[jobid] = {
+                    'id': jobid, 'srcFs': params['srcFs'], 'dstFs': params['dstFs'],
+                    'group': params.get('_group') or f"job/{jobid}",
+                    'config': params.get('_config') or {},
+                    'start': time.time(), 'stopped_at': None,
+                }
+                if params.get('_async'):
+                    return 200, {'jobid': jobid}
+                job = self.jobs[jobid]
+            else:
+                job = None
+
+            if path in ('job/status', 'job/stop'):
+                job = self.jobs.get(params.get('jobid'))
+                if job is None:
+                    # Come rclone: errore generico, non 404
+                    return 500, {'error': 'job not found', 'status': 500, 'path': path}
+                if path == 'job/stop':
+                    if job['stopped_at'] is None and not self._job_state(job)[2]:
+                        job['stopped_at'] = time.time()
+                    return 200, {}
+
+            if job is not None:
+                elapsed, fraction, finished, error = self._job_state(job)
+                return 200, {
+                    'id': job['id'], 'group': job['group'], 'finished': finished,
+                    'success': finished and not error, 'error': error,
+                    'duration': elapsed, 'output': {},
+                }
+
+            if path == 'job/list':
+                return 200, {'jobids': sorted(self.jobs)}
+
+            if path == 'core/stats':
+                group = params.get('group')
+                jobs = [j for j in self.jobs.values() if group is None or j['group'] == group]
+                if not jobs or group in self.deleted_groups:
+                    return 200, {'bytes': 0, 'checks': 0, 'errors': 0, 'transfers': 0, 'speed': 0}
+                return 200, self._stats(jobs[-1])
+
+            if path == 'core/stats-delete':
+                self.deleted_groups.add(params.get('group'))
+                return 200, {}
+
+            if path == 'operations/fsinfo':
+                return 200, {'Name': params.get('fs', '').split(':')[0], 'Hashes': self.hashes, 'Features': {}}
+
+            return 404, {'error': f"couldn't find method \"{path}\"", 'status': 404, 'path': path}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if fake.user:
+                    expected = base64.b64encode(f"{fake.user}:{fake.password or ''}".encode()).decode()
+                    if self.headers.get('Authorization') != f"Basic {expected}":
+                        self._reply(401, {'error': 'authentication required', 'status': 401})
+                        return
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    params = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    self._reply(400, {'error': 'invalid JSON', 'status': 400})
+                    return
+                status, body = fake.handle(self.path.strip('/'), params)
+                self._reply(status, body)
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def self_test():
+    """Run RcClient and RcJobHandle against a fake daemon"""
+    from utils.rc_client import RcClient, RcError, RcJobHandle, rc_lock
+    from utils.progress import JobProgress
+
+    fake = FakeRcd(duration=1.0, user='rcm', password='secret')
+    url = fake.start()
+    try:
+        try:
+            RcClient(url).noop()
+            raise AssertionError("missing credentials were accepted")
+        except RcError as e:
+            assert e.status == 401, e.status
+
+        client = RcClient(url, 'rcm', 'secret', timeout=5)
+        assert client.noop() == {}
+        assert 'md5' in client.fsinfo('remote:')['Hashes']
+
+        progress = JobProgress()
+        ok = RcJobHandle(client, client.sync('src:a', 'dst:b', group='g-ok'), 'g-ok', progress)
+        failing = RcJobHandle(client, client.sync('src:fail', 'dst:b', group='g-fail'), 'g-fail')
+        stopped = RcJobHandle(client, client.sync('src:c', 'dst:d', group='g-stop'), 'g-stop')
+
+        assert ok.refresh() is None and ok.poll() is None
+        stopped.terminate()
+        assert ok.wait(timeout=5, interval=0.1) == 0
+        assert failing.wait(timeout=5, interval=0.1) == 1 and failing.error
+        assert stopped.wait(timeout=5, interval=0.1) < 0
+        assert progress.latest()['percent'] is not None
+
+        try:
+            client.job_status(999)
+            raise AssertionError("unknown job did not fail")
+        except RcError as e:
+            assert e.status == 500 and e.job_not_found, e.status
+        lost = RcJobHandle(client, 999, 'g-lost')
+        assert lost.refresh() == 1 and lost.error
+
+        # Dopo un riavvio gli id ripartono da 1: il lock del vecchio job non vale più
+        lock = rc_lock(ok.jobid, client.daemon_pid())
+        assert client.job_from_lock(lock) == ok.jobid
+        fake.restart()
+        client.sync('src:e', 'dst:f', group='g-new')
+        assert client.job_from_lock(lock) is None
+        assert client.job_from_lock(f"rc:{ok.jobid}") is None
+        print("fake rcd self-test passed")
+    finally:
+        fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in for rclone rcd")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5572)
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds each fake sync runs")
+    parser.add_argument('--user', help="Require basic auth with this user")
+    parser.add_argument('--password', help="Password for --user")
+    parser.add_argument('--self-test', action='store_true', help="Exercise RcClient and exit")
+    args = parser.parse_args()
+
+    if args.self_test:
+        self_test()
+        return
+
+    fake = FakeRcd(args.host, args.port, duration=args.duration, user=args.user, password=args.password)
+    print(f"Fake rclone rcd listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+History-driven autotuning of --transfers/--checkers per pair of remotes.
+
+Un valore fisso (4 transfers, 8 checkers) è troppo basso tra object store e
+troppo alto per alcuni backend WebDAV/SFTP. Qui, per ogni coppia (remote
+sorgente, remote destinazione), si registra il throughput dei job completati
+con ciascun parallelismo usato (tabella transfer_tuning, aggiornata nella
+stessa transazione in cui il job termina dal listener di utils/job_stats.py,
+insieme a job_run_stats) e si sceglie
+il parallelismo dei job successivi con una ricerca hill climbing:
+
+- si parte da un valore dipendente dal tipo di backend;
+- ogni valore viene misurato su MIN_RUNS job prima di essere giudicato;
+- dal migliore si prova il gradino successivo della scala e poi il
+  precedente; un valore più alto viene adottato solo se migliora il
+  throughput di almeno il 10%;
+- limiti per tipo di backend, valori con molti errori esclusi e misure più
+  vecchie di STALE_AFTER riverificate.
+
+I checkers seguono i transfers (il doppio, almeno 8), quindi la ricerca è su
+una sola dimensione. I job pianificati possono forzare entrambi i valori. I job
+avviati con una quota di banda (--bwlimit, vedi utils/bandwidth.py) non sono
+misure valide e vengono ignorati.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, select, insert, update
+
+from models import TransferTuning
+from utils.remote_inventory import remote_inventory, split_remote
+
+logger = logging.getLogger(__name__)
+
+# Valori di --transfers esplorati
+TRANSFER_LADDER = (1, 2, 4, 8, 16, 32, 64)
+
+# Valori usati prima dell'autotuning e per i backend sconosciuti
+DEFAULT_TRANSFERS = 4
+MIN_CHECKERS = 8
+MAX_CHECKERS = 128
+
+# Tipo di backend -> (valore iniziale, massimo) di --transfers
+BACKEND_LIMITS = {
+    's3': (16, 64),
+    'google cloud storage': (16, 64),
+    'azureblob': (16, 64),
+    'b2': (16, 64),
+    'swift': (16, 32),
+    'oracleobjectstorage': (16, 64),
+    'qingstor': (16, 32),
+    'storj': (16, 32),
+    'local': (16, 64),
+    # Backend con limiti di richieste per utente o server singoli
+    'drive': (4, 8),
+    'onedrive': (4, 8),
+    'dropbox': (4, 8),
+    'box': (4, 8),
+    'pcloud': (4, 8),
+    'webdav': (4, 8),
+    'sftp': (4, 8),
+    'smb': (4, 8),
+    'ftp': (2, 4),
+}
+UNKNOWN_LIMITS = (DEFAULT_TRANSFERS, 16)
+
+# Job completati necessari per giudicare un valore
+MIN_RUNS = 2
+
+# Job con meno byte trasferiti non sono misure utili (dominati dai controlli)
+MIN_SAMPLE_BYTES = 64 * 1024 * 1024
+
+# Guadagno minimo perché un valore più alto sia preferito
+IMPROVEMENT = 1.10
+
+# Peso dell'ultima misura nella media mobile del throughput
+EWMA_ALPHA = 0.3
+
+# Valori con almeno MIN_RUNS errori e questa quota di errori vengono esclusi
+MAX_ERROR_RATE = 0.5
+
+# Misure più vecchie vengono ripetute (il collegamento o il backend possono cambiare)
+STALE_AFTER = timedelta(days=30)
+
+
+def checkers_for(transfers):
+    """Return the --checkers value used with a --transfers value"""
+    return min(MAX_CHECKERS, max(MIN_CHECKERS, 2 * transfers))
+
+
+def backend_limits(src_remote, dst_remote):
+    """Return (start, maximum) --transfers for a pair of remotes ('' for local paths)"""
+    start, maximum = None, None
+    for remote in (src_remote, dst_remote):
+        remote_type = remote_inventory.remote_type(remote, resolve=True) if remote else 'local'
+        remote_start, remote_max = BACKEND_LIMITS.get(remote_type, UNKNOWN_LIMITS)
+        start = remote_start if start is None else min(start, remote_start)
+        maximum = remote_max if maximum is None else min(maximum, remote_max)
+    return min(start, maximum), maximum
+
+
+def pair_remotes(source, target):
+    """Return (source remote, target remote) of a job, '' for local paths"""
+    return split_remote(source)[0] or '', split_remote(target)[0] or ''
+
+
+def _is_bad(row):
+    return row.errors >= MIN_RUNS and row.errors / (row.runs + row.errors) >= MAX_ERROR_RATE
+
+
+def _is_measured(row, now):
+    return (row.runs >= MIN_RUNS and row.throughput is not None
+            and row.last_run is not None and now - row.last_run < STALE_AFTER)
+
+
+def plan(rows, start, maximum, now=None):
+    """Choose the next --transfers value from the measurements of a pair
+
+    Args:
+        rows: TransferTuning rows of the pair
+        start: Initial value for the backend types
+        maximum: Upper guardrail for the backend types
+        now: Current time (for the stale measurements)
+
+    Returns:
+        tuple: (transfers, reason)
+    """
+    now = now or datetime.now()
+    ladder = [value for value in TRANSFER_LADDER if value <= maximum] or [TRANSFER_LADDER[0]]
+    start = max(value for value in ladder if value <= start) if start >= ladder[0] else ladder[0]
+    by_value = {row.transfers: row for row in rows
+                if row.transfers in ladder and row.checkers == checkers_for(row.transfers)}
+
+    bad = {value for value, row in by_value.items() if _is_bad(row)}
+    measured = {value: by_value[value].throughput for value in ladder
+                if value in by_value and value not in bad and _is_measured(by_value[value], now)}
+
+    if not measured:
+        if start not in bad:
+            return start, "valore iniziale per il tipo di backend"
+        # Troppi errori anche al valore iniziale: si scende sotto il più basso con errori
+        lower = [value for value in ladder if value < min(bad)]
+        return (lower[-1] if lower else ladder[0]), "riduzione dopo errori"
+
+    # Il più basso tra quelli entro il 10% del migliore: a parità si preferisce meno carico
+    top = max(measured.values())
+    best = min(value for value, throughput in measured.items() if throughput * IMPROVEMENT >= top)
+
+    index = ladder.index(best)
+    up = ladder[index + 1] if index + 1 < len(ladder) else None
+    down = ladder[index - 1] if index > 0 else None
+    if up is not None and up not in bad and up not in measured:
+        return up, f"prova di {up} (migliore finora {best})"
+    if down is not None and down not in bad and down not in measured:
+        return down, f"prova di {down} (migliore finora {best})"
+    return best, "migliore misurato"
+
+
+def choose(source, target):
+    """Return the autotuned (transfers, checkers, reason) for a job
+
+    Da chiamare dentro un app context.
+    """
+    src_remote, dst_remote = pair_remotes(source, target)
+    start, maximum = backend_limits(src_remote, dst_remote)
+    rows = TransferTuning.query.filter_by(src_remote=src_remote, dst_remote=dst_remote).all()
+    transfers, reason = plan(rows, start, maximum)
+    return transfers, checkers_for(transfers), reason
+
+
+def _record(connection, job):
+    """Add a finished job to the transfer_tuning row of its parallelism"""
+    src_remote, dst_remote = pair_remotes(job.source, job.target)
+    table = TransferTuning.__table__
+    key = dict(src_remote=src_remote, dst_remote=dst_remote, transfers=job.transfers, checkers=job.checkers)
+
+    values = {}
+    if job.status == 'error':
+        values['errors'] = table.c.errors + 1
+    else:
+        duration = (job.end_time - job.start_time).total_seconds() if job.end_time and job.start_time else 0
+        if not job.transferred_bytes or job.transferred_bytes < MIN_SAMPLE_BYTES or duration <= 0:
+            return
+        throughput = job.transferred_bytes / duration
+        values.update(runs=table.c.runs + 1,
+                      transferred_bytes=table.c.transferred_bytes + job.transferred_bytes,
+                      seconds=table.c.seconds + duration,
+                      throughput=case((table.c.throughput.is_(None), throughput),
+                                         else_=table.c.throughput * (1 - EWMA_ALPHA) + throughput * EWMA_ALPHA))
+    values['last_run'] = job.end_time or datetime.now()
+
+    row_id = connection.execute(
+        select(table.c.id).where(*[table.c[name] == value for name, value in key.items()])
+    ).scalar()
+    if row_id is None:
+        row_id = connection.execute(insert(table).values(
+            runs=0, errors=0, transferred_bytes=0, seconds=0, **key)).inserted_primary_key[0]
+    connection.execute(update(table).where(table.c.id == row_id).values(**values))
+
+
+def is_sample(job, previous_status):
+    """True if a history row that changed from previous_status is a throughput sample"""
+    if previous_status != 'running' or job.status not in ('completed', 'error'):
+        return False
+    # Con una quota di banda il throughput misura il budget, non il parallelismo
+    return not job.dry_run and job.transfers is not None and not job.bwlimit
+
+
+def record_samples(connection, jobs):
+    """Add finished jobs to the transfer_tuning rows, inside the current transaction
+
+    Chiamata dal listener after_flush di utils/job_stats.py per i job per cui
+    is_sample è vero.
+    """
+    for job in jobs:
+        _record(connection, job)
+
+
+def tuning_snapshot():
+    """Measurements and next choice of every pair of remotes, for the API (inside an app context)"""
+    pairs = {}
+    for row in TransferTuning.query.order_by(TransferTuning.src_remote, TransferTuning.dst_remote,
+                                             TransferTuning.transfers).all():
+        pairs.setdefault((row.src_remote, row.dst_remote), []).append(row)
+    result = []
+    for (src_remote, dst_remote), rows in pairs.items():
+        start, maximum = backend_limits(src_remote, dst_remote)
+        transfers, reason = plan(rows, start, maximum)
+        result.append({
+            'src_remote': src_remote,
+            'dst_remote': dst_remote,
+            'limits': {'start': start, 'max': maximum},
+            'next': {'transfers': transfers, 'checkers': checkers_for(transfers), 'reason': reason},
+            'settings': [row.to_dict() for row in rows],
+        })
+    return result
@@ -51,6 +51,37 @@ def get_db_path(app):
     logger.debug(f"Database path resolved to: {db_path}")
     return db_path
 
+def checkpoint_wal(db_path):
+    """
+    Move the content of the WAL file into the main database file.
+    
+    Con journal_mode=WAL i commit recenti stanno in <db>-wal finché non c'è un
+    checkpoint: una copia del solo file del database li perderebbe, e un file
+    ripristinato sotto un WAL non vuoto verrebbe sovrascritto dai suoi frame.
+    
+    Args:
+        db_path: Path to the SQLite database file
+        
+    Returns:
+        bool: True if the WAL was fully checkpointed (or there is no WAL)
+    """
+    if not os.path.exists(db_path + '-wal'):
+        return True
+    try:
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        finally:
+            conn.close()
+        if busy:
+            logger.warning(f"WAL checkpoint of {db_path} incomplete ({checkpointed}/{log_frames} frames)")
+            return False
+        logger.debug(f"WAL checkpoint of {db_path} completed ({checkpointed} frames)")
+        return True
+    except Exception as e:
+        logger.error(f"Error during WAL checkpoint of {db_path}: {str(e)}")
+        return False
+
 def get_backup_dir(app):
     """
     Get the backup directory, creating it if it doesn't exist.
@@ -99,6 +130,9 @@ def create_backup(app, backup_name=None):
         # Usa shutil.copy2 invece della funzione backup di SQLite per compatibilità universale
         # Prima verifica che il database non sia in uso (si spera che sia in sola lettura durante il backup)
         try:
+            # I commit recenti sono nel file WAL: li riportiamo nel database prima della copia
+            if not checkpoint_wal(db_path):
+                raise RuntimeError("WAL checkpoint incomplete, database in use")
             shutil.copy2(db_path, db_backup_path)
             logger.info(f"Database backup created at {db_backup_path} using file copy")
         except Exception as copy_error:
@@ -277,10 +311,21 @@ def restore_backup(app, backup_name):
     except Exception as e:
         logger.warning(f"Failed to create pre-restore backup: {str(e)}")
     
+    # Il writer tiene aperta una connessione dedicata: va chiusa prima di sostituire il file
+    try:
+        from utils.db_writer import db_writer
+        db_writer.reset()
+    except Exception as e:
+        logger.warning(f"Could not close the database writer connection: {str(e)}")
+    
     # Restore database
     try:
         # Prova prima con il metodo più semplice: copia diretta del file
         try:
+            # Il WAL deve essere vuoto: altrimenti i suoi frame verrebbero applicati al file ripristinato
+            if not checkpoint_wal(db_path):
+                raise RuntimeError("WAL checkpoint incomplete, database in use")
+            
             # Prima crea una copia di sicurezza
             temp_backup = f"{db_path}.before_restore"
             shutil.copy2(db_path, temp_backup)
@@ -349,6 +394,14 @@ def restore_backup(app, backup_name):
             logger.info(f"Database restored from {db_backup_path} using SQL export/import")
         
         logger.info(f"Database restored successfully from {db_backup_path}")
+        
+        # Le connessioni aperte nel pool hanno in cache le pagine del vecchio database
+        try:
+            from models import db
+            with app.app_context():
+                db.engine.dispose()
+        except Exception as e:
+            logger.warning(f"Could not reset database connections after restore: {str(e)}")
     except Exception as e:
         logger.error(f"Error restoring database: {str(e)}")
         return False
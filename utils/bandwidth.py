@@ -0,0 +1,489 @@
+"""
+Cooperative bandwidth budgets shared by the running rclone jobs.
+
+Senza --bwlimit due sync verso lo stesso remote si dividono la banda in modo
+imprevedibile e saturano il collegamento. Qui si configurano un budget globale
+e budget per remote (in UserSettings, con fasce orarie che li sostituiscono),
+che vengono divisi tra i job in esecuzione in modo equo (max-min): un job
+limitato da un remote lento lascia agli altri la sua parte del budget globale.
+
+Applicazione dei limiti:
+
+- modalità a processi: il job parte con --bwlimit già calcolato e con un
+  server rc privato (--rc su una porta locale, utente e password casuali
+  passati per variabile d'ambiente, mai nei log). Endpoint e credenziali sono
+  salvati in un file nella instance folder, così qualsiasi processo
+  (worker gunicorn o scheduler) può ribilanciare i limiti con core/bwlimit
+  quando un job parte o termina, senza riavviare rclone;
+- modalità rcd: il limite di banda del daemon è unico, quindi core/bwlimit
+  viene impostato alla somma delle quote dei job.
+
+Un thread ribilancia anche periodicamente, per applicare i cambi di fascia
+oraria e i job terminati in altri processi.
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import socket
+import hashlib
+import logging
+import secrets
+import threading
+from datetime import datetime
+
+from utils.rc_client import RcClient, RcError
+from utils.remote_inventory import split_remote
+
+logger = logging.getLogger(__name__)
+
+# Intervallo del ribilanciamento periodico (secondi)
+REBALANCE_INTERVAL = 60
+
+# Quota minima di un job: nessun job viene fermato del tutto
+MIN_RATE = 64 * 1024
+
+# Un file rc più recente di così vale come job in esecuzione anche se la
+# riga della cronologia non è ancora stata scritta
+REGISTER_GRACE = 120
+
+# Timeout delle chiamate core/bwlimit ai processi rclone
+RC_TIMEOUT = 5
+
+RATE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)\s*([bkmgt]?)(?:i?b)?(?:/s)?$', re.IGNORECASE)
+RATE_UNITS = {'b': 1, '': 1024, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+WINDOW_PATTERN = re.compile(r'^([01]?\d|2[0-3]):([0-5]\d)-([01]?\d|2[0-4]):([0-5]\d)$')
+
+
+def parse_rate(value):
+    """Parse an rclone bandwidth value ("10M", "512k", "1.5G", "off") into bytes per second
+
+    Come per --bwlimit, senza unità il valore è in KiB/s e le unità sono in base 1024.
+
+    Returns:
+        int or None: Bytes per second, None for no limit ("", "off", "0")
+
+    Raises:
+        ValueError: If the value is not a valid rate
+    """
+    value = str(value or '').strip()
+    if value.lower() in ('', 'off', '0'):
+        return None
+    match = RATE_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"Valore di banda non valido: '{value}' (es. 512K, 10M, 1G)")
+    rate = int(float(match.group(1)) * RATE_UNITS[match.group(2).lower()])
+    return rate or None
+
+
+def format_rate(rate):
+    """Format bytes per second as an rclone --bwlimit value (KiB/s), "off" for None"""
+    if rate is None:
+        return 'off'
+    return f"{max(1, int(rate) // 1024)}K"
+
+
+def parse_remote_budgets(text):
+    """Parse one "remote rate" per line into {remote: rate string}
+
+    Raises:
+        ValueError: With the offending line
+    """
+    budgets = {}
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.replace('=', ' ').split()
+        if len(parts) != 2:
+            raise ValueError(f"Riga {number}: atteso 'remote valore'")
+        remote, rate = parts[0].rstrip(':'), parts[1]
+        parse_rate(rate)
+        budgets[remote] = rate
+    return budgets
+
+
+def parse_schedule(text):
+    """Parse time-of-day budget windows, one per line: "08:00-18:00 global=5M remote=2M"
+
+    Una fascia con fine precedente all'inizio attraversa la mezzanotte.
+
+    Returns:
+        list: [{'start': 'HH:MM', 'end': 'HH:MM', 'global': rate or None, 'remotes': {...}}]
+
+    Raises:
+        ValueError: With the offending line
+    """
+    windows = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split()
+        match = WINDOW_PATTERN.match(parts[0])
+        if not match:
+            raise ValueError(f"Riga {number}: fascia oraria non valida '{parts[0]}' (es. 08:00-18:00)")
+        window = {'start': f"{int(match.group(1)):02d}:{match.group(2)}",
+                  'end': f"{int(match.group(3)):02d}:{match.group(4)}",
+                  'global': None, 'remotes': {}}
+        for part in parts[1:]:
+            if '=' not in part:
+                raise ValueError(f"Riga {number}: atteso 'global=valore' o 'remote=valore', trovato '{part}'")
+            name, rate = part.split('=', 1)
+            parse_rate(rate)
+            if name == 'global':
+                window['global'] = rate
+            else:
+                window['remotes'][name.rstrip(':')] = rate
+        windows.append(window)
+    return windows
+
+
+def format_remote_budgets(budgets):
+    """Inverse of parse_remote_budgets, for the settings form"""
+    return '\n'.join(f"{remote} {rate}" for remote, rate in sorted((budgets or {}).items()))
+
+
+def format_schedule(windows):
+    """Inverse of parse_schedule, for the settings form"""
+    lines = []
+    for window in windows or []:
+        parts = [f"{window['start']}-{window['end']}"]
+        if window.get('global'):
+            parts.append(f"global={window['global']}")
+        parts.extend(f"{remote}={rate}" for remote, rate in sorted(window.get('remotes', {}).items()))
+        lines.append(' '.join(parts))
+    return '\n'.join(lines)
+
+
+def _in_window(window, now):
+    current = now.strftime('%H:%M')
+    start, end = window['start'], window['end']
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def get_bandwidth_budgets(settings, now=None):
+    """Return the budgets active now: (global rate or None, {remote: rate})
+
+    Args:
+        settings: UserSettings.settings dictionary
+        now: datetime used for the time-of-day windows (default: now)
+    """
+    now = now or datetime.now()
+    global_rate = settings.get('bandwidth_global') or None
+    remotes = dict(settings.get('bandwidth_remotes') or {})
+    # Le fasce orarie attive sostituiscono i valori base che specificano
+    for window in settings.get('bandwidth_schedule') or []:
+        if _in_window(window, now):
+            if window.get('global'):
+                global_rate = window['global']
+            remotes.update(window.get('remotes') or {})
+    try:
+        parsed_global = parse_rate(global_rate)
+    except ValueError:
+        parsed_global = None
+    parsed_remotes = {}
+    for remote, rate in remotes.items():
+        try:
+            parsed = parse_rate(rate)
+        except ValueError:
+            continue
+        if parsed is not None:
+            parsed_remotes[remote] = parsed
+    return parsed_global, parsed_remotes
+
+
+def budgets_configured(settings):
+    """True if any bandwidth budget is set, now or in a time-of-day window"""
+    return bool(settings.get('bandwidth_global') or settings.get('bandwidth_remotes')
+                or settings.get('bandwidth_schedule'))
+
+
+def allocate(pairs, global_rate, remote_rates):
+    """Split the budgets among the running jobs with max-min fairness
+
+    Ad ogni passo il vincolo con la quota per job più bassa fissa i suoi job a
+    quella quota; il resto dei budget viene ridiviso tra i job rimanenti.
+
+    Args:
+        pairs: (source, target) of the running jobs
+        global_rate: Global budget in bytes per second, or None
+        remote_rates: {remote: budget in bytes per second}
+
+    Returns:
+        dict: (source, target) -> bytes per second, None for jobs without limits
+    """
+    pairs = list(dict.fromkeys(pairs))
+    constraints = []
+    if global_rate:
+        constraints.append([global_rate, set(pairs)])
+    for remote, rate in remote_rates.items():
+        members = set()
+        for source, target in pairs:
+            if remote in (split_remote(source)[0], split_remote(target)[0]):
+                members.add((source, target))
+        if members:
+            constraints.append([rate, members])
+
+    result = {pair: None for pair in pairs}
+    unfixed = {pair for constraint in constraints for pair in constraint[1]}
+    while unfixed:
+        share, members = min(((capacity / len(members & unfixed), members)
+                              for capacity, members in constraints if members & unfixed),
+                             key=lambda item: item[0])
+        fixed = members & unfixed
+        for pair in fixed:
+            result[pair] = max(MIN_RATE, int(share))
+        for constraint in constraints:
+            constraint[0] = max(0, constraint[0] - share * len(constraint[1] & fixed))
+        unfixed -= fixed
+    return result
+
+
+def _free_port():
+    """Return a free local TCP port for the rc server of a job"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _process_alive(host, pid):
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except (TypeError, ValueError, PermissionError):
+        return True
+
+
+class BandwidthManager:
+    """Bandwidth budgets split among the running jobs and applied through rclone rc"""
+
+    def __init__(self):
+        self.state_dir = None
+        self._running = None
+        self._settings = None
+        self._daemon = None
+        self._daemon_rate = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def open(self, state_dir, running, settings, daemon=None):
+        """Configure the manager
+
+        Args:
+            state_dir: Directory of the rc endpoint files shared by the processes
+            running: Function returning the (source, target) pairs of the running jobs
+            settings: Function returning the UserSettings.settings dictionary
+            daemon: RcClient of the rclone rcd daemon, in rcd mode
+        """
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_dir = state_dir
+        self._running = running
+        self._settings = settings
+        self._daemon = daemon
+
+    def start(self):
+        """Start the rebalancing thread"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="bandwidth")
+                self._thread.start()
+
+    def wake(self):
+        """Ask for a rebalance now (a job started or finished, the budgets changed)"""
+        self._wake.set()
+
+    def enabled(self):
+        """True if budgets are configured (jobs then start with an rc endpoint)"""
+        if self._settings is None:
+            return False
+        try:
+            return budgets_configured(self._settings())
+        except Exception as e:
+            logger.error(f"Error reading bandwidth settings: {str(e)}")
+            return False
+
+    def _path(self, source, target):
+        digest = hashlib.sha1(f"{source}\t{target}".encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.state_dir, f"{digest}.json")
+
+    def _registered(self):
+        """Return {pair: (path, data)} of the rc endpoint files, removing those of dead processes"""
+        registered = {}
+        if not self.state_dir:
+            return registered
+        for name in os.listdir(self.state_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.state_dir, name)
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not _process_alive(data.get('host'), data.get('pid')):
+                self._remove(path)
+                continue
+            registered[(data['source'], data['target'])] = (path, data)
+        return registered
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _allocation(self, extra=None):
+        """Compute the current allocation, optionally counting a job about to start
+
+        Returns:
+            tuple: ({pair: rate or None}, registered rc endpoints)
+        """
+        registered = self._registered()
+        pairs = [(source.strip(), target.strip()) for source, target in self._running()]
+        # Job appena avviati, non ancora nella cronologia
+        now = time.time()
+        pairs += [pair for pair, (_, data) in registered.items()
+                  if now - data.get('registered_at', 0) < REGISTER_GRACE]
+        if extra is not None:
+            pairs.append(extra)
+        global_rate, remote_rates = get_bandwidth_budgets(self._settings())
+        return allocate(pairs, global_rate, remote_rates), registered
+
+    def launch_limit(self, source, target):
+        """Return the share (rclone rate) of a job about to start, None if unlimited"""
+        if not self.enabled():
+            return None
+        try:
+            allocation, _ = self._allocation(extra=(source, target))
+            rate = allocation.get((source, target))
+        except Exception as e:
+            logger.error(f"Error computing the bandwidth limit of {source} → {target}: {str(e)}")
+            rate = None
+        return format_rate(rate) if rate else None
+
+    def launch_options(self, source, target):
+        """Return the bandwidth options of a job about to start as a separate process
+
+        Returns:
+            dict or None: {'bwlimit': rclone rate or None, 'rc_addr', 'rc_user', 'rc_pass'}
+                or None when no budget is configured
+        """
+        if not self.enabled():
+            return None
+        return {
+            'bwlimit': self.launch_limit(source, target),
+            'rc_addr': f"127.0.0.1:{_free_port()}",
+            'rc_user': secrets.token_hex(8),
+            'rc_pass': secrets.token_urlsafe(24),
+        }
+
+    def register(self, source, target, options, pid):
+        """Save the rc endpoint of a started job (file readable only by the owner)"""
+        path = self._path(source, target)
+        data = {
+            'source': source,
+            'target': target,
+            'url': f"http://{options['rc_addr']}/",
+            'user': options['rc_user'],
+            'password': options['rc_pass'],
+            'rate': options['bwlimit'] or 'off',
+            'host': socket.gethostname(),
+            'pid': pid,
+            'registered_at': time.time(),
+        }
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+        except Exception as e:
+            logger.error(f"Error saving the rc endpoint of {source} → {target}: {str(e)}")
+        self.wake()
+
+    def unregister(self, source, target):
+        """Forget the rc endpoint of a finished job and give its share to the others"""
+        if self.state_dir:
+            self._remove(self._path(source, target))
+        self.wake()
+
+    def rebalance(self):
+        """Recompute the shares and push the changed ones with core/bwlimit
+
+        Returns:
+            dict: (source, target) -> applied rclone rate
+        """
+        if self._settings is None:
+            return {}
+        applied = {}
+        lock_file = open(os.path.join(self.state_dir, 'rebalance.lock'), 'w')
+        try:
+            # Un solo processo alla volta legge e riscrive i file rc
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            allocation, registered = self._allocation()
+            for pair, (path, data) in registered.items():
+                rate = format_rate(allocation.get(pair))
+                applied[pair] = rate
+                if rate == data.get('rate'):
+                    continue
+                try:
+                    client = RcClient(data['url'], data['user'], data['password'], timeout=RC_TIMEOUT)
+                    client.call('core/bwlimit', rate=rate)
+                    data['rate'] = rate
+                    with open(path, 'w') as f:
+                        json.dump(data, f)
+                    logger.info(f"Bandwidth limit of {pair[0]} → {pair[1]} set to {rate}")
+                except RcError as e:
+                    # Il processo può essere appena terminato o non aver ancora aperto la porta
+                    logger.warning(f"Could not set the bandwidth limit of {pair[0]} → {pair[1]}: {str(e)}")
+
+            if self._daemon is not None:
+                # Il daemon ha un solo limite: la somma delle quote dei job
+                rates = list(allocation.values())
+                rate = format_rate(sum(rates)) if rates and None not in rates else 'off'
+                if rate != self._daemon_rate:
+                    try:
+                        self._daemon.call('core/bwlimit', rate=rate)
+                        self._daemon_rate = rate
+                        logger.info(f"Bandwidth limit of the rclone daemon set to {rate}")
+                    except RcError as e:
+                        logger.warning(f"Could not set the bandwidth limit of the rclone daemon: {str(e)}")
+        finally:
+            lock_file.close()
+        return applied
+
+    def snapshot(self):
+        """Active budgets and current share of each running job, for the API"""
+        global_rate, remote_rates = get_bandwidth_budgets(self._settings())
+        allocation, registered = self._allocation()
+        return {
+            'global': format_rate(global_rate) if global_rate else None,
+            'remotes': {remote: format_rate(rate) for remote, rate in remote_rates.items()},
+            'jobs': [{'source': source, 'target': target,
+                      'share': format_rate(rate) if rate else None,
+                      'applied': registered[(source, target)][1].get('rate')
+                      if (source, target) in registered else None}
+                     for (source, target), rate in allocation.items()],
+        }
+
+    def _run(self):
+        """Rebalancing loop"""
+        while True:
+            self._wake.wait(REBALANCE_INTERVAL)
+            self._wake.clear()
+            try:
+                self.rebalance()
+            except Exception as e:
+                logger.error(f"Error rebalancing bandwidth: {str(e)}")
+
+
+# Istanza globale condivisa dall'applicazione
+bandwidth_manager = BandwidthManager()
@@ -0,0 +1,135 @@
+"""
+Database migrations for RClone Manager.
+
+db.create_all() crea solo le tabelle mancanti: le colonne aggiunte ai modelli
+dopo la creazione del database vengono aggiunte qui con ALTER TABLE, e gli
+indici dichiarati nei modelli con CREATE INDEX IF NOT EXISTS, così un database
+esistente continua a funzionare senza perdere dati.
+
+Qui è anche configurata ogni connessione SQLite (WAL e PRAGMA di tuning).
+"""
+import logging
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.schema import CreateIndex
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA applicati a ogni nuova connessione SQLite:
+# - synchronous=NORMAL: con WAL è sicuro contro i crash dell'applicazione e
+#   evita un fsync a ogni commit (solo un crash del sistema può perdere gli
+#   ultimi commit, mai corrompere il database)
+# - busy_timeout: attende i lock degli altri processi (worker gunicorn,
+#   scheduler) invece di fallire subito con "database is locked"
+# - cache_size negativo: KiB di cache delle pagine per connessione
+# - temp_store=MEMORY: ordinamenti e tabelle temporanee in memoria
+SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'busy_timeout': 10000,
+    'cache_size': -16000,
+    'temp_store': 'MEMORY',
+}
+
+
+def configure_sqlite(engine, pragmas=None):
+    """Enable WAL and apply the tuning PRAGMAs on every connection of a SQLite engine
+
+    Args:
+        engine: SQLAlchemy engine (ignored if it is not SQLite)
+        pragmas: Optional dict overriding SQLITE_PRAGMAS
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = dict(SQLITE_PRAGMAS, **(pragmas or {}))
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # journal_mode=WAL è persistente nel file: dopo la prima volta è un no-op
+            mode = cursor.execute('PRAGMA journal_mode=WAL').fetchone()
+            if mode and str(mode[0]).lower() != 'wal':
+                logger.warning(f"SQLite journal mode is {mode[0]}, WAL could not be enabled")
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        except Exception as e:
+            logger.error(f"Error configuring SQLite connection: {str(e)}")
+        finally:
+            cursor.close()
+
+    # Le connessioni già aperte nel pool non hanno i PRAGMA: le chiudiamo
+    engine.dispose()
+
+
+def ensure_schema(db):
+    """Add to existing tables the nullable columns declared in the models but missing on disk
+
+    Args:
+        db: Flask-SQLAlchemy instance (to be called inside an app context)
+
+    Returns:
+        list: Names of the columns added, as "table.column"
+    """
+    added = []
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    # SQLite non permette di aggiungere colonne NOT NULL senza default
+                    logger.error(f"Cannot add NOT NULL column {table.name}.{column.name} to an existing table")
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                added.append(f"{table.name}.{column.name}")
+
+    if added:
+        logger.info(f"Database schema updated, added columns: {', '.join(added)}")
+    return added
+
+
+def ensure_indexes(db):
+    """Create the indexes declared in the models but missing on disk
+
+    Usa CREATE INDEX IF NOT EXISTS, quindi è sicuro anche se più processi
+    (worker gunicorn e scheduler) avviano la migrazione insieme. Sulle tabelle
+    grandi la creazione richiede qualche secondo; al termine ANALYZE aggiorna le
+    statistiche usate dal query planner.
+
+    Args:
+        db: Flask-SQLAlchemy instance (to be called inside an app context)
+
+    Returns:
+        list: Names of the indexes created
+    """
+    created = []
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+                created.append(index.name)
+            except Exception as e:
+                # Un indice mancante rallenta le query ma non impedisce l'avvio
+                logger.error(f"Error creating index {index.name}: {str(e)}")
+
+    if created:
+        with db.engine.begin() as conn:
+            conn.execute(text('ANALYZE'))
+        logger.info(f"Database indexes created: {', '.join(created)}")
+    return created
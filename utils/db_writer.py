@@ -0,0 +1,325 @@
+"""
+Single database writer for RClone Manager.
+
+I thread di monitoraggio dei job, lo scheduler, il reconciler e le richieste
+Flask non fanno più commit indipendenti sullo stesso file SQLite: le scritture
+(aggiornamenti di stato, notifiche, inserimenti nella history) vengono messe
+in coda e un solo thread per processo le esegue raggruppandole in transazioni
+(fino a MAX_BATCH operazioni, attendendo al massimo MAX_DELAY secondi le
+operazioni successive).
+
+Ogni operazione restituisce un Future che si risolve dopo il commit: chi ha
+bisogno di rileggere i propri dati (read-your-writes) chiama .result() prima
+di leggere. Con il driver pysqlite le SELECT non aprono una transazione, quindi
+una lettura successiva vede sempre il commit.
+
+Se una transazione fallisce, le operazioni del gruppo vengono ripetute una per
+volta, così l'errore arriva solo al Future dell'operazione che lo ha causato.
+
+Il writer usa una connessione dedicata, fuori dal pool di SQLAlchemy: i thread
+che aspettano un Future tenendo occupata una connessione del pool non possono
+bloccarlo.
+"""
+import os
+import sys
+import queue
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+logger = logging.getLogger(__name__)
+
+# Operazioni massime per transazione
+MAX_BATCH = 200
+
+# Attesa massima per raggruppare operazioni arrivate quasi insieme (secondi)
+MAX_DELAY = 0.02
+
+# Attesa massima di chi chiede il risultato di una scrittura (secondi)
+WRITE_TIMEOUT = 30
+
+
+class DbWriter:
+    """Queue of write operations executed in batched transactions by one thread"""
+
+    def __init__(self, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        """Initialize the writer (the thread is started at the first write)
+
+        Args:
+            max_batch: Maximum operations per transaction
+            max_delay: Seconds to wait for more operations before committing
+        """
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._app = None
+        self._db = None
+        self._connection = None
+        self._session = None
+        self._closing = []
+
+    def init_app(self, app, db):
+        """Bind the writer to the Flask app and the Flask-SQLAlchemy instance"""
+        self._app = app
+        self._db = db
+
+    def _resolve_app(self):
+        if self._app is None:
+            # Import diretto dell'app Flask, come negli altri moduli di utils
+            app_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+            if app_dir not in sys.path:
+                sys.path.insert(0, app_dir)
+            from app import app
+            from models import db
+            self._app, self._db = app, db
+        return self._app, self._db
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="db-writer")
+                self._thread.start()
+
+    def submit(self, operation):
+        """Queue operation(session) -> result; return a Future resolved after the commit
+
+        Dal thread del writer stesso (es. dentro un'altra operazione) l'operazione
+        viene eseguita subito nella transazione corrente, per evitare un deadlock.
+        """
+        future = Future()
+        if threading.current_thread() is self._thread:
+            future.set_result(operation(self._session))
+            return future
+        self._ensure_started()
+        self._queue.put((operation, future))
+        return future
+
+    def insert(self, model, result=None, **values):
+        """Insert a row
+
+        Args:
+            model: Model class
+            result: Optional callable(instance) computing the Future's result
+                inside the transaction (default: the primary key)
+            **values: Column values
+
+        Returns:
+            Future: Resolved with the primary key (or result(instance))
+        """
+        def operation(session):
+            instance = model(**values)
+            session.add(instance)
+            session.flush()
+            return result(instance) if result else inspect(instance).identity[0]
+        return self.submit(operation)
+
+    def update(self, model, ident, **values):
+        """Update the columns of the row with primary key ident
+
+        Returns:
+            Future: Resolved with True if the row exists, False otherwise
+        """
+        def operation(session):
+            instance = session.get(model, ident)
+            if instance is None:
+                return False
+            for key, value in values.items():
+                setattr(instance, key, value)
+            return True
+        return self.submit(operation)
+
+    def call(self, func):
+        """Run func(session) inside a writer transaction
+
+        Returns:
+            Future: Resolved with the return value of func
+        """
+        return self.submit(func)
+
+    def save(self, instance):
+        """Write the pending column changes of an instance loaded in another session
+
+        Le modifiche vengono segnate come già salvate nella sessione del
+        chiamante, che quindi non le riscriverà al proprio commit.
+
+        Returns:
+            Future: Resolved with True if the row exists (None if nothing changed)
+        """
+        values = _pending_changes(instance)
+        if not values:
+            future = Future()
+            future.set_result(None)
+            return future
+        return self.update(type(instance), inspect(instance).identity[0], **values)
+
+    def commit_changes(self, session):
+        """Write the pending changes of all the modified instances of a session in one operation
+
+        Sostituisce session.commit() per gli aggiornamenti di oggetti già esistenti:
+        gli oggetti nuovi vanno inseriti con insert().
+
+        Returns:
+            Future: Resolved with the number of rows updated
+        """
+        changes = []
+        for instance in list(session.dirty):
+            values = _pending_changes(instance)
+            if values:
+                changes.append((type(instance), inspect(instance).identity[0], values))
+        if session.new:
+            logger.warning(f"commit_changes ignores {len(session.new)} new objects, use insert()")
+
+        def operation(writer_session):
+            updated = 0
+            for model, ident, values in changes:
+                instance = writer_session.get(model, ident)
+                if instance is None:
+                    continue
+                for key, value in values.items():
+                    setattr(instance, key, value)
+                updated += 1
+            return updated
+
+        if not changes:
+            future = Future()
+            future.set_result(0)
+            return future
+        return self.submit(operation)
+
+    def flush(self, timeout=WRITE_TIMEOUT):
+        """Wait until every operation queued so far is committed"""
+        if self._thread is None or threading.current_thread() is self._thread:
+            return
+        self.submit(lambda session: None).result(timeout=timeout)
+
+    def reset(self, timeout=WRITE_TIMEOUT):
+        """Close the writer connection, e.g. before the database file is replaced
+
+        La connessione viene chiusa dal thread del writer dopo il commit delle
+        operazioni già in coda e riaperta alla scrittura successiva.
+        """
+        if self._thread is None:
+            return
+        closed = Future()
+        if threading.current_thread() is self._thread:
+            # Dentro un'operazione: la connessione si chiude a fine gruppo
+            self._closing.append(closed)
+            return
+        self.submit(lambda session: self._closing.append(closed)).result(timeout=timeout)
+        closed.result(timeout=timeout)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        waited = False
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            # Coda vuota: aspettiamo una sola volta operazioni arrivate quasi insieme
+            if waited:
+                break
+            waited = True
+            try:
+                batch.append(self._queue.get(timeout=self.max_delay))
+            except queue.Empty:
+                break
+        return batch
+
+    def _open_session(self, db):
+        """Return the writer session, reopening the dedicated connection if it was lost"""
+        if self._connection is not None and self._connection.invalidated:
+            self._close_session()
+        if self._session is None:
+            self._connection = db.engine.connect()
+            self._session = Session(bind=self._connection)
+        return self._session
+
+    def _close_session(self):
+        try:
+            if self._session is not None:
+                self._session.close()
+            if self._connection is not None:
+                self._connection.close()
+        except Exception as e:
+            logger.error(f"Error closing the database writer connection: {str(e)}")
+        self._session = None
+        self._connection = None
+
+    def _run(self):
+        app, db = self._resolve_app()
+        while True:
+            batch = self._next_batch()
+            try:
+                with app.app_context():
+                    self._execute(self._open_session(db), batch)
+            except Exception as e:
+                logger.error(f"Database writer error: {str(e)}")
+                self._close_session()
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            if self._closing:
+                self._close_session()
+                for future in self._closing:
+                    if not future.done():
+                        future.set_result(True)
+                self._closing = []
+
+    def _execute(self, session, batch):
+        results = []
+        try:
+            for operation, future in batch:
+                if future.set_running_or_notify_cancel():
+                    results.append((future, operation(session)))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if len(batch) == 1:
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # Ripete le operazioni una per volta per isolare quella che fallisce
+            logger.warning(f"Batch of {len(batch)} writes failed ({str(e)}), retrying one by one")
+            for operation, future in batch:
+                if future.done():
+                    continue
+                try:
+                    result = operation(session)
+                    session.commit()
+                    future.set_result(result)
+                except Exception as single_error:
+                    session.rollback()
+                    future.set_exception(single_error)
+            return
+
+        for future, result in results:
+            future.set_result(result)
+
+
+def _pending_changes(instance):
+    """Return {column: value} of the modified columns and mark them as committed"""
+    state = inspect(instance)
+    values = {}
+    for attr in state.mapper.column_attrs:
+        if state.attrs[attr.key].history.has_changes():
+            values[attr.key] = getattr(instance, attr.key)
+    for key, value in values.items():
+        set_committed_value(instance, key, value)
+    return values
+
+
+# Istanza condivisa dal processo
+db_writer = DbWriter()
+
+# Le scritture in coda vengono completate prima dell'uscita del processo
+atexit.register(db_writer.flush)
@@ -0,0 +1,200 @@
+"""
+In-process event bus for RClone Manager.
+
+I componenti che cambiano lo stato dei job (RCloneHandler, cancel_job, il
+notification manager) pubblicano eventi qui; l'endpoint SSE /api/events li
+inoltra ai browser collegati. Ogni evento ha un id crescente e gli ultimi
+eventi restano in un ring buffer, così un client che si riconnette con
+Last-Event-ID riceve quelli persi.
+
+Tipi di evento: job_started, job_progress, job_completed, job_cancelled,
+notification.
+"""
+import json
+import time
+import queue
+import logging
+import threading
+from collections import deque, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Eventi conservati per la ripresa dopo una riconnessione
+HISTORY_SIZE = 500
+
+# Eventi in attesa per ogni client: un client troppo lento viene scollegato
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# Intervallo dei commenti di keep-alive sullo stream SSE (secondi)
+HEARTBEAT_INTERVAL = 15
+
+# Chiavi di deduplicazione ricordate (vedi publish(key=...))
+_RECENT_KEYS = 2000
+
+
+class Subscriber:
+    """Queue of events for one connected client"""
+
+    def __init__(self, bus, types=None):
+        self.bus = bus
+        self.types = set(types) if types else None
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+        self.replayed = False
+
+    def offer(self, event):
+        if self.types is not None and event['type'] not in self.types:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Il client non legge abbastanza in fretta: lo scolleghiamo, si riconnetterà
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        """Return the next event, or None after timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """Thread-safe publish/subscribe hub with a replay buffer"""
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=history_size)
+        self._recent_keys = OrderedDict()
+        self._listeners = []
+        self._next_id = 1
+
+    def publish(self, event_type, data=None, key=None):
+        """Publish an event to every subscriber
+
+        Args:
+            event_type: Event name (job_started, job_progress, ...)
+            data: JSON-serializable payload
+            key: Optional deduplication key; an event with a key already
+                published recently is dropped (used when the same change can be
+                observed from two places, e.g. handler and database watcher)
+
+        Returns:
+            dict: The published event, or None if it was a duplicate
+        """
+        with self._lock:
+            if key is not None:
+                if key in self._recent_keys:
+                    return None
+                self._recent_keys[key] = True
+                if len(self._recent_keys) > _RECENT_KEYS:
+                    self._recent_keys.popitem(last=False)
+
+            event = {'id': self._next_id, 'type': event_type, 'data': data or {}, 'time': time.time()}
+            self._next_id += 1
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+            listeners = list(self._listeners)
+
+        for subscriber in subscribers:
+            subscriber.offer(event)
+        for types, callback in listeners:
+            if types is None or event_type in types:
+                try:
+                    callback(event)
+                except Exception as e:
+                    logger.error(f"Error in event listener for {event_type}: {str(e)}")
+        return event
+
+    def add_listener(self, callback, types=None):
+        """Call callback(event) in the publishing thread for every event
+        
+        A differenza dei subscriber, i listener sono componenti interni del processo
+        (es. il reconciler): non contano come client collegati e non hanno una coda,
+        quindi il callback deve essere rapido.
+        
+        Args:
+            callback: Function receiving the event dict
+            types: Optional iterable of event types (default: all)
+        """
+        with self._lock:
+            self._listeners.append((set(types) if types else None, callback))
+
+    def subscribe(self, types=None, last_event_id=None):
+        """Register a subscriber
+
+        Args:
+            types: Optional iterable of event types to receive (default: all)
+            last_event_id: Replay the buffered events after this id
+
+        Returns:
+            Subscriber: Call close() when done
+        """
+        subscriber = Subscriber(self, types)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if last_event_id is not None:
+                subscriber.replayed = True
+                for event in self._history:
+                    if event['id'] > last_event_id:
+                        subscriber.offer(event)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    @property
+    def last_id(self):
+        with self._lock:
+            return self._next_id - 1
+
+    def stream(self, subscriber, max_duration=None, heartbeat=HEARTBEAT_INTERVAL):
+        """Yield Server-Sent Events text for a subscriber until max_duration elapses
+
+        Args:
+            subscriber: Subscriber returned by subscribe()
+            max_duration: Seconds after which the stream ends (the browser's
+                EventSource reconnects by itself with Last-Event-ID)
+            heartbeat: Seconds between keep-alive comments
+        """
+        deadline = time.monotonic() + max_duration if max_duration else None
+        try:
+            # Il browser riprova dopo 3 secondi se la connessione cade. Alla prima
+            # connessione l'id di hello permette di recuperare gli eventi persi durante
+            # una riconnessione anche se non ne è ancora arrivato nessuno
+            hello_id = "" if subscriber.replayed else f"id: {self.last_id}\n"
+            yield f"retry: 3000\n{hello_id}event: hello\ndata: {{}}\n\n"
+            while not subscriber.overflowed:
+                timeout = heartbeat
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    timeout = min(timeout, remaining)
+                event = subscriber.get(timeout=timeout)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            subscriber.close()
+
+
+def format_sse(event):
+    """Format an event as a Server-Sent Events message"""
+    data = json.dumps(event['data'], default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+# Istanza condivisa dal processo
+event_bus = EventBus()
@@ -0,0 +1,424 @@
+"""
+History archive for RClone Manager.
+
+La tabella sync_job_history resta piccola: le esecuzioni più vecchie del
+periodo di conservazione (impostazione history_retention_days) vengono
+spostate a blocchi nella tabella sync_job_history_archive, mantenendo l'id
+originale. I log delle esecuzioni archiviate possono essere compressi (gzip)
+o eliminati secondo l'impostazione archive_log_policy.
+
+/history e /search_logs interrogano l'archivio solo quando l'intervallo di
+date richiesto arriva a comprenderlo (e, per /history, quando la pagina
+richiesta può contenerne righe).
+"""
+import os
+import gzip
+import json
+import base64
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from flask import abort
+from sqlalchemy import delete, func, insert, literal, select, tuple_
+
+from models import db, SyncJobHistory, SyncJobHistoryArchive
+from utils.db_writer import db_writer, WRITE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Giorni di conservazione nella tabella principale (0 = archiviazione disattivata)
+DEFAULT_RETENTION_DAYS = 180
+
+# Cosa fare dei log delle esecuzioni archiviate
+LOG_POLICIES = ('keep', 'compress', 'delete')
+DEFAULT_LOG_POLICY = 'compress'
+
+# Righe spostate per transazione
+ARCHIVE_BATCH = 500
+
+# Intervallo minimo tra due passaggi automatici dell'archiviazione (secondi)
+ARCHIVE_INTERVAL = 3600
+
+_lock = threading.Lock()
+_last_run = 0
+
+
+def get_retention_settings(settings):
+    """Return (retention_days, log_policy) from the UserSettings.settings dictionary"""
+    try:
+        days = max(0, int(settings.get('history_retention_days', DEFAULT_RETENTION_DAYS)))
+    except (TypeError, ValueError):
+        days = DEFAULT_RETENTION_DAYS
+    policy = settings.get('archive_log_policy', DEFAULT_LOG_POLICY)
+    if policy not in LOG_POLICIES:
+        policy = DEFAULT_LOG_POLICY
+    return days, policy
+
+
+def _move_batch(cutoff, batch_size):
+    """Return the writer operation moving one batch of rows older than cutoff"""
+    columns = [column.name for column in SyncJobHistory.__table__.c]
+    hot = SyncJobHistory.__table__
+    archive = SyncJobHistoryArchive.__table__
+
+    def operation(session):
+        # Non archiviamo mai la riga con l'id massimo: senza AUTOINCREMENT SQLite
+        # riutilizzerebbe gli id già presenti nell'archivio. Se è successo comunque
+        # (es. righe eliminate a mano) la riga con l'id già archiviato resta qui
+        max_id = session.execute(select(func.max(hot.c.id))).scalar()
+        ids = session.execute(
+            select(hot.c.id)
+            .where(hot.c.start_time < cutoff, hot.c.status != 'running', hot.c.id != max_id,
+                   hot.c.id.not_in(select(archive.c.id)))
+            .order_by(hot.c.start_time)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return []
+
+        # L'INSERT prende il lock di scrittura: le righe lette dopo sono quelle
+        # effettivamente spostate da questa transazione (anche con altri processi)
+        session.execute(
+            insert(archive).prefix_with('OR IGNORE').from_select(
+                columns + ['archived_at'],
+                select(*[hot.c[name] for name in columns], literal(datetime.now()))
+                .where(hot.c.id.in_(ids))
+            )
+        )
+        # Si eliminano solo le righe che risultano davvero nell'archivio: con OR IGNORE
+        # una riga in conflitto non viene copiata e non deve andare persa
+        moved = session.execute(
+            select(hot.c.id, hot.c.log_file)
+            .join(archive, (archive.c.id == hot.c.id) & (archive.c.start_time == hot.c.start_time))
+            .where(hot.c.id.in_(ids))
+        ).all()
+        if moved:
+            session.execute(delete(hot).where(hot.c.id.in_([row.id for row in moved])))
+        return [(row.id, row.log_file) for row in moved]
+
+    return operation
+
+
+def _compress_log(path):
+    """Compress a log file to path.gz (keeping its mtime) and remove the original
+
+    Returns:
+        str: Path of the compressed file
+    """
+    target = path + '.gz'
+    temp = target + '.tmp'
+    stat = os.stat(path)
+    with open(path, 'rb') as src, gzip.open(temp, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.utime(temp, (stat.st_atime, stat.st_mtime))
+    os.replace(temp, target)
+    os.remove(path)
+    return target
+
+
+def _process_logs(rows, log_policy):
+    """Compress or delete the logs of archived rows
+
+    Returns:
+        dict: {id: (log_file, log_state)} for the rows whose log was changed
+    """
+    changes = {}
+    if log_policy == 'keep':
+        return changes
+    for job_id, log_file in rows:
+        if not log_file or log_file.endswith('.gz') or not os.path.exists(log_file):
+            continue
+        try:
+            if log_policy == 'compress':
+                changes[job_id] = (_compress_log(log_file), 'compressed')
+            else:
+                os.remove(log_file)
+                changes[job_id] = (log_file, 'deleted')
+        except Exception as e:
+            logger.error(f"Error archiving log file {log_file}: {str(e)}")
+    return changes
+
+
+def archive_old_history(retention_days, log_policy=DEFAULT_LOG_POLICY, batch_size=ARCHIVE_BATCH, now=None):
+    """Move the history rows older than retention_days to the archive table
+
+    Da chiamare dentro un app context. Ogni blocco è una transazione separata
+    del writer, così le altre scritture non restano in attesa dell'intera
+    archiviazione.
+
+    Args:
+        retention_days: Days of history kept in the main table (0 disables archiving)
+        log_policy: 'keep', 'compress' or 'delete' for the logs of archived rows
+        batch_size: Rows moved per transaction
+        now: Reference time (default: now)
+
+    Returns:
+        dict: Number of rows moved and of logs compressed/deleted
+    """
+    result = {'moved': 0, 'compressed': 0, 'deleted': 0}
+    if not retention_days or retention_days <= 0:
+        return result
+    cutoff = (now or datetime.now()) - timedelta(days=retention_days)
+
+    while True:
+        rows = db_writer.call(_move_batch(cutoff, batch_size)).result(timeout=WRITE_TIMEOUT)
+        if not rows:
+            break
+        result['moved'] += len(rows)
+
+        changes = _process_logs(rows, log_policy)
+        if changes:
+            def record_logs(session, changes=changes):
+                for job_id, (log_file, log_state) in changes.items():
+                    session.execute(
+                        SyncJobHistoryArchive.__table__.update()
+                        .where(SyncJobHistoryArchive.id == job_id)
+                        .values(log_file=log_file, log_state=log_state)
+                    )
+            db_writer.call(record_logs).result(timeout=WRITE_TIMEOUT)
+            for _, log_state in changes.values():
+                result[log_state] += 1
+
+        if len(rows) < batch_size:
+            break
+
+    if result['moved']:
+        logger.info(f"History archive: {result['moved']} rows archived, {result['compressed']} logs compressed, "
+                    f"{result['deleted']} logs deleted (older than {cutoff:%Y-%m-%d %H:%M})")
+    return result
+
+
+def run_archiver(settings, force=False):
+    """Run archive_old_history with the user settings, at most once per ARCHIVE_INTERVAL
+
+    Args:
+        settings: UserSettings.settings dictionary
+        force: Ignore ARCHIVE_INTERVAL
+
+    Returns:
+        dict: Result of archive_old_history, or None if skipped
+    """
+    global _last_run
+    if not force and _last_run and time.monotonic() - _last_run < ARCHIVE_INTERVAL:
+        return None
+    if not _lock.acquire(blocking=False):
+        return None
+    try:
+        _last_run = time.monotonic()
+        retention_days, log_policy = get_retention_settings(settings)
+        return archive_old_history(retention_days, log_policy)
+    finally:
+        _lock.release()
+
+
+def archive_reached(date_from=None):
+    """Whether a date range starting at date_from includes archived rows
+
+    Args:
+        date_from: Start of the requested range (None = no lower bound)
+
+    Returns:
+        bool: True if the archive has rows started on or after date_from
+    """
+    newest = db.session.query(func.max(SyncJobHistoryArchive.start_time)).scalar()
+    if newest is None:
+        return False
+    return date_from is None or date_from <= newest
+
+
+def get_history_job(job_id):
+    """Return the history row with id job_id from the main table or the archive, or abort 404"""
+    job = db.session.get(SyncJobHistory, job_id) or db.session.get(SyncJobHistoryArchive, job_id)
+    if job is None:
+        abort(404)
+    return job
+
+
+def read_log_bytes(path):
+    """Read a whole log file, decompressing archived (.gz) logs"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return f.read()
+
+
+def encode_cursor(job):
+    """Return the opaque pagination token of a history row (its start_time and id)"""
+    raw = json.dumps([job.start_time.isoformat(), job.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a pagination token into (start_time, id), or None if it is not valid"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        start_time, job_id = json.loads(raw)
+        return datetime.fromisoformat(start_time), int(job_id)
+    except (ValueError, TypeError):
+        return None
+
+
+class HistoryPage:
+    """One page of job history, newest first, with the tokens of the adjacent pages"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None, total_approximate=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_approximate = total_approximate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _sort_key(job):
+    return job.start_time, job.id
+
+
+# Righe più vicine al cursore esaminate con i filtri semplici prima di usare gli
+# indici dei filtri di testo (vedi _tier_rows)
+TEXT_FILTER_WINDOW = 5000
+
+
+def _keyset_query(model, apply_filters, cursor, older, indexed=True):
+    """Filtered query of one table ordered by (start_time, id), starting after cursor"""
+    query = apply_filters(model, model.query, indexed=indexed)
+    key = tuple_(model.start_time, model.id)
+    if cursor is not None:
+        bound = tuple_(literal(cursor[0], model.start_time.type), literal(cursor[1], model.id.type))
+        query = query.filter(key < bound if older else key > bound)
+    if older:
+        return query.order_by(model.start_time.desc(), model.id.desc())
+    return query.order_by(model.start_time.asc(), model.id.asc())
+
+
+def _tier_rows(model, apply_filters, cursor, older, limit, window=None):
+    """Return up to limit filtered rows of one table after cursor
+
+    Con i filtri di testo l'indice trigram trova subito le righe rare, ma per
+    un testo presente in molte righe dovrebbe leggerle e ordinarle tutte.
+    Per questo vengono prima esaminate le `window` righe successive al cursore
+    nell'ordine della pagina (con ilike, lungo l'indice su start_time): se
+    bastano a riempire la pagina l'indice trigram non serve.
+    """
+    if window:
+        key = tuple_(model.start_time, model.id)
+        edge = _keyset_query(model, lambda m, q, indexed: q, cursor, older).with_entities(
+            model.start_time, model.id).offset(window - 1).limit(1).first()
+        query = _keyset_query(model, apply_filters, cursor, older, indexed=False)
+        if edge is not None:
+            bound = tuple_(literal(edge[0], model.start_time.type), literal(edge[1], model.id.type))
+            query = query.filter(key >= bound if older else key <= bound)
+        rows = query.limit(limit).all()
+        # Senza edge la finestra comprendeva tutte le righe rimanenti: il risultato è completo
+        if len(rows) >= limit or edge is None:
+            return rows
+    return _keyset_query(model, apply_filters, cursor, older).limit(limit).all()
+
+
+def _fetch(apply_filters, cursor, older, limit, archive_newest, window=None):
+    """Return up to limit rows after cursor from the main table, merged with the archive if needed
+
+    L'archivio viene interrogato solo se può contenere righe della pagina:
+    verso il passato quando la tabella principale non riempie la pagina o la
+    sua ultima riga non è più recente della riga più recente dell'archivio,
+    verso il presente quando il cursore è più vecchio di quella riga.
+    """
+    rows = _tier_rows(SyncJobHistory, apply_filters, cursor, older, limit, window)
+    if archive_newest is None:
+        return rows
+    if older:
+        needed = len(rows) < limit or rows[-1].start_time <= archive_newest
+    else:
+        needed = cursor is None or cursor[0] <= archive_newest
+    if not needed:
+        return rows
+    rows += _tier_rows(SyncJobHistoryArchive, apply_filters, cursor, older, limit, window)
+    rows.sort(key=_sort_key, reverse=older)
+    return rows[:limit]
+
+
+def paginate_history(apply_filters, per_page, after=None, before=None, date_from=None,
+                     with_count=False, filtered=True, text_filtered=False):
+    """Keyset pagination of the job history on (start_time, id), newest first
+
+    Ogni pagina costa come la prima: niente OFFSET né COUNT(*), solo una
+    ricerca sull'indice a partire dal cursore (e sull'archivio solo se
+    l'intervallo di date lo comprende e la pagina può contenerne righe).
+
+    Args:
+        apply_filters: Callable(model, query, indexed) -> query applying the page
+            filters (must use only columns shared by the two tables; indexed=False
+            asks for plain ilike text filters, see _tier_rows)
+        per_page: Rows per page
+        after: Token of the last row of the previous page (older rows)
+        before: Token of the first row of the next page (newer rows)
+        date_from: Lower bound of the requested date range, if any
+        with_count: Compute the exact number of matching rows
+        filtered: Whether apply_filters restricts the rows (without filters an
+            approximate total is returned for free)
+        text_filtered: Whether apply_filters has substring filters
+
+    Returns:
+        HistoryPage: Rows of the page and tokens of the adjacent pages
+    """
+    archive_newest = db.session.query(func.max(SyncJobHistoryArchive.start_time)).scalar()
+    if archive_newest is not None and date_from is not None and date_from > archive_newest:
+        archive_newest = None
+
+    window = TEXT_FILTER_WINDOW if text_filtered else None
+    before_cursor = decode_cursor(before)
+    after_cursor = None if before_cursor else decode_cursor(after)
+
+    items = None
+    next_cursor = prev_cursor = None
+    if before_cursor is not None:
+        rows = _fetch(apply_filters, before_cursor, False, per_page + 1, archive_newest, window)
+        if len(rows) > per_page:
+            items = list(reversed(rows[:per_page]))
+            prev_cursor = encode_cursor(items[0])
+            next_cursor = encode_cursor(items[-1])
+        # Altrimenti siamo arrivati alle righe più recenti: mostriamo la prima pagina piena
+
+    if items is None:
+        rows = _fetch(apply_filters, after_cursor, True, per_page + 1, archive_newest, window)
+        items = rows[:per_page]
+        if len(rows) > per_page:
+            next_cursor = encode_cursor(items[-1])
+        if after_cursor is not None and items:
+            prev_cursor = encode_cursor(items[0])
+
+    total = None
+    total_approximate = False
+    if with_count:
+        total = apply_filters(SyncJobHistory, SyncJobHistory.query, indexed=True).order_by(None).count()
+        if archive_newest is not None:
+            total += apply_filters(SyncJobHistoryArchive, SyncJobHistoryArchive.query,
+                                   indexed=True).order_by(None).count()
+    elif not filtered:
+        # Gli id crescono e l'archivio li conserva (la riga con l'id massimo non viene
+        # mai archiviata): l'id massimo approssima il numero totale di esecuzioni
+        total = db.session.query(func.max(SyncJobHistory.id)).scalar() or 0
+        total_approximate = True
+
+    return HistoryPage(items, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor,
+                       total=total, total_approximate=total_approximate)
+
+
+def history_counts():
+    """Return the number of rows in the main history table and in the archive"""
+    return {
+        'hot': db.session.query(func.count(SyncJobHistory.id)).scalar(),
+        'archived': db.session.query(func.count(SyncJobHistoryArchive.id)).scalar(),
+    }
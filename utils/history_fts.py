@@ -0,0 +1,142 @@
+"""
+Full-text (trigram) index of the job history for RClone Manager.
+
+I filtri per sottostringa di /history su source, target e log_file con
+ilike('%x%') scandiscono tutta la tabella. I valori distinti delle tre
+colonne (di entrambe le tabelle della cronologia) sono raccolti nella tabella
+history_text_values, indicizzata da una tabella FTS5 "ombra" con tokenizer
+trigram; trigger su INSERT e UPDATE delle colonne la tengono aggiornata.
+
+Source e target hanno pochi valori distinti ripetuti in migliaia di
+esecuzioni: la ricerca trigram avviene sui valori (poche righe) e la
+cronologia viene poi filtrata con source IN (...) usando gli indici esistenti.
+I valori che non compaiono più nella cronologia restano nella tabella: non
+producono risultati e non vengono rimossi.
+
+Il tokenizer trigram non può cercare testi più corti di 3 caratteri: in quel
+caso (o se SQLite non ha FTS5) il filtro torna a ilike.
+"""
+import logging
+
+from sqlalchemy import inspect, select, text, column, table as sql_table, literal_column
+
+logger = logging.getLogger(__name__)
+
+# Colonne indicizzate
+FTS_COLUMNS = ('source', 'target', 'log_file')
+
+# Tabella dei valori distinti e relativo indice FTS
+VALUES_TABLE = 'history_text_values'
+FTS_TABLE = 'history_text_values_fts'
+
+# Lunghezza minima di un testo cercabile con il tokenizer trigram
+MIN_FTS_LENGTH = 3
+
+_values = sql_table(VALUES_TABLE, column('id'), column('field'), column('value'))
+_fts = sql_table(FTS_TABLE, column('rowid'))
+
+# Tabelle della cronologia collegate all'indice (impostato da ensure_history_fts)
+_indexed_tables = set()
+
+
+def _collect_values(prefix, source_table=None):
+    """SELECT of the (field, value) pairs of a history row (new.*) or of a whole table"""
+    parts = []
+    for name in FTS_COLUMNS:
+        if source_table:
+            parts.append(f"SELECT DISTINCT '{name}', {name} FROM {source_table} WHERE {name} IS NOT NULL")
+        else:
+            parts.append(f"SELECT '{name}', {prefix}.{name} WHERE {prefix}.{name} IS NOT NULL")
+    return ' UNION ALL '.join(parts)
+
+
+def _ddl(history_tables):
+    """Statements creating the values table, its FTS index and the sync triggers"""
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS {VALUES_TABLE} ("
+        f"id INTEGER PRIMARY KEY, field VARCHAR(20) NOT NULL, value VARCHAR(255) NOT NULL, "
+        f"UNIQUE (field, value))",
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"value, content='{VALUES_TABLE}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {VALUES_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, value) VALUES (new.id, new.value); END",
+    ]
+    columns = ', '.join(FTS_COLUMNS)
+    for table_name in history_tables:
+        insert_values = f"INSERT OR IGNORE INTO {VALUES_TABLE}(field, value) {_collect_values('new')};"
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {table_name}_text_ai AFTER INSERT ON {table_name} "
+            f"BEGIN {insert_values} END",
+            f"CREATE TRIGGER IF NOT EXISTS {table_name}_text_au AFTER UPDATE OF {columns} ON {table_name} "
+            f"BEGIN {insert_values} END",
+        ]
+    return statements
+
+
+def ensure_history_fts(db, models):
+    """Create the values table, the FTS index and the triggers, populating them the first time
+
+    Args:
+        db: Flask-SQLAlchemy instance (to be called inside an app context)
+        models: History models to index (their tables must have FTS_COLUMNS)
+
+    Returns:
+        bool: True if the index was created (and populated) by this call
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    table_names = [model.__tablename__ for model in models]
+    try:
+        created = FTS_TABLE not in set(inspect(db.engine).get_table_names())
+        with db.engine.begin() as conn:
+            for statement in _ddl(table_names):
+                conn.execute(text(statement))
+            if created:
+                # Indice nuovo: raccoglie i valori delle righe già presenti
+                for table_name in table_names:
+                    conn.execute(text(f"INSERT OR IGNORE INTO {VALUES_TABLE}(field, value) "
+                                      f"{_collect_values(None, table_name)}"))
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    except Exception as e:
+        # Ad esempio SQLite compilato senza FTS5: i filtri useranno ilike
+        logger.error(f"Error creating the history full-text index: {str(e)}")
+        return False
+    _indexed_tables.update(table_names)
+    if created:
+        logger.info(f"History full-text index created for {', '.join(table_names)}")
+    return created
+
+
+def _match_query(value):
+    """FTS5 query matching value as a substring (phrase of its trigrams)"""
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _like_pattern(value):
+    """LIKE pattern matching value literally as a substring (escape character: backslash)"""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def substring_filter(model, column_name, value, indexed=True):
+    """Return a filter clause for rows of model whose column_name contains value (case-insensitive)
+
+    Args:
+        model: SyncJobHistory or SyncJobHistoryArchive
+        column_name: One of FTS_COLUMNS
+        value: Text to search
+        indexed: Use the trigram index (False forces ilike, used when only a
+            small range of rows is scanned)
+
+    Returns:
+        ColumnElement: Clause to pass to query.filter()
+    """
+    if not indexed or model.__tablename__ not in _indexed_tables or len(value) < MIN_FTS_LENGTH:
+        # Come nella ricerca FTS5, % e _ (frequenti nei nomi dei remote) sono letterali
+        return getattr(model, column_name).ilike(_like_pattern(value), escape='\\')
+    matching_ids = (select(literal_column('rowid'))
+                    .select_from(_fts)
+                    .where(literal_column(FTS_TABLE).op('MATCH')(_match_query(value))))
+    matching_values = select(_values.c.value).where(_values.c.field == column_name,
+                                                    _values.c.id.in_(matching_ids))
+    return getattr(model, column_name).in_(matching_values)
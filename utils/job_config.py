@@ -0,0 +1,130 @@
+"""
+Cached parsing of the configured jobs file (rclone_scheduled.conf).
+
+Il file contiene una coppia "source target" per riga (righe vuote e commenti
+'#' ignorati). Viene analizzato una volta e tenuto in memoria; ad ogni accesso
+un os.stat() confronta mtime, dimensione e inode e lo rilegge solo se è
+cambiato, quindi anche gli altri worker gunicorn vedono subito le modifiche
+fatte da save() (che sostituisce il file in modo atomico, cambiando l'inode).
+
+L'ID di un job è un hash della coppia source/target: resta lo stesso se si
+aggiungono, tolgono o spostano altre righe, invece dell'indice di riga usato
+in precedenza.
+"""
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Caratteri esadecimali dell'hash usati come ID
+ID_LENGTH = 12
+
+
+def job_id_for(source, target, occurrence=1):
+    """Return the stable ID of a source/target pair
+
+    Args:
+        source: Source path
+        target: Target path
+        occurrence: 1 for the first line with this pair, 2 for the second duplicate, ...
+    """
+    digest = hashlib.sha1(f"{source}\t{target}".encode('utf-8')).hexdigest()[:ID_LENGTH]
+    return digest if occurrence == 1 else f"{digest}-{occurrence}"
+
+
+class JobConfig:
+    """Configured jobs file parsed into records keyed by a content hash"""
+
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self._jobs = []
+        self._by_id = {}
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.config_path)
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except OSError:
+            return None
+
+    def _parse(self, lines):
+        """Build the job records from the lines of the file"""
+        jobs = []
+        occurrences = {}
+        for i, line in enumerate(lines):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split()
+            if len(parts) != 2:
+                logger.warning(f"Invalid line {i + 1} in {self.config_path}: expected 'source target'")
+                continue
+            source, target = parts
+            occurrences[(source, target)] = occurrences.get((source, target), 0) + 1
+            jobs.append({
+                'id': job_id_for(source, target, occurrences[(source, target)]),
+                'source': source,
+                'target': target,
+                'line': i + 1,
+            })
+        return jobs
+
+    def _refresh(self):
+        """Reparse the file if it changed since the last read"""
+        stamp = self._stat()
+        if stamp is not None and stamp == self._stamp:
+            return self._jobs
+        with self._lock:
+            if stamp is not None and stamp == self._stamp:
+                return self._jobs
+            jobs = []
+            if stamp is None:
+                logger.warning(f"Config file not found: {self.config_path}")
+            else:
+                try:
+                    with open(self.config_path, 'r') as f:
+                        jobs = self._parse(f.readlines())
+                except Exception as e:
+                    logger.error(f"Error reading config file: {str(e)}")
+                    return self._jobs
+            self._jobs = jobs
+            self._by_id = {job['id']: job for job in jobs}
+            self._stamp = stamp
+            return jobs
+
+    def jobs(self):
+        """Return the configured jobs in file order (shared records, not to be modified)"""
+        return self._refresh()
+
+    def get(self, job_id):
+        """Return the job with the given ID, or None"""
+        self._refresh()
+        return self._by_id.get(str(job_id))
+
+    def invalidate(self):
+        """Force a reparse on the next access"""
+        with self._lock:
+            self._stamp = None
+
+    def save(self, content):
+        """Replace the file atomically and reload it"""
+        directory = os.path.dirname(self.config_path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.rclone_scheduled.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            # mkstemp crea il file con permessi 0600: mantiene quelli del file originale
+            mode = os.stat(self.config_path).st_mode & 0o777 if os.path.exists(self.config_path) else 0o644
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self.config_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.invalidate()
@@ -0,0 +1,510 @@
+"""
+Durable execution queue of the rclone jobs.
+
+Le route web, l'API e lo scheduler non avviano direttamente run_custom_job:
+inviare un job è un solo INSERT nella tabella job_queue (JobQueueEntry). Un
+dispatcher in ogni processo prende i job pending e li avvia solo se non
+superano i limiti di concorrenza configurati:
+
+- numero massimo di job in esecuzione in totale;
+- numero massimo di job che usano lo stesso remote (come source o target);
+- numero massimo di job che scrivono nello stesso bucket di destinazione
+  (remote + primo componente del percorso del target).
+
+Ciclo di vita di una riga:
+
+    pending -> claimed -> running -> done
+
+La presa in carico è un UPDATE ... WHERE status = 'pending' (idempotente: un
+solo processo la ottiene) con un lease. Se il processo muore prima che il job
+parta, al riavvio (o alla scadenza del lease) la riga torna pending, a meno che
+la riga della cronologia del job esista già: in quel caso viene solo
+collegata, senza avviare il job una seconda volta. Le righe running diventano
+done quando la loro riga della cronologia non è più "running".
+
+I job in esecuzione vengono contati dalla cronologia e dalle righe claimed,
+quindi i limiti valgono per tutti i processi (worker gunicorn e scheduler); un
+file di lock (fcntl) rende atomici conteggio e avvio tra i processi. Un job
+bloccato dai limiti non blocca quelli successivi che usano altri remote.
+"""
+import os
+import time
+import fcntl
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, delete, select
+
+from utils.db_writer import db_writer, WRITE_TIMEOUT
+from utils.remote_inventory import split_remote
+
+logger = logging.getLogger(__name__)
+
+# Limiti predefiniti (0 = nessun limite)
+DEFAULT_MAX_JOBS = 8
+DEFAULT_MAX_PER_REMOTE = 4
+DEFAULT_MAX_PER_BUCKET = 2
+
+# Intervallo massimo tra due tentativi di avvio (secondi): i job terminati in
+# altri processi liberano posti senza svegliare il dispatcher di questo
+DISPATCH_INTERVAL = 5
+
+# Durata della presa in carico: oltre, la riga claimed torna pending
+LEASE_SECONDS = 300
+
+# Tentativi di avvio dopo i quali un job recuperato viene abbandonato
+MAX_ATTEMPTS = 3
+
+# Righe pending esaminate per ciclo
+DISPATCH_BATCH = 200
+
+# Le righe done vengono eliminate dopo questo periodo
+DONE_RETENTION = timedelta(days=7)
+PRUNE_INTERVAL = 600
+
+QUEUED_STATUSES = ('pending', 'claimed')
+
+
+def get_queue_limits(settings):
+    """Return (max_jobs, max_per_remote, max_per_bucket) from the UserSettings.settings dictionary"""
+    limits = []
+    for key, default in (('queue_max_jobs', DEFAULT_MAX_JOBS),
+                         ('queue_max_per_remote', DEFAULT_MAX_PER_REMOTE),
+                         ('queue_max_per_bucket', DEFAULT_MAX_PER_BUCKET)):
+        try:
+            limits.append(max(0, int(settings.get(key, default))))
+        except (TypeError, ValueError):
+            limits.append(default)
+    return tuple(limits)
+
+
+def job_resources(source, target):
+    """Return (remotes, bucket) used by a job for the concurrency limits
+
+    Args:
+        source: Source path ("remote:path" or local path)
+        target: Target path
+
+    Returns:
+        tuple: (set of remote names, "remote:bucket" of the target or None for local targets)
+    """
+    src_remote, _ = split_remote(source)
+    tgt_remote, tgt_path = split_remote(target)
+    remotes = {remote for remote in (src_remote, tgt_remote) if remote}
+    bucket = None
+    if tgt_remote:
+        bucket = f"{tgt_remote}:{tgt_path.strip('/').split('/', 1)[0]}"
+    return remotes, bucket
+
+
+def _owner():
+    """Identity written in claimed_by: host and pid of this process"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    """False only if owner is a process of this host that no longer exists"""
+    try:
+        host, pid = owner.rsplit(':', 1)
+        if host != socket.gethostname():
+            return True
+        os.kill(int(pid), 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except (ValueError, AttributeError, PermissionError):
+        return True
+
+
+class _Counts:
+    """Running jobs per pair, remote and bucket used to check the limits"""
+
+    def __init__(self):
+        self.pairs = set()
+        self.total = 0
+        self.per_remote = {}
+        self.per_bucket = {}
+
+    def add(self, source, target):
+        remotes, bucket = job_resources(source, target)
+        self.pairs.add((source, target))
+        self.total += 1
+        for remote in remotes:
+            self.per_remote[remote] = self.per_remote.get(remote, 0) + 1
+        if bucket:
+            self.per_bucket[bucket] = self.per_bucket.get(bucket, 0) + 1
+
+    def blocked_by(self, source, target, limits):
+        """Return None if the job can start now, otherwise the reason it has to wait"""
+        max_jobs, max_per_remote, max_per_bucket = limits
+        if (source, target) in self.pairs:
+            return "stesso source/target in esecuzione"
+        if max_jobs and self.total >= max_jobs:
+            return f"limite globale ({max_jobs})"
+        remotes, bucket = job_resources(source, target)
+        for remote in sorted(remotes):
+            if max_per_remote and self.per_remote.get(remote, 0) >= max_per_remote:
+                return f"limite per il remote {remote} ({max_per_remote})"
+        if bucket and max_per_bucket and self.per_bucket.get(bucket, 0) >= max_per_bucket:
+            return f"limite per il bucket {bucket} ({max_per_bucket})"
+        return None
+
+
+class JobQueue:
+    """Queue stored in the job_queue table with a dispatcher thread per process"""
+
+    def __init__(self):
+        self.state_dir = None
+        self._launch = None
+        self._running = None
+        self._limits = None
+        self._on_error = None
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_prune = 0
+
+    def open(self, state_dir, launch, running, limits, on_error=None):
+        """Configure the queue
+
+        Args:
+            state_dir: Directory for the lock file shared by the processes
+            launch: Function JobQueueEntry -> history id; starts the job (run_custom_job,
+                history entry, notification) and raises on errors
+            running: Function returning the (source, target) pairs of the running jobs
+            limits: Function returning (max_jobs, max_per_remote, max_per_bucket)
+            on_error: Function (JobQueueEntry, message) called when a job that waited
+                in the queue fails to start (the caller of submit is gone)
+        """
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_dir = state_dir
+        self._launch = launch
+        self._running = running
+        self._limits = limits
+        self._on_error = on_error
+
+    def start(self):
+        """Recover the work interrupted by a previous run and start the dispatcher thread"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.recover()
+                self._thread = threading.Thread(target=self._run, daemon=True, name="job-queue")
+                self._thread.start()
+
+    def wake(self):
+        """Ask the dispatcher to try again now (a job finished or the limits changed)"""
+        self._wake.set()
+
+    def submit(self, source, target, dry_run=False, origin='manual', scheduled_job_id=None, name=None,
+               dispatch=True):
+        """Durably enqueue a job and try to start it immediately
+
+        Un job uguale (stessi source, target e dry_run) ancora pending o claimed
+        non viene inserito una seconda volta.
+
+        Args:
+            source: Source path
+            target: Target path
+            dry_run: Whether the job is a dry run
+            origin: 'manual', 'configured', 'scheduled' or 'api'
+            scheduled_job_id: ScheduledJob id for scheduled jobs
+            name: Display name
+            dispatch: Try to start the job before returning
+
+        Returns:
+            JobQueueEntry: detached copy of the row: status 'running' (history_id set),
+                'pending' / 'claimed' (blocked_by set) or 'done' with outcome 'error'
+        """
+        from app import app
+        from models import db, JobQueueEntry
+
+        source, target = source.strip(), target.strip()
+
+        def insert(session):
+            existing = session.execute(
+                select(JobQueueEntry.id).where(JobQueueEntry.source == source,
+                                               JobQueueEntry.target == target,
+                                               JobQueueEntry.dry_run == dry_run,
+                                               JobQueueEntry.status.in_(QUEUED_STATUSES))
+            ).scalar()
+            if existing is not None:
+                return existing
+            entry = JobQueueEntry(source=source, target=target, dry_run=dry_run, origin=origin,
+                                  scheduled_job_id=scheduled_job_id, name=name, status='pending',
+                                  attempts=0, created_at=datetime.now())
+            session.add(entry)
+            session.flush()
+            return entry.id
+
+        entry_id = db_writer.call(insert).result(timeout=WRITE_TIMEOUT)
+        logger.info(f"Job queued ({origin}): {source} → {target} [{entry_id}]")
+        if dispatch:
+            self._dispatch(wait_for=entry_id)
+            self.start()
+        with app.app_context():
+            try:
+                entry = db.session.get(JobQueueEntry, entry_id)
+                db.session.expunge(entry)
+                return entry
+            finally:
+                db.session.remove()
+
+    def is_queued(self, source, target):
+        """True if a job for source/target is pending or claimed"""
+        from app import app
+        from models import db, JobQueueEntry
+        with app.app_context():
+            try:
+                return db.session.query(JobQueueEntry.id).filter(
+                    JobQueueEntry.source == source.strip(),
+                    JobQueueEntry.target == target.strip(),
+                    JobQueueEntry.status.in_(QUEUED_STATUSES)).first() is not None
+            finally:
+                db.session.remove()
+
+    def cancel(self, entry_id):
+        """Remove a pending job from the queue
+
+        Returns:
+            bool: True if the job was still pending
+        """
+        from models import JobQueueEntry
+
+        def operation(session):
+            return session.execute(
+                update(JobQueueEntry)
+                .where(JobQueueEntry.id == entry_id, JobQueueEntry.status == 'pending')
+                .values(status='done', outcome='cancelled', finished_at=datetime.now())
+            ).rowcount == 1
+
+        cancelled = db_writer.call(operation).result(timeout=WRITE_TIMEOUT)
+        if cancelled:
+            logger.info(f"Queued job {entry_id} cancelled")
+        return cancelled
+
+    def queued_jobs(self):
+        """Return the pending and claimed jobs (dicts), oldest first"""
+        from app import app
+        from models import db, JobQueueEntry
+        with app.app_context():
+            try:
+                rows = JobQueueEntry.query.filter(JobQueueEntry.status.in_(QUEUED_STATUSES)).order_by(
+                    JobQueueEntry.created_at, JobQueueEntry.id).all()
+                return [row.to_dict() for row in rows]
+            finally:
+                db.session.remove()
+
+    def recover(self):
+        """Bring the queue back to a consistent state after a crash or restart
+
+        - claimed con lease scaduto o di un processo terminato: se la riga della
+          cronologia del job esiste già viene collegata (running), altrimenti la
+          riga torna pending (done/error dopo MAX_ATTEMPTS tentativi);
+        - running la cui riga della cronologia non è più "running": done.
+
+        Returns:
+            int: Number of rows changed
+        """
+        from models import JobQueueEntry, SyncJobHistory
+
+        now = datetime.now()
+
+        def operation(session):
+            changed = 0
+            claimed = session.query(JobQueueEntry).filter(JobQueueEntry.status == 'claimed').all()
+            for entry in claimed:
+                expired = entry.lease_until is None or entry.lease_until < now
+                if not expired and _owner_alive(entry.claimed_by):
+                    continue
+                # Il job è partito prima dell'interruzione? Allora non va riavviato
+                history = session.query(SyncJobHistory).filter(
+                    SyncJobHistory.source == entry.source,
+                    SyncJobHistory.target == entry.target,
+                    SyncJobHistory.start_time >= entry.claimed_at
+                ).order_by(SyncJobHistory.id).first() if entry.claimed_at else None
+                if history is not None:
+                    entry.status = 'running'
+                    entry.history_id = history.id
+                    entry.started_at = history.start_time
+                    logger.info(f"Queued job {entry.id} was already started (history {history.id}): linked")
+                elif entry.attempts >= MAX_ATTEMPTS:
+                    entry.status = 'done'
+                    entry.outcome = 'error'
+                    entry.error = f"Non avviato dopo {entry.attempts} tentativi"
+                    entry.finished_at = now
+                    logger.warning(f"Queued job {entry.id} abandoned after {entry.attempts} attempts")
+                else:
+                    entry.status = 'pending'
+                    logger.info(f"Queued job {entry.id} claimed by {entry.claimed_by} recovered as pending")
+                entry.claimed_by = None
+                entry.lease_until = None
+                changed += 1
+            changed += self._finish_running(session, now)
+            return changed
+
+        try:
+            changed = db_writer.call(operation).result(timeout=WRITE_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error recovering the job queue: {str(e)}")
+            return 0
+        if changed:
+            logger.info(f"Job queue recovery: {changed} entries updated")
+        return changed
+
+    @staticmethod
+    def _finish_running(session, now):
+        """Mark done the running entries whose history row is no longer running (writer operation)"""
+        from models import JobQueueEntry, SyncJobHistory, SyncJobHistoryArchive
+
+        rows = session.execute(
+            select(JobQueueEntry.id, JobQueueEntry.history_id).where(JobQueueEntry.status == 'running')
+        ).all()
+        changed = 0
+        for entry_id, history_id in rows:
+            status = None
+            if history_id is not None:
+                status = session.execute(
+                    select(SyncJobHistory.status).where(SyncJobHistory.id == history_id)).scalar()
+                if status is None:
+                    status = session.execute(
+                        select(SyncJobHistoryArchive.status).where(SyncJobHistoryArchive.id == history_id)).scalar()
+            if status == 'running':
+                continue
+            session.execute(update(JobQueueEntry).where(JobQueueEntry.id == entry_id).values(
+                status='done', outcome=status or 'unknown', finished_at=now))
+            changed += 1
+        return changed
+
+    def _claim(self, entry_id):
+        """Take a pending entry; only one process can succeed"""
+        from models import JobQueueEntry
+        now = datetime.now()
+
+        def operation(session):
+            return session.execute(
+                update(JobQueueEntry)
+                .where(JobQueueEntry.id == entry_id, JobQueueEntry.status == 'pending')
+                .values(status='claimed', claimed_by=_owner(), claimed_at=now,
+                        lease_until=now + timedelta(seconds=LEASE_SECONDS),
+                        attempts=JobQueueEntry.attempts + 1, blocked_by=None)
+            ).rowcount == 1
+
+        return db_writer.call(operation).result(timeout=WRITE_TIMEOUT)
+
+    def _dispatch(self, background=False, wait_for=None):
+        """Start the pending jobs allowed by the limits
+
+        Args:
+            background: Called by the dispatcher loop; launch errors are reported
+                through on_error since nobody waits for the result
+            wait_for: Entry just submitted by the caller (its errors are returned, not notified)
+        """
+        from app import app
+        from models import db, JobQueueEntry
+
+        if self._launch is None:
+            return
+        with self._lock:
+            lock_file = None
+            try:
+                # Conteggio e avvio atomici rispetto agli altri processi
+                lock_file = open(os.path.join(self.state_dir, 'dispatch.lock'), 'w')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+                with app.app_context():
+                    try:
+                        pending = JobQueueEntry.query.filter(JobQueueEntry.status == 'pending').order_by(
+                            JobQueueEntry.created_at, JobQueueEntry.id).limit(DISPATCH_BATCH).all()
+                        claimed = db.session.query(JobQueueEntry.source, JobQueueEntry.target).filter(
+                            JobQueueEntry.status == 'claimed').all()
+                        for entry in pending:
+                            db.session.expunge(entry)
+                    finally:
+                        db.session.remove()
+                if not pending:
+                    return
+
+                limits = self._limits()
+                counts = _Counts()
+                for source, target in list(self._running()) + list(claimed):
+                    counts.add(source.strip(), target.strip())
+
+                blocked = {}
+                for entry in pending:
+                    reason = counts.blocked_by(entry.source, entry.target, limits)
+                    if reason:
+                        if reason != entry.blocked_by:
+                            blocked[entry.id] = reason
+                        continue
+                    if not self._claim(entry.id):
+                        continue  # presa da un altro processo
+                    counts.add(entry.source, entry.target)
+                    self._start(entry, notify_error=background or entry.id != wait_for)
+
+                if blocked:
+                    db_writer.call(lambda session: [
+                        session.execute(update(JobQueueEntry).where(
+                            JobQueueEntry.id == entry_id, JobQueueEntry.status == 'pending'
+                        ).values(blocked_by=reason)) for entry_id, reason in blocked.items()]
+                    ).result(timeout=WRITE_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Error dispatching the job queue: {str(e)}")
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+    def _start(self, entry, notify_error):
+        """Launch a claimed entry and record the outcome"""
+        from models import JobQueueEntry
+        try:
+            history_id = self._launch(entry)
+        except Exception as e:
+            logger.error(f"Error starting queued job {entry.source} → {entry.target}: {str(e)}")
+            recorded = True
+            try:
+                # Atteso: submit rilegge la riga subito dopo e deve vedere l'errore
+                db_writer.update(JobQueueEntry, entry.id, status='done', outcome='error', error=str(e),
+                                 finished_at=datetime.now(), lease_until=None).result(timeout=WRITE_TIMEOUT)
+            except Exception as write_error:
+                recorded = False
+                logger.error(f"Error recording the failed start of queued job {entry.id}: {str(write_error)}")
+            # Se l'errore non è nella riga, il chiamante di submit non può vederlo
+            if (notify_error or not recorded) and self._on_error is not None:
+                self._on_error(entry, str(e))
+            return
+
+        try:
+            db_writer.update(JobQueueEntry, entry.id, status='running', history_id=history_id,
+                             started_at=datetime.now(), lease_until=None).result(timeout=WRITE_TIMEOUT)
+        except Exception as e:
+            # Il job è partito: recover() collegherà la riga alla cronologia alla scadenza del lease
+            logger.error(f"Error marking queued job {entry.id} as running: {str(e)}")
+        logger.info(f"Queued job started: {entry.source} → {entry.target} [{entry.id}] "
+                    f"after {(datetime.now() - entry.created_at).total_seconds():.1f}s")
+
+    def _prune(self):
+        """Delete the done entries older than DONE_RETENTION"""
+        from models import JobQueueEntry
+        cutoff = datetime.now() - DONE_RETENTION
+        db_writer.call(lambda session: session.execute(
+            delete(JobQueueEntry).where(JobQueueEntry.status == 'done', JobQueueEntry.finished_at < cutoff)))
+
+    def _run(self):
+        """Dispatcher loop"""
+        while True:
+            self._wake.wait(DISPATCH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.recover()
+                self._dispatch(background=True)
+                if time.time() - self._last_prune > PRUNE_INTERVAL:
+                    self._last_prune = time.time()
+                    self._prune()
+            except Exception as e:
+                logger.error(f"Error in job queue dispatcher: {str(e)}")
+
+
+# Istanza globale condivisa dall'applicazione
+job_queue = JobQueue()
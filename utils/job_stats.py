@@ -0,0 +1,393 @@
+"""
+Run statistics rollups for RClone Manager.
+
+La tabella job_run_stats contiene, per ogni coppia source/target e per ogni
+giorno, il numero di esecuzioni (completate, in errore, annullate), i byte e
+i file trasferiti e un istogramma logaritmico delle durate dei job
+completati, da cui sono calcolati p50 e p95.
+
+Le righe vengono aggiornate nella stessa transazione in cui un job passa da
+running/pending a uno stato finale, qualunque sia il percorso (fine del
+processo, riparazioni del reconciler, annullamento): un listener after_flush
+della Session intercetta il cambio di stato. Le statistiche di una coppia si
+leggono quindi con una ricerca sull'indice, senza scandire la cronologia né
+leggere i log. I dry run sono esclusi.
+"""
+import json
+import math
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect, select, insert, update, delete, tuple_
+from sqlalchemy.orm import Session
+
+from models import db, JobRunStats, SyncJobHistory, SyncJobHistoryArchive
+from utils import autotune
+from utils.db_writer import db_writer, WRITE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Stati finali di un job
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+
+# Rapporto tra i limiti di due bucket consecutivi dell'istogramma delle durate
+# (errore relativo dei percentili di circa il 2.5%)
+HISTOGRAM_GAMMA = 1.05
+
+# Giorni considerati di default dalle statistiche per coppia
+DEFAULT_STATS_DAYS = 30
+
+
+def duration_bucket(seconds):
+    """Return the histogram bucket of a duration in seconds (0 for durations up to 1s)"""
+    if seconds <= 1:
+        return 0
+    return int(math.ceil(math.log(seconds) / math.log(HISTOGRAM_GAMMA)))
+
+
+def bucket_value(bucket):
+    """Return the representative duration (seconds) of a histogram bucket"""
+    if bucket <= 0:
+        return 1.0
+    return 2 * HISTOGRAM_GAMMA ** bucket / (HISTOGRAM_GAMMA + 1)
+
+
+def histogram_percentile(histogram, q):
+    """Return the q-quantile (0-1) of a {bucket: count} histogram, or None if empty"""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = max(1, math.ceil(q * total))
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return round(bucket_value(bucket), 1)
+    return None
+
+
+def format_duration(seconds):
+    """Format a duration like SyncJobHistory.duration_formatted ('-' for None)"""
+    if seconds is None:
+        return '-'
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    elif seconds < 3600:
+        return f"{seconds/60:.1f}m"
+    return f"{seconds/3600:.1f}h"
+
+
+class Rollup:
+    """Accumulator of run statistics, mergeable across jobs and days"""
+
+    def __init__(self):
+        self.runs = 0
+        self.completed = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.histogram = {}
+        self.duration_total = 0.0
+        self.duration_max = None
+        self.transferred_bytes = 0
+        self.transferred_files = 0
+        self.last_run = None
+        self.last_status = None
+
+    @classmethod
+    def from_row(cls, row):
+        """Create a Rollup from a job_run_stats row (ORM object or Row)"""
+        rollup = cls()
+        rollup.runs = row.runs or 0
+        rollup.completed = row.completed or 0
+        rollup.errors = row.errors or 0
+        rollup.cancelled = row.cancelled or 0
+        try:
+            rollup.histogram = {int(k): v for k, v in json.loads(row.duration_histogram or '{}').items()}
+        except (TypeError, ValueError):
+            rollup.histogram = {}
+        rollup.duration_total = row.duration_total or 0.0
+        rollup.duration_max = row.duration_max
+        rollup.transferred_bytes = row.transferred_bytes or 0
+        rollup.transferred_files = row.transferred_files or 0
+        rollup.last_run = row.last_run
+        rollup.last_status = row.last_status
+        return rollup
+
+    def add_run(self, status, start_time, duration, transferred_bytes=None, transferred_files=None, sign=1):
+        """Add a finished run (sign=-1 removes a run added before, e.g. when its status is corrected)"""
+        self.runs += sign
+        if status == 'completed':
+            self.completed += sign
+            # Le durate sono quelle dei job completati: quelli falliti o annullati
+            # terminano spesso subito e falserebbero la durata tipica
+            if duration is not None:
+                bucket = duration_bucket(duration)
+                count = self.histogram.get(bucket, 0) + sign
+                if count > 0:
+                    self.histogram[bucket] = count
+                else:
+                    self.histogram.pop(bucket, None)
+                self.duration_total += sign * duration
+                # Il massimo non può essere ritirato: resta quello già visto
+                if sign > 0:
+                    self.duration_max = duration if self.duration_max is None else max(self.duration_max, duration)
+        elif status == 'error':
+            self.errors += sign
+        elif status == 'cancelled':
+            self.cancelled += sign
+        self.transferred_bytes += sign * (transferred_bytes or 0)
+        self.transferred_files += sign * (transferred_files or 0)
+        if sign > 0 and start_time is not None and (self.last_run is None or start_time >= self.last_run):
+            self.last_run = start_time
+            self.last_status = status
+
+    def merge(self, other):
+        """Add the statistics of another Rollup"""
+        self.runs += other.runs
+        self.completed += other.completed
+        self.errors += other.errors
+        self.cancelled += other.cancelled
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+        self.duration_total += other.duration_total
+        if other.duration_max is not None:
+            self.duration_max = other.duration_max if self.duration_max is None else max(self.duration_max, other.duration_max)
+        self.transferred_bytes += other.transferred_bytes
+        self.transferred_files += other.transferred_files
+        if other.last_run is not None and (self.last_run is None or other.last_run >= self.last_run):
+            self.last_run = other.last_run
+            self.last_status = other.last_status
+
+    def values(self):
+        """Column values of the job_run_stats row"""
+        return {
+            'runs': self.runs,
+            'completed': self.completed,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'duration_histogram': json.dumps(self.histogram, sort_keys=True),
+            'duration_total': self.duration_total,
+            'duration_p50': histogram_percentile(self.histogram, 0.5),
+            'duration_p95': histogram_percentile(self.histogram, 0.95),
+            'duration_max': self.duration_max,
+            'transferred_bytes': self.transferred_bytes,
+            'transferred_files': self.transferred_files,
+            'last_run': self.last_run,
+            'last_status': self.last_status,
+        }
+
+    def summary(self):
+        """JSON-serializable summary for the API and the templates"""
+        p50 = histogram_percentile(self.histogram, 0.5)
+        p95 = histogram_percentile(self.histogram, 0.95)
+        finished = self.completed + self.errors
+        return {
+            'runs': self.runs,
+            'completed': self.completed,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'success_rate': round(100.0 * self.completed / finished, 1) if finished else None,
+            'duration_avg': round(self.duration_total / self.completed, 1) if self.completed else None,
+            'duration_p50': p50,
+            'duration_p95': p95,
+            'duration_max': round(self.duration_max, 1) if self.duration_max is not None else None,
+            'duration_p50_formatted': format_duration(p50),
+            'duration_p95_formatted': format_duration(p95),
+            'transferred_bytes': self.transferred_bytes,
+            'transferred_files': self.transferred_files,
+            'last_run': self.last_run.strftime('%Y-%m-%d %H:%M:%S') if self.last_run else None,
+            'last_status': self.last_status,
+        }
+
+
+# Colonne della cronologia usate dalle statistiche
+RUN_COLUMNS = ('source', 'target', 'status', 'dry_run', 'start_time', 'end_time',
+               'transferred_bytes', 'transferred_files')
+
+
+def _run_values(job, sign=1):
+    """Return (key, add_run kwargs) of a finished history row, or None if it is not counted
+
+    Args:
+        job: Object with the RUN_COLUMNS attributes (model instance, Row or dict wrapper)
+        sign: 1 to add the run, -1 to remove it
+    """
+    if job.dry_run or job.status not in FINISHED_STATUSES or job.start_time is None:
+        return None
+    duration = None
+    if job.end_time is not None:
+        duration = max(0.0, (job.end_time - job.start_time).total_seconds())
+    key = (job.source, job.target, job.start_time.date())
+    return key, dict(status=job.status, start_time=job.start_time, duration=duration,
+                     transferred_bytes=job.transferred_bytes, transferred_files=job.transferred_files,
+                     sign=sign)
+
+
+class _PreviousValues:
+    """Values of an instance's RUN_COLUMNS before the current flush"""
+
+    def __init__(self, instance):
+        state = inspect(instance)
+        for name in RUN_COLUMNS:
+            history = state.attrs[name].history
+            value = history.deleted[0] if history.deleted else getattr(instance, name)
+            setattr(self, name, value)
+
+
+def _apply_runs(connection, runs):
+    """Add runs [(key, kwargs)] to the job_run_stats rows, inside the current transaction"""
+    table = JobRunStats.__table__
+    grouped = {}
+    for key, values in runs:
+        grouped.setdefault(key, []).append(values)
+
+    for (source, target, day), values_list in grouped.items():
+        row = connection.execute(
+            select(table).where(table.c.source == source, table.c.target == target, table.c.day == day)
+        ).first()
+        rollup = Rollup.from_row(row) if row is not None else Rollup()
+        for values in values_list:
+            rollup.add_run(**values)
+        if row is not None:
+            connection.execute(update(table).where(table.c.id == row.id).values(**rollup.values()))
+        else:
+            connection.execute(insert(table).values(source=source, target=target, day=day, **rollup.values()))
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_finished_jobs(session, flush_context):
+    """Update the rollups of the jobs whose final state changed in this flush
+
+    Un job che raggiunge uno stato finale viene aggiunto; se lo stato finale di
+    un job già contato viene corretto (es. error -> completed dopo una nuova
+    classificazione del log) il vecchio contributo viene prima ritirato. I job
+    che passano da running a completed/error sono anche misure per l'autotuning
+    del parallelismo (utils/autotune.py).
+    """
+    runs = []
+    samples = []
+    for instance in list(session.dirty) + list(session.new):
+        if not isinstance(instance, SyncJobHistory):
+            continue
+        history = inspect(instance).attrs.status.history
+        if not history.has_changes():
+            continue
+        previous = history.deleted[0] if history.deleted else None
+        if autotune.is_sample(instance, previous):
+            samples.append(instance)
+        if previous not in FINISHED_STATUSES and instance.status not in FINISHED_STATUSES:
+            continue
+        if previous in FINISHED_STATUSES:
+            run = _run_values(_PreviousValues(instance), sign=-1)
+            if run is not None:
+                runs.append(run)
+        run = _run_values(instance)
+        if run is not None:
+            runs.append(run)
+    if runs:
+        try:
+            _apply_runs(session.connection(), runs)
+        except Exception as e:
+            # Le statistiche non devono mai impedire l'aggiornamento dello stato dei job
+            logger.error(f"Error updating job run statistics: {str(e)}")
+    if samples:
+        try:
+            autotune.record_samples(session.connection(), samples)
+        except Exception as e:
+            logger.error(f"Error recording transfer tuning: {str(e)}")
+
+
+def rebuild_rollups():
+    """Recompute all the rollups from the job history and its archive
+
+    Usata per popolare la tabella sui database esistenti. Eseguita in una sola
+    transazione del writer: cancellazione e ricalcolo sono atomici anche se
+    due processi la avviano insieme.
+
+    Returns:
+        int: Number of job_run_stats rows written
+    """
+    def operation(session):
+        connection = session.connection()
+        connection.execute(delete(JobRunStats.__table__))
+        rollups = {}
+        for model in (SyncJobHistoryArchive, SyncJobHistory):
+            table = model.__table__
+            rows = connection.execute(
+                select(*[table.c[name] for name in RUN_COLUMNS])
+                .where(table.c.status.in_(FINISHED_STATUSES))
+            )
+            for row in rows:
+                run = _run_values(row)
+                if run is None:
+                    continue
+                key, values = run
+                rollups.setdefault(key, Rollup()).add_run(**values)
+        if rollups:
+            connection.execute(insert(JobRunStats.__table__), [
+                dict(source=source, target=target, day=day, **rollup.values())
+                for (source, target, day), rollup in rollups.items()
+            ])
+        return len(rollups)
+
+    return db_writer.call(operation).result(timeout=WRITE_TIMEOUT * 10)
+
+
+def ensure_rollups():
+    """Populate the rollups if the table is empty but the history is not (call inside an app context)
+
+    Returns:
+        int: Number of rows written (0 if nothing was needed)
+    """
+    if db.session.query(JobRunStats.id).first() is not None:
+        return 0
+    has_history = any(
+        db.session.query(model.id).filter(model.status.in_(FINISHED_STATUSES)).first() is not None
+        for model in (SyncJobHistory, SyncJobHistoryArchive)
+    )
+    if not has_history:
+        return 0
+    written = rebuild_rollups()
+    logger.info(f"Job run statistics rebuilt from the history: {written} rows")
+    return written
+
+
+def pair_stats(days=DEFAULT_STATS_DAYS, pairs=None, today=None):
+    """Return the statistics of the last `days` days per source/target pair
+
+    Args:
+        days: Number of days (today included)
+        pairs: Optional list of (source, target) to restrict the lookup
+        today: Reference day (default: today)
+
+    Returns:
+        dict: {(source, target): summary dict}
+    """
+    since = (today or datetime.now().date()) - timedelta(days=days - 1)
+    query = JobRunStats.query.filter(JobRunStats.day >= since)
+    if pairs is not None:
+        pairs = list(set(pairs))
+        if not pairs:
+            return {}
+        query = query.filter(tuple_(JobRunStats.source, JobRunStats.target).in_(pairs))
+    rollups = {}
+    for row in query:
+        rollups.setdefault((row.source, row.target), Rollup()).merge(Rollup.from_row(row))
+    return {pair: rollup.summary() for pair, rollup in rollups.items()}
+
+
+def daily_stats(source, target, days=DEFAULT_STATS_DAYS, today=None):
+    """Return the daily statistics of a source/target pair, oldest first"""
+    since = (today or datetime.now().date()) - timedelta(days=days - 1)
+    rows = JobRunStats.query.filter(
+        JobRunStats.source == source, JobRunStats.target == target, JobRunStats.day >= since
+    ).order_by(JobRunStats.day)
+    return [dict(Rollup.from_row(row).summary(), day=row.day.isoformat()) for row in rows]
+
+
+def expected_duration(source, target, default=None, days=DEFAULT_STATS_DAYS):
+    """Return the p95 duration (seconds) of the completed runs of a pair, or default"""
+    stats = pair_stats(days=days, pairs=[(source, target)]).get((source, target))
+    if not stats or stats['duration_p95'] is None:
+        return default
+    return stats['duration_p95']
@@ -0,0 +1,279 @@
+"""
+Job supervisor for RClone Manager.
+
+Un unico event loop asyncio, in un thread dedicato, sorveglia tutti i processi
+rclone avviati dall'applicazione. Ogni processo viene osservato tramite pidfd
+(epoll sul descrittore) quando il kernel lo supporta, altrimenti con un timer di
+polling condiviso. Alla terminazione il processo viene raccolto (reap) e la
+gestione del completamento viene eseguita in un pool di thread di dimensione
+fissa; le operazioni ritardate (es. rimozione dagli active_jobs) sono timer
+del loop. Il numero di thread resta costante qualunque sia il numero di job.
+
+I job eseguiti in un daemon `rclone rcd` (handle con metodo refresh()) non hanno
+un processo locale: vengono interrogati periodicamente da un thread dedicato,
+separato dal pool di completamento, così una gestione lenta (es. la
+classificazione di un log grande) non ritarda l'avanzamento e la fine degli
+altri job.
+"""
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class JobSupervisor:
+    """Single event loop owning all rclone child processes"""
+
+    def __init__(self, poll_interval=1.0, max_workers=2, remote_interval=5.0):
+        """Initialize the supervisor (the loop thread starts lazily)
+
+        Args:
+            poll_interval: Seconds between polls when pidfd is not available
+            max_workers: Threads used to run completion handlers
+            remote_interval: Seconds between refreshes of rclone rcd jobs (in their own thread)
+        """
+        self.poll_interval = poll_interval
+        self.remote_interval = remote_interval
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._remote_executor = None
+        self._watched = {}       # pid -> (process, callback, args)
+        self._outputs = {}       # pid -> (fd, on_data, on_eof)
+        self._pidfds = {}        # pid -> pidfd
+        self._polled = set()     # pid osservati con il timer di polling
+        self._poll_handle = None
+        self._remote = set()     # chiavi dei job rcd (aggiornati con refresh())
+        self._remote_handle = None
+
+    def start(self):
+        """Start the loop thread if it is not running yet"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix="job-completion")
+            # Un solo thread basta: il tick successivo parte solo dopo la fine del precedente
+            self._remote_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-rc-poll")
+            self._thread = threading.Thread(target=self._run, name="job-supervisor", daemon=True)
+            self._thread.start()
+            logger.info("Job supervisor event loop started")
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        except Exception as e:
+            logger.error(f"Job supervisor loop stopped: {str(e)}")
+
+    def watch(self, process, callback, *args):
+        """Watch a subprocess.Popen and call callback(*args) once it has exited
+
+        Il callback viene eseguito nel pool di completamento, mai nel thread del loop,
+        quindi può accedere liberamente a file e database.
+        """
+        self.start()
+        self._loop.call_soon_threadsafe(self._register, process, callback, args)
+
+    def read_output(self, process, on_data, on_eof=None):
+        """Drain process.stdout from the loop, passing each chunk to on_data(bytes)
+
+        La pipe viene letta continuamente in modalità non bloccante, così rclone non
+        si blocca mai per il buffer pieno. on_data e on_eof girano nel thread del
+        loop e devono quindi essere veloci (solo parsing in memoria).
+        """
+        if process.stdout is None:
+            return
+        self.start()
+        self._loop.call_soon_threadsafe(self._register_output, process, on_data, on_eof)
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds as a loop timer"""
+        self.start()
+        self._loop.call_soon_threadsafe(self._loop.call_later, delay, self._run_timer, callback, args)
+
+    def call_soon(self, callback, *args):
+        """Run callback(*args) in the loop thread (thread-safe)"""
+        self.start()
+        self._loop.call_soon_threadsafe(self._run_timer, callback, args)
+
+    @property
+    def watched_count(self):
+        """Number of processes currently being supervised"""
+        return len(self._watched)
+
+    # --- Metodi eseguiti nel thread del loop ---
+
+    def _register(self, process, callback, args):
+        if hasattr(process, 'refresh'):
+            self._register_remote(process, callback, args)
+            return
+
+        pid = process.pid
+        self._watched[pid] = (process, callback, args)
+
+        pidfd = None
+        if hasattr(os, 'pidfd_open'):
+            try:
+                pidfd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                # Il processo è già stato raccolto da qualcun altro
+                self._reap(pid)
+                return
+            except OSError as e:
+                logger.debug(f"pidfd_open not available for PID {pid}: {str(e)}")
+
+        if pidfd is not None:
+            self._pidfds[pid] = pidfd
+            self._loop.add_reader(pidfd, self._on_pidfd_ready, pid)
+        else:
+            self._polled.add(pid)
+            self._schedule_poll()
+
+        logger.info(f"Supervising PID {pid} ({len(self._watched)} processes watched)")
+
+    def _register_remote(self, handle, callback, args):
+        key = handle.watch_key
+        self._watched[key] = (handle, callback, args)
+        self._remote.add(key)
+        self._schedule_remote_poll()
+        logger.info(f"Supervising {key} ({len(self._watched)} jobs watched)")
+
+    def _schedule_remote_poll(self):
+        if self._remote_handle is None and self._remote:
+            self._remote_handle = self._loop.call_later(self.remote_interval, self._remote_tick)
+
+    def _remote_tick(self):
+        self._remote_handle = None
+        keys = [key for key in self._remote if key in self._watched]
+        handles = [self._watched[key][0] for key in keys]
+        # Le chiamate HTTP al daemon sono bloccanti: le eseguiamo fuori dal loop
+        self._remote_executor.submit(self._refresh_remote, keys, handles)
+
+    def _refresh_remote(self, keys, handles):
+        for handle in handles:
+            try:
+                handle.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing {handle.watch_key}: {str(e)}")
+        self._loop.call_soon_threadsafe(self._after_remote_refresh, keys)
+
+    def _after_remote_refresh(self, keys):
+        for key in keys:
+            entry = self._watched.get(key)
+            if entry is None:
+                self._remote.discard(key)
+            elif entry[0].poll() is not None:
+                self._remote.discard(key)
+                self._reap(key)
+        self._schedule_remote_poll()
+
+    def _register_output(self, process, on_data, on_eof):
+        fd = process.stdout.fileno()
+        os.set_blocking(fd, False)
+        self._outputs[process.pid] = (fd, on_data, on_eof)
+        self._loop.add_reader(fd, self._on_output_ready, process.pid)
+
+    def _on_output_ready(self, pid):
+        entry = self._outputs.get(pid)
+        if entry is None:
+            return
+        fd, on_data, on_eof = entry
+        try:
+            chunk = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.debug(f"Error reading output of PID {pid}: {str(e)}")
+            chunk = b''
+        if chunk:
+            self._run_timer(on_data, (chunk, ))
+        else:
+            self._close_output(pid)
+
+    def _drain_output(self, pid):
+        """Read whatever is left in the pipe of an exited process"""
+        entry = self._outputs.get(pid)
+        if entry is None:
+            return
+        fd, on_data, on_eof = entry
+        while True:
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                # Un figlio di rclone tiene ancora aperta la pipe: si continua col reader
+                return
+            except OSError:
+                chunk = b''
+            if not chunk:
+                self._close_output(pid)
+                return
+            self._run_timer(on_data, (chunk, ))
+
+    def _close_output(self, pid):
+        fd, on_data, on_eof = self._outputs.pop(pid)
+        self._loop.remove_reader(fd)
+        if on_eof is not None:
+            self._run_timer(on_eof, ())
+
+    def _on_pidfd_ready(self, pid):
+        pidfd = self._pidfds.pop(pid, None)
+        if pidfd is not None:
+            self._loop.remove_reader(pidfd)
+            os.close(pidfd)
+        self._reap(pid)
+
+    def _schedule_poll(self):
+        if self._poll_handle is None and self._polled:
+            self._poll_handle = self._loop.call_later(self.poll_interval, self._poll_tick)
+
+    def _poll_tick(self):
+        self._poll_handle = None
+        for pid in list(self._polled):
+            entry = self._watched.get(pid)
+            if entry is None or entry[0].poll() is not None:
+                self._reap(pid)
+        self._schedule_poll()
+
+    def _reap(self, pid):
+        entry = self._watched.get(pid)
+        if entry is None:
+            self._polled.discard(pid)
+            return
+        process, callback, args = entry
+
+        # Popen.poll() esegue waitpid(WNOHANG): raccoglie lo zombie e imposta returncode
+        if process.poll() is None:
+            # Notifica spuria: torniamo al polling per questo processo
+            self._polled.add(pid)
+            self._schedule_poll()
+            return
+
+        self._polled.discard(pid)
+        del self._watched[pid]
+        # L'output residuo viene consumato prima della gestione del completamento
+        self._drain_output(pid)
+        self._executor.submit(self._run_callback, callback, args)
+
+    def _run_timer(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Error in supervisor timer {getattr(callback, '__name__', callback)}: {str(e)}")
+
+    @staticmethod
+    def _run_callback(callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Error in job completion handler: {str(e)}")
+
+
+# Istanza condivisa da tutti gli RCloneHandler del processo
+job_supervisor = JobSupervisor()
@@ -0,0 +1,220 @@
+"""
+Log classifier for RClone Manager.
+
+Decide se un job rclone è terminato con successo o con errori leggendo il suo
+file di log in un unico passaggio a blocchi, senza caricarlo in memoria.
+Lo stato della scansione (offset e contatori) può essere salvato e ripreso,
+così un log che cresce viene riletto solo a partire dai byte nuovi.
+
+Criteri (gli stessi usati finora in app.py e rclone_handler.py):
+- errore se compare " ERROR " / " ERROR:" / " FATAL " / " FATAL:" (senza
+  distinzione di maiuscole), "NOTICE: Failed", oppure se la prima riga
+  "Errors:" non contiene "0)";
+- "There was nothing to transfer" fa comunque considerare il job completato.
+"""
+import os
+import logging
+
+from utils.progress import BYTES_RE, FILES_RE, parse_size
+
+logger = logging.getLogger(__name__)
+
+# Dimensione dei blocchi letti dal disco
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Pattern compilati una volta: (contatore, prefiltro, needle, case-insensitive).
+# Il prefiltro è una sottostringa comune a tutte le needle: si conta quella
+# (un solo passaggio in C sul blocco) e le needle esatte solo se compare.
+# Le ricerche case-insensitive avvengono sul blocco convertito in minuscolo.
+_PATTERNS = (
+    ('error_lines', b'error', (b' error ', b' error:'), True),
+    ('fatal_lines', b'fatal', (b' fatal ', b' fatal:'), True),
+    ('failed_notices', b'NOTICE: Failed', (b'NOTICE: Failed', ), False),
+)
+_NOTHING_TO_TRANSFER = b'There was nothing to transfer'
+_ERRORS_MARKER = b'Errors:'
+_TRANSFERRED_MARKER = b'Transferred:'
+
+
+class LogScan:
+    """Resumable result of a log classification"""
+
+    FIELDS = ('offset', 'size', 'mtime', 'error_lines', 'fatal_lines', 'failed_notices',
+              'nothing_to_transfer', 'errors_line', 'transferred_bytes', 'total_bytes',
+              'transferred_files', 'total_files')
+
+    def __init__(self, **values):
+        self.offset = 0               # byte fino a cui il log è stato analizzato (fine riga)
+        self.size = None              # dimensione del file all'ultima scansione
+        self.mtime = None             # mtime del file all'ultima scansione
+        self.error_lines = 0
+        self.fatal_lines = 0
+        self.failed_notices = 0
+        self.nothing_to_transfer = False
+        self.errors_line = None       # testo dopo il primo "Errors:"
+        self.transferred_bytes = None
+        self.total_bytes = None
+        self.transferred_files = None
+        self.total_files = None
+        for key, value in values.items():
+            if key in self.FIELDS:
+                setattr(self, key, value)
+
+    @property
+    def has_errors(self):
+        """True if any error indicator was found (before the nothing-to-transfer rule)"""
+        return bool(self.error_lines or self.fatal_lines or self.failed_notices or
+                    (self.errors_line is not None and '0)' not in self.errors_line))
+
+    @property
+    def verdict(self):
+        """'error' or 'completed'"""
+        if self.has_errors and not self.nothing_to_transfer:
+            return 'error'
+        return 'completed'
+
+    @property
+    def success(self):
+        return self.verdict == 'completed'
+
+    def to_dict(self):
+        """Serializable form (e.g. to persist it in the database)"""
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**(values or {}))
+
+    def copy(self):
+        return LogScan(**self.to_dict())
+
+    def __repr__(self):
+        return f"<LogScan {self.verdict} offset={self.offset} errors={self.error_lines}>"
+
+
+def classify_log(path, state=None, chunk_size=CHUNK_SIZE):
+    """Classify a log file, resuming from state if given
+
+    Args:
+        path: Path of the log file
+        state: Previous LogScan for the same file (only bytes after state.offset are read)
+        chunk_size: Bytes read per block
+
+    Returns:
+        LogScan: New state; the input state is not modified
+
+    Raises:
+        OSError: If the file cannot be opened
+    """
+    scan = state.copy() if state is not None else LogScan()
+
+    stat = os.stat(path)
+    if stat.st_size < scan.offset:
+        # Il file è stato troncato o sostituito: si ricomincia da capo
+        logger.debug(f"Log {path} shrank below saved offset, rescanning from start")
+        scan = LogScan()
+
+    with open(path, 'rb') as f:
+        f.seek(scan.offset)
+        carry = b''
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            data = carry + block if carry else block
+            # Analizziamo solo righe complete: nessun pattern attraversa un a capo,
+            # e l'ultima riga parziale viene riletta alla prossima scansione
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                carry = data
+                continue
+            _scan_lines(scan, data, end)
+            scan.offset += end
+            carry = data[end:]
+
+    scan.size = stat.st_size
+    scan.mtime = stat.st_mtime
+    return scan
+
+
+def _scan_lines(scan, data, end):
+    """Update scan counters with data[:end], a block made of complete lines"""
+    lowered = None
+    for counter, prefilter, needles, ignore_case in _PATTERNS:
+        if ignore_case:
+            if lowered is None:
+                lowered = data[:end].lower()
+            haystack = lowered
+        else:
+            haystack = data
+        if not haystack.count(prefilter, 0, end):
+            continue
+        found = 0
+        for needle in needles:
+            found += haystack.count(needle, 0, end)
+        if found:
+            setattr(scan, counter, getattr(scan, counter) + found)
+
+    if not scan.nothing_to_transfer and data.find(_NOTHING_TO_TRANSFER, 0, end) >= 0:
+        scan.nothing_to_transfer = True
+
+    # Solo la prima riga "Errors:" conta per il verdetto (come nei controlli originali)
+    if scan.errors_line is None:
+        index = data.find(_ERRORS_MARKER, 0, end)
+        if index >= 0:
+            line_end = data.find(b'\n', index)
+            scan.errors_line = data[index + len(_ERRORS_MARKER):line_end].decode('utf-8', 'replace')
+
+    _scan_transferred(scan, data, end)
+
+
+def _scan_transferred(scan, data, end):
+    """Take the last "Transferred:" statistics (bytes and files) of data[:end]"""
+    need_bytes = need_files = True
+    while need_bytes or need_files:
+        index = data.rfind(_TRANSFERRED_MARKER, 0, end)
+        if index < 0:
+            break
+        line_end = data.find(b'\n', index)
+        line = data[index:line_end].decode('utf-8', 'replace')
+        end = index
+
+        match = BYTES_RE.search(line) if need_bytes else None
+        if match:
+            scan.transferred_bytes = parse_size(match.group(1), match.group(2))
+            scan.total_bytes = parse_size(match.group(3), match.group(4))
+            need_bytes = False
+            continue
+        match = FILES_RE.search(line.rstrip()) if need_files else None
+        if match:
+            scan.transferred_files = int(match.group(1))
+            scan.total_files = int(match.group(2))
+            need_files = False
+
+
+def classify_history_log(history):
+    """Classify the log of a SyncJobHistory row, reusing its saved scan state
+
+    Se dimensione e mtime del file coincidono con quelli salvati il risultato
+    viene restituito senza leggere il file; altrimenti si riprende dall'offset
+    salvato e il nuovo stato viene scritto sulla riga (il commit resta al
+    chiamante).
+
+    Args:
+        history: SyncJobHistory with a log_file
+
+    Returns:
+        LogScan: Current classification of the log
+
+    Raises:
+        OSError: If the file cannot be opened
+    """
+    saved = history.log_scan
+    if saved is not None and saved.size is not None:
+        stat = os.stat(history.log_file)
+        if stat.st_size == saved.size and stat.st_mtime == saved.mtime:
+            return saved
+
+    scan = classify_log(history.log_file, saved)
+    history.log_scan = scan
+    return scan
@@ -0,0 +1,385 @@
+"""
+Persistent trigram index of the rclone log files.
+
+Ogni file di log è diviso in blocchi di righe complete (circa BLOCK_SIZE
+byte); per ogni trigramma presente nel file viene salvata una bitmap dei
+blocchi che lo contengono. Una ricerca calcola i trigrammi del testo cercato,
+interseca le bitmap e restituisce solo gli intervalli di byte dei blocchi
+candidati (con il numero della loro prima riga), che vanno poi verificati con
+la ricerca vera e propria.
+
+L'indice vive in un database SQLite separato (instance/log_index.db) ed è
+incrementale: per ogni file si salva l'offset indicizzato, quindi un log che
+cresce viene letto solo dai byte nuovi. I trigrammi sono calcolati sui byte
+convertiti in minuscolo (solo ASCII), così lo stesso indice serve sia le
+ricerche case-sensitive sia quelle case-insensitive.
+"""
+import os
+import zlib
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Dimensione indicativa dei blocchi (tagliati a fine riga)
+BLOCK_SIZE = 128 * 1024
+
+# Le bitmap più grandi di così vengono compresse
+_COMPRESS_MIN = 64
+
+# Massimo numero di parametri per query (limite di SQLite)
+_SQL_BATCH = 500
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        size INTEGER NOT NULL DEFAULT 0,
+        mtime REAL,
+        offset INTEGER NOT NULL DEFAULT 0,
+        lines INTEGER NOT NULL DEFAULT 0,
+        blocks INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS blocks (
+        file_id INTEGER NOT NULL,
+        block INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        end INTEGER NOT NULL,
+        first_line INTEGER NOT NULL,
+        PRIMARY KEY (file_id, block)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS postings (
+        file_id INTEGER NOT NULL,
+        trigram INTEGER NOT NULL,
+        bitmap BLOB NOT NULL,
+        PRIMARY KEY (file_id, trigram)
+    ) WITHOUT ROWID""",
+)
+
+
+def block_trigrams(data):
+    """Return the set of trigram keys (24-bit ints) of an already lowercased block"""
+    # Le righe ripetute (es. blocchi di statistiche) vengono considerate una volta sola;
+    # i trigrammi a cavallo delle righe non servono perché la ricerca è per riga
+    lines = set(data.split(b'\n'))
+    data = b'\n'.join(lines)
+    return {(a << 16) | (b << 8) | c for a, b, c in set(zip(data, data[1:], data[2:]))}
+
+
+def query_trigrams(text, case_sensitive=False):
+    """Return the trigram keys that every line matching text must contain
+
+    Args:
+        text: Literal text searched
+        case_sensitive: Whether the search distinguishes upper/lower case
+
+    Returns:
+        set: Trigram keys (empty if the text is too short to use the index)
+    """
+    if case_sensitive:
+        data = text.encode('utf-8').lower()
+        allow_non_ascii = True
+    else:
+        # In modalità case-insensitive i caratteri non ASCII possono comparire nel log
+        # con un'altra capitalizzazione (l'indice abbassa solo l'ASCII): li escludiamo
+        data = text.lower().encode('utf-8')
+        allow_non_ascii = False
+
+    keys = set()
+    for a, b, c in zip(data, data[1:], data[2:]):
+        if not allow_non_ascii and (a | b | c) & 0x80:
+            continue
+        keys.add((a << 16) | (b << 8) | c)
+    return keys
+
+
+def _encode_bitmap(bits):
+    raw = bytes(bits)
+    if len(raw) > _COMPRESS_MIN:
+        return b'z' + zlib.compress(raw)
+    return b'r' + raw
+
+
+def _decode_bitmap(blob):
+    blob = bytes(blob)
+    if blob[:1] == b'z':
+        return bytearray(zlib.decompress(blob[1:]))
+    return bytearray(blob[1:])
+
+
+def _bitmap_to_int(blob):
+    return int.from_bytes(_decode_bitmap(blob), 'little')
+
+
+class LogIndex:
+    """Incremental trigram index of log files stored in SQLite"""
+
+    def __init__(self, db_path=None, block_size=BLOCK_SIZE):
+        """Initialize the index
+
+        Args:
+            db_path: Path of the SQLite file (can be set later with open())
+            block_size: Approximate size in bytes of the indexed blocks
+        """
+        self.db_path = None
+        self.block_size = block_size
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        if db_path:
+            self.open(db_path)
+
+    def open(self, db_path):
+        """Set the database path and create the schema if needed"""
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connection()
+        with conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+
+    @property
+    def enabled(self):
+        return self.db_path is not None
+
+    def _connection(self):
+        # Una connessione per thread: sqlite3 non condivide le connessioni tra thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Aggiornamento ---
+
+    def update_file(self, path):
+        """Index the bytes appended to path since the last update
+
+        Args:
+            path: Log file path
+
+        Returns:
+            int: Number of bytes indexed by this call
+        """
+        if not self.enabled:
+            return 0
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return 0
+
+        with self._write_lock:
+            conn = self._connection()
+            row = conn.execute("SELECT id, size, mtime, offset, lines, blocks FROM files WHERE path = ?",
+                               (path, )).fetchone()
+            if row is not None and row[1] == stat.st_size and row[2] == stat.st_mtime:
+                return 0
+
+            if row is not None and stat.st_size < row[3]:
+                # Il file è stato troncato o sostituito: si ricomincia da capo
+                logger.debug(f"Log {path} shrank below indexed offset, reindexing")
+                self._drop_file(conn, row[0])
+                row = None
+
+            if row is None:
+                # OR IGNORE: un altro worker può aver appena inserito lo stesso file
+                with conn:
+                    conn.execute("INSERT OR IGNORE INTO files (path) VALUES (?)", (path, ))
+                file_id = conn.execute("SELECT id FROM files WHERE path = ?", (path, )).fetchone()[0]
+                offset, lines, block = 0, 0, 0
+            else:
+                file_id, _, _, offset, lines, block = row
+
+            try:
+                indexed = self._index_from(conn, file_id, path, stat, offset, lines, block)
+            except OSError as e:
+                logger.error(f"Error indexing log file {path}: {str(e)}")
+                return 0
+        if indexed:
+            logger.debug(f"Indexed {indexed} bytes of {path}")
+        return indexed
+
+    def _index_from(self, conn, file_id, path, stat, offset, lines, block):
+        """Index complete lines of path starting at offset, in a single transaction"""
+        new_blocks = []
+        occurrences = {}  # trigramma -> lista di blocchi nuovi che lo contengono
+        start = offset
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            carry = b''
+            while True:
+                chunk = f.read(self.block_size)
+                if not chunk:
+                    break
+                data = carry + chunk if carry else chunk
+                end = data.rfind(b'\n') + 1
+                if end == 0:
+                    # Riga più lunga di un blocco: si continua a leggere
+                    carry = data
+                    continue
+                body = data[:end]
+                for key in block_trigrams(body.lower()):
+                    occurrences.setdefault(key, []).append(block)
+                new_blocks.append((file_id, block, start, start + end, lines))
+                lines += body.count(b'\n')
+                start += end
+                block += 1
+                carry = data[end:]
+
+        with conn:
+            if new_blocks:
+                conn.executemany("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?)", new_blocks)
+                self._merge_postings(conn, file_id, occurrences, fresh=offset == 0)
+            conn.execute("UPDATE files SET size = ?, mtime = ?, offset = ?, lines = ?, blocks = ? WHERE id = ?",
+                         (stat.st_size, stat.st_mtime, start, lines, block, file_id))
+        return start - offset
+
+    def _merge_postings(self, conn, file_id, occurrences, fresh):
+        """OR the new block numbers into the stored bitmaps"""
+        existing = {}
+        if not fresh:
+            keys = list(occurrences)
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                for trigram, blob in conn.execute(
+                        f"SELECT trigram, bitmap FROM postings WHERE file_id = ? AND trigram IN ({placeholders})",
+                        [file_id] + batch):
+                    existing[trigram] = _decode_bitmap(blob)
+
+        rows = []
+        for trigram, blocks in occurrences.items():
+            bits = existing.get(trigram) or bytearray()
+            needed = blocks[-1] // 8 + 1
+            if len(bits) < needed:
+                bits.extend(b'\0' * (needed - len(bits)))
+            for number in blocks:
+                bits[number >> 3] |= 1 << (number & 7)
+            rows.append((file_id, trigram, _encode_bitmap(bits)))
+        conn.executemany("INSERT OR REPLACE INTO postings VALUES (?, ?, ?)", rows)
+
+    def _drop_file(self, conn, file_id):
+        with conn:
+            conn.execute("DELETE FROM postings WHERE file_id = ?", (file_id, ))
+            conn.execute("DELETE FROM blocks WHERE file_id = ?", (file_id, ))
+            conn.execute("DELETE FROM files WHERE id = ?", (file_id, ))
+
+    def remove_missing(self, keep_paths=None):
+        """Drop the index of files that no longer exist (or are not in keep_paths)
+
+        Returns:
+            int: Number of files removed from the index
+        """
+        if not self.enabled:
+            return 0
+        removed = 0
+        with self._write_lock:
+            conn = self._connection()
+            for file_id, path in conn.execute("SELECT id, path FROM files").fetchall():
+                if (keep_paths is not None and path not in keep_paths) or not os.path.exists(path):
+                    self._drop_file(conn, file_id)
+                    removed += 1
+        return removed
+
+    def update_all(self, paths):
+        """Bring the index up to date for every path, returning the bytes indexed"""
+        total = 0
+        for path in paths:
+            total += self.update_file(path)
+        return total
+
+    # --- Ricerca ---
+
+    def candidate_ranges(self, path, text, case_sensitive=False):
+        """Return the byte ranges of path that can contain lines matching text
+
+        Il file viene prima aggiornato (solo i byte nuovi). I blocchi senza tutti i
+        trigrammi del testo sono scartati; la coda non ancora indicizzata (l'ultima
+        riga incompleta di un log in crescita) viene sempre restituita.
+
+        Args:
+            path: Log file path
+            text: Literal text searched
+            case_sensitive: Whether the search distinguishes upper/lower case
+
+        Returns:
+            list: (start, end, first_line) tuples, merged and sorted by offset; the
+                whole file [(0, size, 0)] if the index cannot be used
+        """
+        keys = query_trigrams(text, case_sensitive)
+        if not self.enabled or not keys:
+            return [(0, os.path.getsize(path), 0)]
+
+        self.update_file(path)
+        conn = self._connection()
+        row = conn.execute("SELECT id, offset, lines, blocks FROM files WHERE path = ?", (path, )).fetchone()
+        if row is None:
+            return [(0, os.path.getsize(path), 0)]
+        file_id, indexed_offset, indexed_lines, block_count = row
+
+        candidates = None
+        keys = list(keys)
+        for i in range(0, len(keys), _SQL_BATCH):
+            batch = keys[i:i + _SQL_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            found = conn.execute(
+                f"SELECT bitmap FROM postings WHERE file_id = ? AND trigram IN ({placeholders})",
+                [file_id] + batch).fetchall()
+            if len(found) < len(batch):
+                # Almeno un trigramma non compare in nessun blocco
+                candidates = 0
+                break
+            for (blob, ) in found:
+                bits = _bitmap_to_int(blob)
+                candidates = bits if candidates is None else candidates & bits
+                if not candidates:
+                    break
+            if not candidates:
+                break
+
+        selected = set()
+        if candidates:
+            # bin() elenca i bit dal più significativo: lo invertiamo per avere il blocco 0 per primo
+            for number, bit in enumerate(bin(candidates)[:1:-1]):
+                if bit == '1':
+                    selected.add(number)
+        size = os.path.getsize(path)
+        selected = sorted(n for n in selected if 0 <= n < block_count)
+
+        ranges = []
+        for i in range(0, len(selected), _SQL_BATCH):
+            batch = selected[i:i + _SQL_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            for start, end, first_line in conn.execute(
+                    f"SELECT start, end, first_line FROM blocks WHERE file_id = ? AND block IN ({placeholders}) "
+                    f"ORDER BY block", [file_id] + batch):
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1] = (ranges[-1][0], end, ranges[-1][2])
+                else:
+                    ranges.append((start, end, first_line))
+
+        # Coda non indicizzata (riga incompleta di un log ancora in scrittura)
+        if size > indexed_offset:
+            if ranges and ranges[-1][1] == indexed_offset:
+                ranges[-1] = (ranges[-1][0], size, ranges[-1][2])
+            else:
+                ranges.append((indexed_offset, size, indexed_lines))
+        return ranges
+
+    def stats(self):
+        """Return a summary of the index (files, blocks, postings, indexed bytes)"""
+        if not self.enabled:
+            return {'enabled': False}
+        conn = self._connection()
+        files, indexed = conn.execute("SELECT COUNT(*), COALESCE(SUM(offset), 0) FROM files").fetchone()
+        blocks = conn.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+        postings = conn.execute("SELECT COUNT(*) FROM postings").fetchone()[0]
+        return {'enabled': True, 'files': files, 'blocks': blocks, 'postings': postings,
+                'indexed_bytes': indexed}
+
+
+# Istanza condivisa: app.py la apre su instance/log_index.db all'avvio
+log_index = LogIndex()
@@ -0,0 +1,361 @@
+"""
+Parallel log search engine for RClone Manager.
+
+I file di log (o, con l'indice a trigrammi, i soli intervalli candidati)
+vengono divisi in pezzi di righe complete e distribuiti a un pool di processi.
+Ogni worker mappa il file con mmap e lo scandisce con un pattern compilato
+sui byte, senza decodificare le righe che non corrispondono. I risultati sono
+restituiti da un generatore nell'ordine dei file (cioè per data) e dei pezzi,
+mentre i pezzi successivi sono già in elaborazione; al raggiungimento di
+max_results un flag condiviso ferma i worker e i pezzi in coda vengono
+annullati.
+
+Modalità di ricerca:
+- testo letterale (default): il testo viene escapato; l'indice a trigrammi
+  limita la scansione ai blocchi candidati
+- regex: il testo è un'espressione regolare Python (sui byte; senza
+  distinzione di maiuscole solo per i caratteri ASCII), applicata riga per riga
+"""
+import os
+import re
+import mmap
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Dimensione massima di un pezzo assegnato a un worker (tagliato a fine riga)
+PIECE_SIZE = 8 * 1024 * 1024
+
+# Ricerche contemporanee che possono essere fermate in anticipo
+STOP_SLOTS = 32
+
+# Byte contati per volta per aggiornare i numeri di riga
+_COUNT_CHUNK = 4 * 1024 * 1024
+
+# Flag di stop condivisi con i worker (impostati dall'initializer del pool)
+_stop_flags = None
+
+
+def _init_worker(flags):
+    global _stop_flags
+    _stop_flags = flags
+
+
+def _stopped(slot):
+    return slot is not None and _stop_flags is not None and _stop_flags[slot]
+
+
+@lru_cache(maxsize=32)
+def _compile(pattern, flags):
+    return re.compile(pattern, flags)
+
+
+def build_pattern(text, regex=False, case_sensitive=False):
+    """Return (bytes pattern, flags) for a search
+
+    Args:
+        text: Searched text or regular expression
+        regex: If True text is a regular expression, otherwise a literal
+        case_sensitive: Whether upper/lower case must match
+
+    Returns:
+        tuple: (pattern, flags) ready for re.compile on bytes
+
+    Raises:
+        re.error: If regex is True and text is not a valid expression
+    """
+    flags = re.MULTILINE if regex else 0
+    if not case_sensitive:
+        flags |= re.IGNORECASE
+
+    if regex:
+        pattern = text.encode('utf-8')
+    elif case_sensitive:
+        pattern = re.escape(text.encode('utf-8'))
+    else:
+        # re.IGNORECASE sui byte vale solo per l'ASCII: per gli altri caratteri
+        # si elencano esplicitamente le varianti maiuscole/minuscole
+        parts = []
+        for char in text:
+            variants = {char, char.lower(), char.upper()}
+            if char.isascii() or len(variants) == 1:
+                parts.append(re.escape(char.encode('utf-8')))
+            else:
+                parts.append(b'(?:' + b'|'.join(re.escape(v.encode('utf-8')) for v in sorted(variants)) + b')')
+        pattern = b''.join(parts)
+
+    _compile(pattern, flags)  # solleva re.error subito, nel processo principale
+    return pattern, flags
+
+
+def highlight_pattern(text, regex=False, case_sensitive=False):
+    """Return the str pattern used to highlight matches in the result lines"""
+    flags = 0 if case_sensitive else re.IGNORECASE
+    return re.compile(text if regex else re.escape(text), flags)
+
+
+def _count_newlines(mm, start, end):
+    count = 0
+    while start < end:
+        stop = min(end, start + _COUNT_CHUNK)
+        count += mm[start:stop].count(b'\n')
+        start = stop
+    return count
+
+
+def _decode(data):
+    return data.decode('utf-8', 'replace')
+
+
+def search_piece(task):
+    """Search one piece of a log file (runs in a worker process)
+
+    Args:
+        task: Tuple (slot, path, start, end, pattern, flags, context, limit)
+
+    Returns:
+        tuple: (matches, newlines) where matches is a list of
+            (relative line number, before lines, line, after lines) and newlines
+            is the number of lines of the piece (None if the scan stopped early)
+    """
+    slot, path, start, end, pattern, flags, context, limit = task
+    if _stopped(slot):
+        return [], None
+
+    compiled = _compile(pattern, flags)
+    matches = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = min(end, size)
+        if start >= end:
+            return [], 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            line_no = 0
+            counted = start
+            pos = start
+            while pos < end:
+                match = compiled.search(mm, pos, end)
+                if match is None:
+                    break
+                index = mm.rfind(b'\n', start, match.start())
+                line_start = index + 1 if index >= 0 else start
+                line_end = mm.find(b'\n', match.start(), size)
+                line_end = size if line_end < 0 else line_end + 1
+
+                if mm.find(b'\n', match.start(), match.end() - 1) >= 0:
+                    # La regex ha attraversato un a capo (es. \s o [^x]): si cerca
+                    # di nuovo limitando la ricerca alla riga
+                    content_end = line_end - 1 if mm[line_end - 1:line_end] == b'\n' else line_end
+                    if compiled.search(mm, line_start, content_end) is None:
+                        pos = line_end
+                        continue
+
+                line_no += _count_newlines(mm, counted, line_start)
+                counted = line_start
+
+                # Righe di contesto (anche fuori dal pezzo: il file è mappato per intero)
+                before = []
+                cursor = line_start
+                while len(before) < context and cursor > 0:
+                    index = mm.rfind(b'\n', 0, cursor - 1)
+                    before.append(_decode(mm[index + 1:cursor]))
+                    cursor = index + 1
+                before.reverse()
+                after = []
+                cursor = line_end
+                while len(after) < context and cursor < size:
+                    index = mm.find(b'\n', cursor)
+                    stop = size if index < 0 else index + 1
+                    after.append(_decode(mm[cursor:stop]))
+                    cursor = stop
+
+                matches.append((line_no, before, _decode(mm[line_start:line_end]), after))
+                if len(matches) >= limit or _stopped(slot):
+                    return matches, None
+                # Un solo risultato per riga, come la ricerca originale
+                pos = line_end
+
+            newlines = line_no + _count_newlines(mm, counted, end)
+    return matches, newlines
+
+
+class LogSearch:
+    """Process pool that scans log files in parallel"""
+
+    def __init__(self, workers=None, piece_size=PIECE_SIZE):
+        """Initialize the engine (the pool is started at the first search)
+
+        Args:
+            workers: Number of worker processes (default: number of CPUs)
+            piece_size: Maximum bytes of a piece handed to a worker
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.piece_size = piece_size
+        self._pool = None
+        self._flags = None
+        self._free_slots = list(range(STOP_SLOTS))
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None and self.workers > 1:
+                try:
+                    # Niente fork: il worker gunicorn ha altri thread (scheduler, writer,
+                    # supervisor) e un figlio creato con fork ne erediterebbe i lock.
+                    # Il forkserver carica solo questo modulo (solo libreria standard),
+                    # non __main__, e i task portano già percorsi e pattern
+                    if 'forkserver' in multiprocessing.get_all_start_methods():
+                        context = multiprocessing.get_context('forkserver')
+                        context.set_forkserver_preload([__name__])
+                    else:
+                        context = multiprocessing.get_context('spawn')
+                    self._flags = context.Array('b', STOP_SLOTS, lock=False)
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=context,
+                                                     initializer=_init_worker, initargs=(self._flags, ))
+                    logger.info(f"Log search pool started with {self.workers} workers")
+                except Exception as e:
+                    logger.error(f"Cannot start log search pool, searching in-process: {str(e)}")
+                    self.workers = 1
+            return self._pool
+
+    def _acquire_slot(self):
+        with self._lock:
+            if self._flags is None or not self._free_slots:
+                return None
+            slot = self._free_slots.pop()
+            self._flags[slot] = 0
+            return slot
+
+    def _release_slot(self, slot):
+        if slot is None:
+            return
+        with self._lock:
+            self._free_slots.append(slot)
+
+    def _pieces(self, path, ranges):
+        """Split (start, end, first_line) ranges into line-aligned pieces of at most piece_size bytes
+
+        Solo il primo pezzo di ogni intervallo ha il numero di riga iniziale; per gli
+        altri è None e viene calcolato dal conteggio delle righe del pezzo precedente.
+        """
+        pieces = []
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return pieces
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for start, end, first_line in ranges:
+                    end = min(end, size)
+                    base = first_line
+                    while start < end:
+                        cut = end
+                        if end - start > self.piece_size:
+                            index = mm.find(b'\n', start + self.piece_size, end)
+                            cut = end if index < 0 else index + 1
+                        pieces.append((start, cut, base))
+                        start = cut
+                        base = None
+        return pieces
+
+    def search(self, files, text, regex=False, case_sensitive=False, context_lines=0,
+               max_results=1000, ranges_for=None):
+        """Search text in the log files, yielding results in file order
+
+        Args:
+            files: List of (job_id, path, date) in the order results must follow
+            text: Text or regular expression to search
+            regex: Interpret text as a regular expression
+            case_sensitive: Whether upper/lower case must match
+            context_lines: Lines of context returned around each match
+            max_results: Stop after this many matching lines
+            ranges_for: Optional callable(path) -> list of (start, end, first_line)
+                candidate ranges (e.g. from the trigram index); whole files if None
+
+        Yields:
+            dict: job_id, path, date, line (0-based), before, text, after
+
+        Raises:
+            re.error: If regex is True and text is not a valid expression
+        """
+        pattern, flags = build_pattern(text, regex, case_sensitive)
+        pool = self._get_pool()
+        slot = self._acquire_slot() if pool is not None else None
+        window = self.workers * 2
+        pending = deque()
+        file_iter = iter(files)
+        found = 0
+
+        def submit_next_file():
+            # Calcola i pezzi del prossimo file e li mette in coda
+            for job_id, path, date in file_iter:
+                try:
+                    ranges = ranges_for(path) if ranges_for else [(0, os.path.getsize(path), 0)]
+                    pieces = self._pieces(path, ranges)
+                except Exception as e:
+                    logger.error(f"Error preparing search of {path}: {str(e)}")
+                    continue
+                for start, end, base in pieces:
+                    task = (slot, path, start, end, pattern, flags, context_lines, max_results - found)
+                    if pool is not None:
+                        future = pool.submit(search_piece, task)
+                    else:
+                        future = Future()
+                        future.set_result(search_piece(task))
+                    pending.append((future, job_id, path, date, base))
+                return True
+            return False
+
+        try:
+            line_base = 0
+            more_files = True
+            while True:
+                while more_files and len(pending) < window:
+                    more_files = submit_next_file()
+                if not pending:
+                    break
+
+                future, job_id, path, date, base = pending.popleft()
+                try:
+                    matches, newlines = future.result()
+                except Exception as e:
+                    logger.error(f"Error searching log file {path}: {str(e)}")
+                    matches, newlines = [], None
+                if base is not None:
+                    line_base = base
+
+                for line_no, before, line, after in matches:
+                    yield {
+                        'job_id': job_id,
+                        'path': path,
+                        'date': date,
+                        'line': line_base + line_no,
+                        'before': before,
+                        'text': line,
+                        'after': after,
+                    }
+                    found += 1
+                    if found >= max_results:
+                        return
+                line_base += newlines or 0
+        finally:
+            # Ferma i worker ancora attivi e annulla i pezzi non ancora avviati
+            if slot is not None:
+                self._flags[slot] = 1
+            for future, *_ in pending:
+                future.cancel()
+            self._release_slot(slot)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+# Istanza condivisa usata da /search_logs
+log_search = LogSearch()
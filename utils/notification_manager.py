@@ -3,7 +3,10 @@ Notification manager module for handling browser notifications.
 """
 import logging
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
 from models import db, Notification, UserSettings
+from utils.event_bus import event_bus
+from utils.db_writer import db_writer, WRITE_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
@@ -37,11 +40,7 @@ def mark_notification_read(notification_id):
         Boolean indicating success
     """
     try:
-        notification = Notification.query.get(notification_id)
-        if notification:
-            notification.read = True
-            db.session.commit()
-            return True
+        return db_writer.update(Notification, notification_id, read=True).result(timeout=WRITE_TIMEOUT)
     except Exception as e:
         logger.error(f"Error marking notification as read: {str(e)}")
     
@@ -55,12 +54,11 @@ def mark_all_read():
         Number of notifications marked as read
     """
     try:
-        count = Notification.query.filter_by(read=False).update({"read": True})
-        db.session.commit()
-        return count
+        return db_writer.call(
+            lambda session: session.query(Notification).filter_by(read=False).update({"read": True})
+        ).result(timeout=WRITE_TIMEOUT)
     except Exception as e:
         logger.error(f"Error marking all notifications as read: {str(e)}")
-        db.session.rollback()
         return 0
 
 
@@ -73,7 +71,7 @@ def add_notification(title, message, level="info"):
         level: Notification level (info, success, warning, error)
     
     Returns:
-        The created notification or None if there was an error
+        The created notification as a dictionary, or None if there was an error
     """
     try:
         # Check if notifications are enabled
@@ -82,14 +80,18 @@ def add_notification(title, message, level="info"):
             logger.info("Notifications are disabled, skipping")
             return None
         
-        notification = Notification(
+        # Inserimento tramite il writer: il dizionario è calcolato nella stessa transazione
+        notification = db_writer.insert(
+            Notification,
+            result=lambda n: n.to_dict(),
             title=title,
             message=message,
             level=level,
             created_at=datetime.now()
-        )
-        db.session.add(notification)
-        db.session.commit()
+        ).result(timeout=WRITE_TIMEOUT)
+        
+        # Push ai browser collegati a /api/events
+        event_bus.publish('notification', notification, key=('notification', notification['id']))
         
         return notification
     except Exception as e:
@@ -111,6 +113,11 @@ def notify_job_started(job_id, source, target, is_scheduled=False, dry_run=False
     Returns:
         The created notification or None if there was an error
     """
+    event_bus.publish('job_started', {
+        'job_id': job_id, 'source': source, 'target': target,
+        'is_scheduled': is_scheduled, 'dry_run': dry_run
+    }, key=('job_started', job_id))
+    
     mode = "Dry Run" if dry_run else "Live"
     trigger = "schedulatore" if is_scheduled else "manualmente"
     
@@ -133,6 +140,11 @@ def notify_job_completed(job_id, source, target, success=True, duration=None):
     Returns:
         The created notification or None if there was an error
     """
+    event_bus.publish('job_completed', {
+        'job_id': job_id, 'source': source, 'target': target,
+        'status': 'completed' if success else 'error', 'duration': duration
+    }, key=('job_finished', job_id))
+    
     level = "success" if success else "error"
     status = "completato con successo" if success else "terminato con errori"
     
@@ -169,7 +181,12 @@ def get_user_settings():
             settings_json='{}'
         )
         db.session.add(settings)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Creata nel frattempo da un altro thread o processo
+            db.session.rollback()
+            settings = UserSettings.query.get(1)
     
     return settings
 
@@ -0,0 +1,342 @@
+"""
+Process table service for RClone Manager.
+
+Legge la tabella dei processi direttamente da /proc invece di eseguire `ps aux`,
+mantiene uno snapshot in cache per un breve TTL e indicizza i processi rclone
+per PID e per (operazione, source, target).
+"""
+import os
+import time
+import logging
+import subprocess
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+PROC_ROOT = "/proc"
+
+# Operazioni rclone che consideriamo "job" reali (stesso elenco usato dai vecchi filtri su ps aux)
+RCLONE_OPERATIONS = frozenset([
+    'sync', 'copy', 'move', 'check', 'ls', 'lsd', 'lsl', 'md5sum', 'sha1sum',
+    'size', 'delete', 'mkdir', 'rmdir', 'rcat', 'cat', 'copyto', 'moveto',
+    'copyurl', 'mount', 'about', 'cleanup', 'dedupe', 'version', 'touch', 'serve'
+])
+
+
+class ProcessInfo:
+    """Single process entry parsed from /proc"""
+
+    __slots__ = ('pid', 'argv', 'state', 'start_ticks', 'start_time',
+                 'operation', 'source', 'target', 'log_file')
+
+    def __init__(self, pid, argv, state=None, start_ticks=None, start_time=None):
+        self.pid = pid
+        self.argv = argv
+        self.state = state
+        self.start_ticks = start_ticks
+        self.start_time = start_time
+        self.operation = None
+        self.source = None
+        self.target = None
+        self.log_file = None
+
+    @property
+    def command(self):
+        """Command line as a single string (equivalent to the ps COMMAND column)"""
+        return ' '.join(self.argv)
+
+    @property
+    def is_rclone(self):
+        """True if this is a real rclone command (not e.g. journalctl -u rclone)"""
+        return self.operation is not None
+
+    def __repr__(self):
+        return f"<ProcessInfo {self.pid} {self.operation} {self.source} -> {self.target}>"
+
+
+def parse_rclone_argv(argv):
+    """Extract (operation, source, target, log_file) from an rclone argv
+
+    Returns (None, None, None, None) if argv is not an rclone job command.
+    """
+    if len(argv) < 2:
+        return None, None, None, None
+
+    executable = argv[0]
+    if executable != 'rclone' and not executable.endswith('/rclone'):
+        return None, None, None, None
+
+    operation = argv[1]
+    if operation not in RCLONE_OPERATIONS:
+        return None, None, None, None
+
+    # I nostri comandi hanno la forma: rclone <op> <source> <target> --flag ...
+    positional = []
+    for arg in argv[2:]:
+        if arg.startswith('-'):
+            break
+        positional.append(arg)
+
+    source = positional[0] if len(positional) > 0 else None
+    target = positional[1] if len(positional) > 1 else None
+
+    # Fallback per comandi con flag prima degli argomenti posizionali:
+    # prima parola con ':' come source, la successiva con ':' o '/' come target
+    if source is None or target is None:
+        words = argv[2:]
+        source_index = -1
+        for i, word in enumerate(words):
+            if ':' in word and not word.startswith('-'):
+                source = word
+                source_index = i
+                break
+        if source_index >= 0:
+            for word in words[source_index + 1:]:
+                if not word.startswith('-') and ((':' in word) or ('/' in word)):
+                    target = word
+                    break
+
+    log_file = None
+    for i, arg in enumerate(argv):
+        if arg == '--log-file' and i + 1 < len(argv):
+            log_file = argv[i + 1]
+            break
+        if arg.startswith('--log-file='):
+            log_file = arg.split('=', 1)[1]
+            break
+
+    return operation, source, target, log_file
+
+
+class ProcessSnapshot:
+    """Immutable view of the process table at a given instant"""
+
+    def __init__(self, processes, taken_at):
+        self.taken_at = taken_at
+        self.by_pid = {p.pid: p for p in processes}
+        self.rclone = [p for p in processes if p.is_rclone]
+        self.by_job = {}
+        for proc in self.rclone:
+            key = (proc.operation, proc.source, proc.target)
+            self.by_job.setdefault(key, []).append(proc)
+
+    def __len__(self):
+        return len(self.by_pid)
+
+    def get(self, pid):
+        """Return the ProcessInfo for pid, or None"""
+        return self.by_pid.get(pid)
+
+    def is_alive(self, pid):
+        """True if pid exists and is not a zombie"""
+        proc = self.by_pid.get(pid)
+        return proc is not None and proc.state != 'Z'
+
+    def find_job(self, source, target, operation=None, loose=True):
+        """Find rclone processes working on source → target
+
+        Prima cerca una corrispondenza esatta nell'indice (operazione, source, target),
+        poi, come i vecchi filtri su `ps aux`, i processi rclone in cui source e target
+        compaiono in quest'ordine nella riga di comando. Se loose è True prova infine
+        anche con l'ultima parte dei due percorsi (usato solo per i controlli read-only).
+        """
+        matches = []
+        for (op, src, tgt), procs in self.by_job.items():
+            if operation and op != operation:
+                continue
+            if src == source and tgt == target:
+                matches.extend(procs)
+        if matches:
+            return matches
+
+        candidates = [p for p in self.rclone if not operation or p.operation == operation]
+        matches = [p for p in candidates if _in_order(p.command, source, target)]
+        if matches or not loose:
+            return matches
+
+        alt_source = source.split('/')[-1] if '/' in source else source
+        alt_target = target.split('/')[-1] if '/' in target else target
+        return [p for p in candidates if _in_order(p.command, alt_source, alt_target)]
+
+
+def _in_order(text, first, second):
+    """True if `first` appears in text and `second` appears after it"""
+    index = text.find(first)
+    if index < 0:
+        return False
+    return text.find(second, index + len(first)) >= 0
+
+
+class ProcessTable:
+    """Shared, TTL-cached process table backed by /proc"""
+
+    def __init__(self, ttl=2.0, proc_root=PROC_ROOT):
+        """Initialize the process table
+
+        Args:
+            ttl: Seconds a snapshot stays valid before /proc is scanned again
+            proc_root: Mount point of procfs (overridable for benchmarks)
+        """
+        self.ttl = ttl
+        self.proc_root = proc_root
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._clock_ticks = None
+        self._boot_time = None
+
+    def invalidate(self):
+        """Drop the cached snapshot (e.g. after spawning or killing a process)"""
+        with self._lock:
+            self._snapshot = None
+
+    def snapshot(self, max_age=None):
+        """Return a snapshot no older than max_age seconds (default: ttl)"""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            snap = self._snapshot
+            if snap is not None and time.monotonic() - snap.taken_at <= max_age:
+                return snap
+
+            try:
+                if os.path.isdir(os.path.join(self.proc_root, 'self')):
+                    processes = self._scan_proc()
+                else:
+                    processes = self._scan_ps()
+            except Exception as e:
+                logger.error(f"Error scanning process table: {str(e)}")
+                processes = []
+
+            snap = ProcessSnapshot(processes, time.monotonic())
+            self._snapshot = snap
+            return snap
+
+    def rclone_processes(self):
+        """Shortcut for snapshot().rclone"""
+        return self.snapshot().rclone
+
+    def find_job(self, source, target, operation=None, loose=True):
+        """Shortcut for snapshot().find_job(...)"""
+        return self.snapshot().find_job(source, target, operation=operation, loose=loose)
+
+    def is_alive(self, pid):
+        """Check a single pid without waiting for the next full scan"""
+        try:
+            with open(os.path.join(self.proc_root, str(pid), 'stat'), 'rb') as f:
+                state = _parse_stat(f.read())[0]
+            return state != 'Z'
+        except (FileNotFoundError, ProcessLookupError):
+            return False
+        except Exception:
+            return self.snapshot().is_alive(pid)
+
+    def _boot_info(self):
+        """Return (clock ticks per second, boot time as epoch seconds)"""
+        if self._clock_ticks is None:
+            try:
+                self._clock_ticks = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+            except Exception:
+                self._clock_ticks = 100
+        if self._boot_time is None:
+            try:
+                with open(os.path.join(self.proc_root, 'stat'), 'r') as f:
+                    for line in f:
+                        if line.startswith('btime '):
+                            self._boot_time = float(line.split()[1])
+                            break
+            except Exception:
+                pass
+            if self._boot_time is None:
+                try:
+                    with open(os.path.join(self.proc_root, 'uptime'), 'r') as f:
+                        self._boot_time = time.time() - float(f.read().split()[0])
+                except Exception:
+                    self._boot_time = 0.0
+        return self._clock_ticks, self._boot_time
+
+    def _scan_proc(self):
+        """Read every /proc/<pid>/cmdline and /proc/<pid>/stat"""
+        clock_ticks, boot_time = self._boot_info()
+        processes = []
+
+        for entry in os.scandir(self.proc_root):
+            name = entry.name
+            if not name.isdigit():
+                continue
+            pid = int(name)
+            try:
+                with open(f"{entry.path}/cmdline", 'rb') as f:
+                    raw_cmdline = f.read()
+                # I thread del kernel non hanno cmdline: non possono essere rclone
+                if not raw_cmdline:
+                    continue
+                argv = raw_cmdline.rstrip(b'\0').decode('utf-8', 'replace').split('\0')
+            except (FileNotFoundError, ProcessLookupError, PermissionError):
+                continue
+
+            proc = ProcessInfo(pid, argv)
+            operation, source, target, log_file = parse_rclone_argv(argv)
+
+            # /proc/<pid>/stat serve solo per i processi rclone (stato e ora di avvio)
+            if operation is not None:
+                try:
+                    with open(f"{entry.path}/stat", 'rb') as f:
+                        state, start_ticks = _parse_stat(f.read())
+                    proc.state = state
+                    proc.start_ticks = start_ticks
+                    if start_ticks is not None and boot_time:
+                        proc.start_time = datetime.fromtimestamp(boot_time + start_ticks / clock_ticks)
+                except (FileNotFoundError, ProcessLookupError):
+                    continue
+                except Exception:
+                    pass
+                proc.operation = operation
+                proc.source = source
+                proc.target = target
+                proc.log_file = log_file
+
+            processes.append(proc)
+
+        return processes
+
+    def _scan_ps(self):
+        """Fallback per sistemi senza procfs: una sola invocazione di ps"""
+        output = subprocess.check_output(['ps', '-eo', 'pid=,etimes=,args='],
+                                         universal_newlines=True, timeout=5)
+        now = datetime.now()
+        processes = []
+        for line in output.splitlines():
+            parts = line.split(None, 2)
+            if len(parts) < 3 or not parts[0].isdigit():
+                continue
+            argv = parts[2].split()
+            proc = ProcessInfo(int(parts[0]), argv)
+            operation, source, target, log_file = parse_rclone_argv(argv)
+            if operation is not None:
+                proc.operation = operation
+                proc.source = source
+                proc.target = target
+                proc.log_file = log_file
+                if parts[1].isdigit():
+                    proc.start_time = now - timedelta(seconds=int(parts[1]))
+            processes.append(proc)
+        return processes
+
+
+def _parse_stat(raw):
+    """Return (state, starttime ticks) from the content of /proc/<pid>/stat
+
+    Il campo comm (2) può contenere spazi e parentesi, quindi si riparte
+    dall'ultima ')' prima di dividere i campi.
+    """
+    text = raw.decode('utf-8', 'replace')
+    close = text.rfind(')')
+    fields = text[close + 2:].split()
+    state = fields[0] if fields else None
+    # starttime è il campo 22; dopo comm l'indice relativo è 22 - 3 = 19
+    start_ticks = int(fields[19]) if len(fields) > 19 else None
+    return state, start_ticks
+
+
+# Istanza condivisa da handler, app e scheduler
+process_table = ProcessTable()
@@ -0,0 +1,207 @@
+"""
+Progress tracking for RClone Manager.
+
+Interpreta l'output di `rclone --progress` / `--stats` letto dallo stdout del
+processo e mantiene per ogni job un ring buffer di dimensione fissa con gli
+ultimi campioni (byte trasferiti, velocità, ETA, check, errori).
+"""
+import re
+import time
+import threading
+from collections import deque
+
+# Numero di campioni conservati per job (con --stats=15s sono circa 30 minuti)
+DEFAULT_SAMPLES = 120
+
+# Sequenze di escape ANSI usate da --progress per ridisegnare il terminale
+_ANSI_RE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+
+_SIZE = r'([\d.]+)\s*([KkMGTPE]?i?(?:Bytes|B)?)'
+
+# Transferred:   1.234 GiB / 10.000 GiB, 12%, 10.000 MiB/s, ETA 15m0s
+# Transferred:   0 B / 0 B, -, 0 B/s, ETA -   (totale ancora sconosciuto)
+BYTES_RE = re.compile(
+    r'Transferred:\s+' + _SIZE + r'\s*/\s*' + _SIZE +
+    r',\s*(\d+%|-),\s*' + _SIZE + r'/s(?:,\s*ETA\s*(\S+))?')
+# Transferred:           10 / 100, 10%
+FILES_RE = re.compile(r'Transferred:\s+(\d+)\s*/\s*(\d+),\s*(\d+%|-)\s*$')
+# Checks:               100 / 100, 100%
+_CHECKS_RE = re.compile(r'Checks:\s+(\d+)\s*/\s*(\d+)')
+# Errors:                 1 (retrying may help)
+_ERRORS_RE = re.compile(r'Errors:\s+(\d+)')
+# Elapsed time:       1m0.0s
+_ELAPSED_RE = re.compile(r'Elapsed time:\s+(\S+)')
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4,
+          'P': 1024 ** 5, 'E': 1024 ** 6}
+
+
+def parse_size(number, unit):
+    """Convert an rclone size ("1.5", "GiB") to bytes"""
+    try:
+        value = float(number)
+    except ValueError:
+        return None
+    prefix = unit[:1].upper() if unit and unit[:1].upper() in _UNITS else ''
+    return int(value * _UNITS[prefix])
+
+
+def parse_duration(text):
+    """Convert an rclone duration ("1h2m3.5s", "-") to seconds, or None"""
+    if not text or text == '-':
+        return None
+    total = 0.0
+    matched = False
+    for value, unit in re.findall(r'([\d.]+)(ms|[dhms])', text):
+        matched = True
+        value = float(value)
+        total += value * {'d': 86400, 'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}[unit]
+    return total if matched else None
+
+
+def format_bytes(value):
+    """Human readable size (same binary units used by rclone)"""
+    if value is None:
+        return '-'
+    value = float(value)
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if value < 1024 or unit == 'TiB':
+            return f"{value:.1f} {unit}" if unit != 'B' else f"{int(value)} B"
+        value /= 1024
+
+
+class JobProgress:
+    """Incremental parser of rclone stats output with a per-job ring buffer"""
+
+    def __init__(self, max_samples=DEFAULT_SAMPLES, on_sample=None):
+        """Initialize an empty progress tracker
+
+        Args:
+            max_samples: Size of the ring buffer of samples
+            on_sample: Optional callable(progress) invoked after each new sample
+        """
+        self.on_sample = on_sample
+        self.samples = deque(maxlen=max_samples)
+        self.bytes_read = 0
+        self._partial = ''
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def feed(self, data):
+        """Consume a chunk of stdout (bytes or str) and record complete samples"""
+        if isinstance(data, bytes):
+            self.bytes_read += len(data)
+            data = data.decode('utf-8', 'replace')
+        text = _ANSI_RE.sub('', self._partial + data)
+        # --progress ridisegna con \r oltre che con \n
+        lines = re.split(r'[\r\n]', text)
+        self._partial = lines.pop()
+        for line in lines:
+            self._parse_line(line.strip())
+
+    def close(self):
+        """Flush the last partial block when the stream ends"""
+        if self._partial:
+            self._parse_line(self._partial.strip())
+            self._partial = ''
+        self._push()
+
+    def record(self, stats):
+        """Record a sample from an rc core/stats response (rclone rcd mode)"""
+        total_bytes = stats.get('totalBytes')
+        transferred = stats.get('bytes', 0)
+        percent = None
+        if total_bytes:
+            percent = int(transferred * 100 / total_bytes)
+        self._pending = {
+            'timestamp': time.time(),
+            'bytes': transferred,
+            'total_bytes': total_bytes,
+            'percent': percent,
+            'speed': int(stats.get('speed') or 0),
+            'eta': stats.get('eta'),
+            'checks': stats.get('checks', 0),
+            'total_checks': stats.get('totalChecks', 0),
+            'errors': stats.get('errors', 0),
+            'files': stats.get('transfers', 0),
+            'total_files': stats.get('totalTransfers', 0),
+            'elapsed': stats.get('elapsedTime'),
+        }
+        self._push()
+
+    def _parse_line(self, line):
+        if not line:
+            return
+
+        match = BYTES_RE.search(line)
+        if match:
+            # Ogni blocco di statistiche comincia con la riga dei byte trasferiti
+            self._push()
+            percent = match.group(5)
+            self._pending = {
+                'timestamp': time.time(),
+                'bytes': parse_size(match.group(1), match.group(2)),
+                'total_bytes': parse_size(match.group(3), match.group(4)),
+                'percent': int(percent.rstrip('%')) if percent != '-' else None,
+                'speed': parse_size(match.group(6), match.group(7)),
+                'eta': parse_duration(match.group(8)),
+            }
+            return
+
+        if self._pending is None:
+            return
+
+        match = FILES_RE.search(line)
+        if match:
+            self._pending['files'] = int(match.group(1))
+            self._pending['total_files'] = int(match.group(2))
+            return
+
+        match = _CHECKS_RE.search(line)
+        if match:
+            self._pending['checks'] = int(match.group(1))
+            self._pending['total_checks'] = int(match.group(2))
+            return
+
+        match = _ERRORS_RE.search(line)
+        if match:
+            self._pending['errors'] = int(match.group(1))
+            return
+
+        match = _ELAPSED_RE.search(line)
+        if match:
+            self._pending['elapsed'] = parse_duration(match.group(1))
+            self._push()
+
+    def _push(self):
+        if self._pending is not None:
+            with self._lock:
+                self.samples.append(self._pending)
+            self._pending = None
+            if self.on_sample is not None:
+                self.on_sample(self)
+
+    def latest(self):
+        """Return the most recent sample, or None"""
+        with self._lock:
+            return dict(self.samples[-1]) if self.samples else None
+
+    def history(self):
+        """Return a copy of all samples in the ring buffer"""
+        with self._lock:
+            return [dict(sample) for sample in self.samples]
+
+    def to_dict(self, include_history=False):
+        """Summary for the API (latest values, optionally the full history)"""
+        latest = self.latest()
+        if latest is None:
+            result = {'available': False}
+        else:
+            result = dict(latest)
+            result['available'] = True
+            result['speed_formatted'] = f"{format_bytes(latest.get('speed'))}/s"
+            result['bytes_formatted'] = format_bytes(latest.get('bytes'))
+            result['total_bytes_formatted'] = format_bytes(latest.get('total_bytes'))
+        if include_history:
+            result['history'] = self.history()
+        return result
@@ -0,0 +1,279 @@
+"""
+Client for the rclone remote control API (rclone rcd).
+
+Permette a RCloneHandler di eseguire i job dentro un unico daemon `rclone rcd`
+persistente invece di avviare un processo per ogni job: i job vengono inviati
+con `sync/sync` e `_async=true`, seguiti con `job/status`, fermati con
+`job/stop` e le statistiche arrivano da `core/stats` con un `group` per job.
+
+La modalità si attiva impostando RCLONE_RC_URL (es. http://127.0.0.1:5572/),
+con RCLONE_RC_USER / RCLONE_RC_PASS se il daemon richiede autenticazione.
+"""
+import os
+import json
+import time
+import base64
+import signal
+import logging
+import urllib.error
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+# Messaggio di rclone per un job id sconosciuto (HTTP 500, es. dopo un riavvio del daemon)
+JOB_NOT_FOUND = "job not found"
+
+
+def rc_lock(jobid, daemon_pid):
+    """Return the lock file content of an rc job: "rc:<jobid>:<daemon pid>"
+
+    Gli id dei job ripartono da 1 a ogni avvio del daemon: il PID del daemon
+    distingue un lock rimasto da un riavvio precedente da un job attuale.
+    """
+    return f"rc:{jobid}:{daemon_pid}"
+
+
+def parse_rc_lock(content):
+    """Return (jobid, daemon pid or None) of an rc lock, None if content is not an rc lock"""
+    if not content or not content.startswith('rc:'):
+        return None
+    parts = content[3:].split(':')
+    try:
+        jobid = int(parts[0])
+        daemon_pid = int(parts[1]) if len(parts) > 1 else None
+    except ValueError:
+        return None
+    return jobid, daemon_pid
+
+
+class RcError(Exception):
+    """Error returned by the rclone rc API (or by the HTTP transport)"""
+
+    def __init__(self, message, status=None, path=None):
+        super().__init__(message)
+        self.status = status
+        self.path = path
+
+    @property
+    def job_not_found(self):
+        """True if the daemon does not know the job id (whatever the HTTP status)"""
+        return JOB_NOT_FOUND in str(self).lower()
+
+
+class RcClient:
+    """Minimal JSON client for the rclone rc endpoints used by the application"""
+
+    def __init__(self, url, user=None, password=None, timeout=30):
+        """Initialize the client
+
+        Args:
+            url: Base URL of the rc server, e.g. http://127.0.0.1:5572/
+            user: Optional rc user (--rc-user)
+            password: Optional rc password (--rc-pass)
+            timeout: HTTP timeout in seconds for each call
+        """
+        self.url = url.rstrip('/') + '/'
+        self.timeout = timeout
+        self._auth = None
+        if user:
+            token = base64.b64encode(f"{user}:{password or ''}".encode()).decode()
+            self._auth = f"Basic {token}"
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """Build a client from RCLONE_RC_URL/USER/PASS, or return None if rc mode is off"""
+        environ = os.environ if environ is None else environ
+        url = environ.get("RCLONE_RC_URL")
+        if not url:
+            return None
+        return cls(url, environ.get("RCLONE_RC_USER"), environ.get("RCLONE_RC_PASS"))
+
+    def call(self, path, **params):
+        """POST params as JSON to /path and return the decoded JSON response"""
+        body = json.dumps(params).encode('utf-8')
+        req = urllib.request.Request(self.url + path.lstrip('/'), data=body, method='POST')
+        req.add_header('Content-Type', 'application/json')
+        if self._auth:
+            req.add_header('Authorization', self._auth)
+
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                payload = response.read()
+        except urllib.error.HTTPError as e:
+            # rclone risponde con {"error": "...", "status": 500, ...}
+            try:
+                message = json.loads(e.read().decode('utf-8')).get('error', str(e))
+            except Exception:
+                message = str(e)
+            raise RcError(message, status=e.code, path=path)
+        except (urllib.error.URLError, OSError) as e:
+            raise RcError(f"Cannot reach rclone rc at {self.url}: {str(e)}", path=path)
+
+        try:
+            return json.loads(payload.decode('utf-8')) if payload else {}
+        except ValueError as e:
+            raise RcError(f"Invalid JSON from {path}: {str(e)}", path=path)
+
+    # --- Endpoint usati dall'applicazione ---
+
+    def noop(self):
+        """Check that the daemon is reachable"""
+        return self.call('rc/noop')
+
+    def sync(self, source, target, group=None, config=None):
+        """Start an asynchronous sync and return the rc job id
+
+        Args:
+            source: Source fs (remote:path)
+            target: Destination fs (remote:path)
+            group: Stats group used to read progress with core/stats
+            config: Dict of per-job ConfigInfo overrides (passed as _config)
+        """
+        params = {'srcFs': source, 'dstFs': target, '_async': True}
+        if group:
+            params['_group'] = group
+        if config:
+            params['_config'] = config
+        return self.call('sync/sync', **params)['jobid']
+
+    def job_status(self, jobid):
+        """Return job/status for jobid (finished, success, error, ...)"""
+        return self.call('job/status', jobid=jobid)
+
+    def job_stop(self, jobid):
+        """Ask the daemon to stop jobid"""
+        return self.call('job/stop', jobid=jobid)
+
+    def daemon_pid(self):
+        """Return the PID of the daemon (core/pid), which identifies its current run"""
+        return self.call('core/pid').get('pid')
+
+    def job_from_lock(self, content):
+        """Return the job id of an rc lock written for the running daemon
+
+        Returns:
+            int or None: The job id, or None if content is not an rc lock or was
+                written by another run of the daemon (its job ids may now
+                belong to other jobs)
+        """
+        parsed = parse_rc_lock(content)
+        if parsed is None:
+            return None
+        jobid, daemon_pid = parsed
+        current = self.daemon_pid()
+        if daemon_pid is None or daemon_pid != current:
+            logger.info(f"Ignoring stale rc lock {content} (daemon PID now {current})")
+            return None
+        return jobid
+
+    def job_list(self):
+        """Return the ids of the jobs known to the daemon"""
+        return self.call('job/list').get('jobids', [])
+
+    def core_stats(self, group=None):
+        """Return core/stats, optionally for a single stats group"""
+        return self.call('core/stats', group=group) if group else self.call('core/stats')
+
+    def stats_delete(self, group):
+        """Drop the stats of a finished group from the daemon"""
+        return self.call('core/stats-delete', group=group)
+
+    def fsinfo(self, fs):
+        """Return operations/fsinfo for fs (features, hashes, ...)"""
+        return self.call('operations/fsinfo', fs=fs)
+
+
+class RcJobHandle:
+    """Popen-like handle for a job running inside rclone rcd
+
+    Espone poll()/wait()/terminate()/returncode come subprocess.Popen, così il
+    resto del codice (active_jobs, cancel_job, force_cleanup) non deve
+    distinguere i due motori. pid è None: il job vive nel processo del daemon.
+    """
+
+    pid = None
+    stdout = None
+
+    def __init__(self, client, jobid, group, progress=None, daemon_pid=None):
+        """Initialize the handle
+
+        Args:
+            client: RcClient used to query the daemon
+            jobid: rc job id returned by sync/sync
+            group: Stats group of the job
+            progress: Optional JobProgress fed with core/stats samples
+            daemon_pid: PID of the daemon that runs the job (saved in the lock)
+        """
+        self.client = client
+        self.jobid = jobid
+        self.group = group
+        self.daemon_pid = daemon_pid
+        self.progress = progress
+        self.returncode = None
+        self.error = None
+        self.stats = None
+        self._stop_requested = False
+
+    @property
+    def watch_key(self):
+        """Key used by the job supervisor instead of the pid"""
+        return f"rc:{self.jobid}"
+
+    @property
+    def lock_key(self):
+        """Content of the job lock file (job id and daemon PID)"""
+        return rc_lock(self.jobid, self.daemon_pid)
+
+    def refresh(self):
+        """Query job/status and core/stats once (blocking HTTP calls)"""
+        if self.returncode is not None:
+            return self.returncode
+
+        try:
+            self.stats = self.client.core_stats(self.group)
+            if self.progress is not None:
+                self.progress.record(self.stats)
+        except RcError as e:
+            logger.debug(f"core/stats failed for rc job {self.jobid}: {str(e)}")
+
+        try:
+            status = self.client.job_status(self.jobid)
+        except RcError as e:
+            if e.job_not_found:
+                # Il daemon è stato riavviato e non conosce più il job
+                self.error = str(e)
+                self.returncode = 1
+            else:
+                logger.warning(f"job/status failed for rc job {self.jobid}: {str(e)}")
+            return self.returncode
+
+        if status.get('finished'):
+            self.error = status.get('error') or None
+            if status.get('success'):
+                self.returncode = 0
+            elif self._stop_requested:
+                # Stesso codice di un processo terminato con SIGTERM
+                self.returncode = -signal.SIGTERM
+            else:
+                self.returncode = 1
+        return self.returncode
+
+    def poll(self):
+        """Return the last known return code (updated by refresh)"""
+        return self.returncode
+
+    def wait(self, timeout=None, interval=1.0):
+        """Block until the job has finished, refreshing every interval seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.refresh() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"rc job {self.jobid} still running after {timeout}s")
+            time.sleep(interval)
+        return self.returncode
+
+    def terminate(self):
+        """Stop the job through job/stop"""
+        self._stop_requested = True
+        self.client.job_stop(self.jobid)
+
+    kill = terminate
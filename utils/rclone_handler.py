@@ -6,7 +6,21 @@ import logging
 import subprocess
 import sys
 from datetime import datetime, timedelta
-from threading import Thread
+
+from utils.process_table import process_table
+from utils.job_supervisor import job_supervisor
+from utils.progress import JobProgress, format_bytes
+from utils.rc_client import RcError, RcJobHandle
+from utils.log_classifier import classify_log
+from utils.log_index import log_index
+from utils.event_bus import event_bus
+from utils.db_writer import db_writer, WRITE_TIMEOUT
+from utils.remote_capabilities import remote_capabilities
+from utils.remote_inventory import remote_inventory
+from utils.job_config import JobConfig
+from utils.job_queue import job_queue
+from utils.bandwidth import bandwidth_manager
+from utils import autotune
 
 logger = logging.getLogger(__name__)
 
@@ -14,17 +28,21 @@ logger = logging.getLogger(__name__)
 class RCloneHandler:
     """Handler for interacting with rclone and the bash script"""
 
-    def __init__(self, config_path, log_dir):
+    def __init__(self, config_path, log_dir, rc_client=None):
         """Initialize the RClone handler
         
         Args:
             config_path: Path to the rclone configuration file with scheduled jobs
             log_dir: Directory where logs are stored
+            rc_client: Optional RcClient; if set, jobs run inside a persistent
+                `rclone rcd` daemon instead of one rclone process per job
         """
         self.config_path = config_path
         self.log_dir = log_dir
+        self.rc_client = rc_client
         self.active_jobs = {}
         self.main_config_path = "/root/.config/rclone/rclone.conf"
+        self.job_config = JobConfig(config_path)
 
         # Create log directory if it doesn't exist
         os.makedirs(self.log_dir, exist_ok=True)
@@ -116,32 +134,13 @@ class RCloneHandler:
         return f"{source_tag}_TO_{target_tag}"
 
     def get_configured_jobs(self):
-        """Get list of jobs from configuration file"""
-        jobs = []
-
-        if not os.path.exists(self.config_path):
-            logger.warning(f"Config file not found: {self.config_path}")
-            return jobs
+        """Get list of jobs from configuration file
 
-        try:
-            with open(self.config_path, 'r') as f:
-                lines = f.readlines()
-
-            for i, line in enumerate(lines):
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        source, target = parts
-                        jobs.append({
-                            'id': i,
-                            'source': source,
-                            'target': target
-                        })
-        except Exception as e:
-            logger.error(f"Error reading config file: {str(e)}")
-
-        return jobs
+        Returns:
+            list: Dicts with a stable 'id' (hash of source and target), 'source',
+                'target' and 'line'; the file is parsed again only when it changes
+        """
+        return self.job_config.jobs()
 
     def read_config_file(self):
         """Read the current configuration file content"""
@@ -162,15 +161,23 @@ class RCloneHandler:
             # Create directory if it doesn't exist
             os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
 
-            with open(self.config_path, 'w') as f:
-                f.write(content)
+            # Sostituzione atomica: gli altri worker vedono il nuovo inode e rileggono il file
+            self.job_config.save(content)
             return True
         except Exception as e:
             logger.error(f"Error saving config file: {str(e)}")
             raise
 
-    def run_custom_job(self, source, target, dry_run=False):
-        """Run a custom job with source and target"""
+    def run_custom_job(self, source, target, dry_run=False, transfers=None, checkers=None):
+        """Run a custom job with source and target
+
+        Args:
+            source: Source path
+            target: Target path
+            dry_run: Run rclone with --dry-run
+            transfers: Forced --transfers (None = autotuned for the pair of remotes)
+            checkers: Forced --checkers (None = autotuned for the pair of remotes)
+        """
         # Puliamo eventuali spazi extra nelle sorgenti/destinazioni
         source = source.strip()
         target = target.strip()
@@ -204,6 +211,12 @@ class RCloneHandler:
                     f"A job with the same source and target is already running: {source} → {target}"
                 )
 
+        transfers, checkers = self._parallelism(source, target, transfers, checkers)
+
+        # Modalità rcd: il job viene inviato al daemon invece di avviare un processo
+        if self.rc_client is not None:
+            return self._run_rc_job(source, target, dry_run, log_file, lock_file, transfers, checkers)
+
         # Prepare command
         cmd = [
             "/bin/bash", "-c",
@@ -231,81 +244,31 @@ class RCloneHandler:
         tgt_remote = target.split(':', 1)[0] if ':' in target else ""
 
         if src_remote and tgt_remote:
-            # Determine if we can use checksums
-            src_hashes_cmd = f"rclone backend features {src_remote}: --json --no-check-certificate"
-            tgt_hashes_cmd = f"rclone backend features {tgt_remote}: --json --no-check-certificate"
-
-            # Log the hash capability check commands
-            logger.info(f"Checking source hash capabilities: {src_hashes_cmd}")
-            logger.info(f"Checking target hash capabilities: {tgt_hashes_cmd}")
-
-            try:
-                # Crea un ambiente senza variabili proxy
-                my_env = os.environ.copy()
-                for proxy_var in [
-                        'http_proxy', 'https_proxy', 'HTTP_PROXY',
-                        'HTTPS_PROXY'
-                ]:
-                    if proxy_var in my_env:
-                        del my_env[proxy_var]
-                        logger.info(
-                            f"Unset proxy variable for hash check: {proxy_var}"
-                        )
-
-                # Utilizzare Popen invece di run per maggiore compatibilità con versioni Python più vecchie
-                src_process = subprocess.Popen(src_hashes_cmd,
-                                               shell=True,
-                                               stdout=subprocess.PIPE,
-                                               stderr=subprocess.PIPE,
-                                               universal_newlines=True,
-                                               env=my_env)
-                src_stdout, src_stderr = src_process.communicate()
-                src_result_text = src_stdout
-                src_returncode = src_process.returncode
-
-                tgt_process = subprocess.Popen(tgt_hashes_cmd,
-                                               shell=True,
-                                               stdout=subprocess.PIPE,
-                                               stderr=subprocess.PIPE,
-                                               universal_newlines=True,
-                                               env=my_env)
-                tgt_stdout, tgt_stderr = tgt_process.communicate()
-                tgt_result_text = tgt_stdout
-                tgt_returncode = tgt_process.returncode
-
-                src_hashes = []
-                tgt_hashes = []
-
-                if src_returncode == 0:
-                    src_json = json.loads(src_result_text)
-                    src_hashes = src_json.get('Hashes', [])
-
-                if tgt_returncode == 0:
-                    tgt_json = json.loads(tgt_result_text)
-                    tgt_hashes = tgt_json.get('Hashes', [])
-
-                common_hashes = set(src_hashes) & set(tgt_hashes)
-
-                if common_hashes:
-                    cmd[-1] += " --checksum"
-                else:
-                    cmd[-1] += " --size-only"
-            except Exception as e:
-                logger.warning(
-                    f"Error determining hash capability: {str(e)}. Using --size-only"
-                )
+            # Determine if we can use checksums (risposta in cache per remote)
+            common_hashes = remote_capabilities.common_hashes(src_remote, tgt_remote, self.probe_hash_capabilities)
+            logger.info(f"Common hashes of {src_remote} and {tgt_remote}: {sorted(common_hashes) or 'none'}")
+            if common_hashes:
+                cmd[-1] += " --checksum"
+            else:
                 cmd[-1] += " --size-only"
         else:
             # Default to size-only if we can't determine
             cmd[-1] += " --size-only"
 
-        # Add other common options
-        # Non sovrascriviamo i parametri già impostati sopra
-        cmd[-1] += " --transfers=4 --checkers=8"
+        # Parallelismo scelto dall'autotuning (o forzato dal job pianificato)
+        cmd[-1] += f" --transfers={transfers} --checkers={checkers}"
 
         # Add user-requested default flags
         cmd[-1] += " --metadata --use-server-modtime --gcs-bucket-policy-only"
 
+        # Budget di banda: quota iniziale e server rc privato per ribilanciarla
+        # con core/bwlimit mentre il job è in esecuzione
+        bandwidth = bandwidth_manager.launch_options(source, target)
+        if bandwidth is not None:
+            if bandwidth['bwlimit']:
+                cmd[-1] += f" --bwlimit {bandwidth['bwlimit']}"
+            cmd[-1] += f" --rc --rc-addr {bandwidth['rc_addr']}"
+
         # Prepara il comando esatto con tutti gli argomenti
         full_command = cmd[-1]
 
@@ -344,6 +307,11 @@ class RCloneHandler:
                 del my_env[proxy_var]
                 logger.info(f"Unset proxy variable: {proxy_var}")
 
+        # Credenziali rc passate per ambiente: non compaiono nel comando né nei log
+        if bandwidth is not None:
+            my_env['RCLONE_RC_USER'] = bandwidth['rc_user']
+            my_env['RCLONE_RC_PASS'] = bandwidth['rc_pass']
+
         # Modifica: utilizza il parametro shell=True per assicurarci di ottenere l'exit code corretto
         # quando rclone incontra errori (come directory non trovate)
         process = subprocess.Popen(
@@ -352,11 +320,12 @@ class RCloneHandler:
             True,  # Eseguiamo tramite shell per una gestione migliore degli errori
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            universal_newlines=
-            True,  # Equivalente a text=True nelle versioni più recenti
-            env=my_env)
+            env=my_env)  # Output binario: viene letto e interpretato da JobProgress
 
         logger.info(f"Started rclone process with PID {process.pid}")
+        process_table.invalidate()
+        if bandwidth is not None:
+            bandwidth_manager.register(source, target, bandwidth, process.pid)
 
         # Create lock file
         with open(lock_file, 'w') as f:
@@ -383,62 +352,208 @@ class RCloneHandler:
             'process': process,
             'log_file': log_file,
             'lock_file': lock_file,
-            'start_time': datetime.now()
+            'start_time': datetime.now(),
+            'progress': JobProgress(on_sample=self._progress_publisher(source, target)),
+            'transfers': transfers,
+            'checkers': checkers,
+            'bwlimit': bandwidth['bwlimit'] if bandwidth is not None else None
         }
 
         job_key = f"{source}|{target}"
         self.active_jobs[job_key] = job_info
         logger.info(f"Added job to active_jobs dictionary: {job_key}")
 
-        # Start a thread to monitor the job
-        Thread(target=self._monitor_job, args=(job_key, ), daemon=True).start()
+        # Lo stdout (statistiche di --progress) viene consumato di continuo, così la
+        # pipe non si riempie mai; il supervisor raccoglie poi il processo alla
+        # terminazione e chiama _on_job_exit
+        progress = job_info['progress']
+        job_supervisor.read_output(process, progress.feed, progress.close)
+        job_supervisor.watch(process, self._on_job_exit, job_key, job_info)
 
         return job_info
 
-    def run_configured_job(self, job_id, dry_run=False):
-        """Run a configured job from the config file"""
-        jobs = self.get_configured_jobs()
-        job_id = int(job_id)
+    def _parallelism(self, source, target, transfers=None, checkers=None):
+        """Return the (transfers, checkers) of a job: forced values or the autotuned ones"""
+        if transfers is not None and checkers is not None:
+            return transfers, checkers
+        if transfers is not None:
+            # Checkers non forzati: seguono i transfers forzati, come nell'autotuning
+            return transfers, autotune.checkers_for(transfers)
+        from models import db
+        from app import app
+        try:
+            with app.app_context():
+                try:
+                    tuned_transfers, tuned_checkers, reason = autotune.choose(source, target)
+                finally:
+                    db.session.remove()
+            logger.info(f"Autotuned parallelism for {source} → {target}: "
+                        f"--transfers={tuned_transfers} --checkers={tuned_checkers} ({reason})")
+        except Exception as e:
+            logger.error(f"Error choosing the parallelism of {source} → {target}: {str(e)}")
+            tuned_transfers = autotune.DEFAULT_TRANSFERS
+            tuned_checkers = autotune.checkers_for(tuned_transfers)
+        return (transfers if transfers is not None else tuned_transfers,
+                checkers if checkers is not None else tuned_checkers)
+
+    def _run_rc_job(self, source, target, dry_run, log_file, lock_file, transfers, checkers):
+        """Submit a sync to the rclone rcd daemon (sync/sync with _async=true)
+
+        Stesse opzioni della riga di comando, passate come _config del job. Le
+        opzioni di backend (es. --gcs-bucket-policy-only) vanno impostate
+        all'avvio del daemon.
+        """
+        # Il nome del gruppo di statistiche è quello del file di log: unico per job
+        group = os.path.basename(log_file)[:-len(".log")]
+
+        config = {
+            'DryRun': dry_run,
+            'InsecureSkipVerify': True,    # --no-check-certificate
+            'Timeout': '30m',
+            'ConnectTimeout': '2m',
+            'LowLevelRetries': 10,
+            'Transfers': transfers,
+            'Checkers': checkers,
+            'Metadata': True,
+            'UseServerModTime': True,
+        }
+
+        # Checksum solo se source e target hanno almeno un hash in comune; fsinfo
+        # viene risolto dal daemon, senza avviare processi `rclone backend features`
+        src_remote = source.split(':', 1)[0] if ':' in source else ""
+        tgt_remote = target.split(':', 1)[0] if ':' in target else ""
+        use_checksum = False
+        if src_remote and tgt_remote:
+            use_checksum = bool(remote_capabilities.common_hashes(src_remote, tgt_remote,
+                                                                  self.probe_hash_capabilities))
+        if use_checksum:
+            config['CheckSum'] = True
+        else:
+            config['SizeOnly'] = True
 
-        if job_id < 0 or job_id >= len(jobs):
-            raise Exception(f"Invalid job ID: {job_id}")
+        request = {'srcFs': source, 'dstFs': target, '_async': True, '_group': group, '_config': config}
+        logger.info(f"Submitting rc job: sync/sync {json.dumps(request)}")
 
-        job = jobs[job_id]
-        return self.run_custom_job(job['source'], job['target'], dry_run)
+        try:
+            with open(log_file, 'w') as f:
+                f.write(f"=============== COMANDO RCLONE ESEGUITO ===============\n")
+                f.write(f"rc {self.rc_client.url}sync/sync {json.dumps(request)}\n")
+                f.write(f"======================================================\n")
+                # L'output di rclone va nel log del daemon, unico per tutti i job
+                f.write(f"Job eseguito nel daemon rclone rcd: questo log contiene solo il comando "
+                        f"e il riepilogo finale, l'output completo è nel log del daemon\n\n")
+        except Exception as e:
+            logger.error(f"Errore durante la scrittura del comando nel file di log: {str(e)}")
+
+        # Quota del job nel limite del daemon, registrata per escluderlo dall'autotuning
+        bwlimit = bandwidth_manager.launch_limit(source, target)
+        daemon_pid = self.rc_client.daemon_pid()
+        jobid = self.rc_client.sync(source, target, group=group, config=config)
+        # Il limite di banda del daemon è la somma delle quote dei job
+        bandwidth_manager.wake()
+        progress = JobProgress(on_sample=self._progress_publisher(source, target))
+        handle = RcJobHandle(self.rc_client, jobid, group, progress=progress, daemon_pid=daemon_pid)
+        logger.info(f"Started rc job {jobid} (group {group})")
+
+        # Il lock file contiene "rc:<jobid>:<PID del daemon>" al posto del PID
+        for path in (lock_file, f"{lock_file}.bak"):
+            try:
+                with open(path, 'w') as f:
+                    f.write(handle.lock_key)
+            except Exception as e:
+                logger.warning(f"Could not create lock file {path}: {str(e)}")
 
-    def _monitor_job(self, job_key):
-        """Monitor a running job and clean up when done"""
-        import os  # Importiamo os esplicitamente all'interno della funzione
-        import sys
-        import time
+        job_info = {
+            'source': source,
+            'target': target,
+            'dry_run': dry_run,
+            'process': handle,
+            'log_file': log_file,
+            'lock_file': lock_file,
+            'start_time': datetime.now(),
+            'progress': progress,
+            'rc_job_id': jobid,
+            'transfers': transfers,
+            'checkers': checkers,
+            'bwlimit': bwlimit
+        }
 
-        # Verifica iniziale se il job è ancora attivo
-        if job_key not in self.active_jobs:
-            logger.warning(f"Job {job_key} not found in active_jobs, cannot monitor")
-            return
+        job_key = f"{source}|{target}"
+        self.active_jobs[job_key] = job_info
+        logger.info(f"Added job to active_jobs dictionary: {job_key}")
 
-        # Copia locale del job per evitare problemi se viene rimosso mentre è in esecuzione
-        job_copy = self.active_jobs[job_key].copy()
-        process = job_copy['process']
-        
-        # Crea anche un riferimento al job originale ma lo aggiorna ad ogni utilizzo
-        # per evitare race condition se il job viene rimosso
-        
+        job_supervisor.watch(handle, self._on_job_exit, job_key, job_info)
+
+        return job_info
+
+    def _progress_publisher(self, source, target):
+        """Return the JobProgress callback that pushes samples to the event bus"""
+        def publish(progress):
+            event_bus.publish('job_progress', {
+                'source': source,
+                'target': target,
+                'progress': progress.to_dict()
+            })
+        return publish
+
+    def _write_rc_summary(self, job):
+        """Append the final stats of an rc job to its log file
+
+        Il daemon scrive un unico log per tutti i job: qui riportiamo nel log del
+        job le statistiche finali nello stesso formato di rclone, così la
+        classificazione degli errori funziona come per i job a processo.
+        """
+        handle = job['process']
+        stats = handle.stats or {}
         try:
-            # Wait for process to finish
-            logger.info(f"Monitoring job {job_key} with PID {process.pid}")
-            process.wait()
-            logger.info(
-                f"Job {job_key} with PID {process.pid} has completed with exit code {process.returncode}"
-            )
+            stats = self.rc_client.core_stats(handle.group)
+            self.rc_client.stats_delete(handle.group)
+        except RcError as e:
+            logger.debug(f"Could not read final stats for rc job {handle.jobid}: {str(e)}")
+
+        try:
+            with open(job['log_file'], 'a') as f:
+                transferred = stats.get('bytes', 0)
+                total = stats.get('totalBytes') or 0
+                percent = int(transferred * 100 / total) if total else 100
+                f.write(f"Transferred:   \t{format_bytes(transferred)} / {format_bytes(total)}, {percent}%, "
+                        f"{format_bytes(stats.get('speed') or 0)}/s, ETA -\n")
+                f.write(f"Checks:        \t{stats.get('checks', 0)} / {stats.get('totalChecks', 0)}\n")
+                if stats.get('errors'):
+                    f.write(f"Errors:        \t{stats['errors']} (retrying may help)\n")
+                f.write(f"Transferred:   \t{stats.get('transfers', 0)} / {stats.get('totalTransfers', 0)}\n")
+                if handle.error:
+                    f.write(f"{datetime.now().strftime('%Y/%m/%d %H:%M:%S')} ERROR : rc job {handle.jobid}: {handle.error}\n")
+                elif not stats.get('transfers') and not stats.get('errors'):
+                    f.write("There was nothing to transfer\n")
         except Exception as e:
-            logger.error(f"Error while waiting for process to complete: {str(e)}")
-            
-        # Aggiorna il riferimento al job originale
-        job = self.active_jobs.get(job_key)
-        if not job:
-            logger.warning(f"Job {job_key} was removed while monitoring, using local copy")
-            job = job_copy
+            logger.error(f"Error writing rc job summary to log: {str(e)}")
+
+    def run_configured_job(self, job_id, dry_run=False):
+        """Run a configured job from the config file"""
+        job = self.job_config.get(job_id)
+        if job is None:
+            raise Exception(f"Invalid job ID: {job_id} (the configuration may have changed)")
+
+        return self.run_custom_job(job['source'], job['target'], dry_run)
+
+    def _on_job_exit(self, job_key, job):
+        """Handle completion of a job whose process has exited
+
+        Chiamato dal job supervisor dopo aver raccolto il processo.
+
+        Args:
+            job_key: Key of the job in active_jobs
+            job: Job info dict as created by run_custom_job (the same object stored
+                in active_jobs, so updates are visible to get_active_jobs)
+        """
+        process = job['process']
+        logger.info(
+            f"Job {job_key} with PID {process.pid} has completed with exit code {process.returncode}"
+        )
+
+        if self.active_jobs.get(job_key) is not job:
+            logger.warning(f"Job {job_key} was removed from active_jobs while running")
 
         # Verifica se il processo è stato terminato da un segnale esterno (come SIGTERM)
         if process.returncode < 0:
@@ -491,35 +606,28 @@ class RCloneHandler:
         except Exception as e:
             logger.debug(f"Error removing backup lock file: {str(e)}")
 
+        if job.get('rc_job_id') is not None:
+            self._write_rc_summary(job)
+
         # Verifica se il job ha prodotto errori nei log
         success = process.returncode == 0
-        if success and job.get('log_file') and os.path.exists(
-                job.get('log_file')):
+        scan = None
+        if job.get('log_file') and os.path.exists(job.get('log_file')):
             try:
-                with open(job.get('log_file'), 'r') as f:
-                    log_content = f.read()
-                    # Controlla se ci sono indicazioni di errore nei log, anche se l'exit code è 0
-                    # Rclone a volte termina con successo anche se ci sono stati errori
-                    # Verifichiamo il contenuto escludendo le righe di INFO
-                    if ((" ERROR " in log_content.upper()
-                         or " ERROR:" in log_content.upper())
-                            or (" FATAL " in log_content.upper()
-                                or " FATAL:" in log_content.upper())
-                            or "NOTICE: Failed" in log_content or
-                        ("Errors:" in log_content and "0)" not in
-                         log_content.split("Errors:")[1].split("\n")[0])):
-                        # Manteniamo il job come successo se il messaggio di errore è solo informativo
-                        # o se il job ha riguardato 0 file (nothing to transfer)
-                        if "There was nothing to transfer" in log_content:
-                            # Non consideriamo un errore il caso "nothing to transfer"
-                            logger.info(
-                                f"Job reported 'nothing to transfer' - keeping as success"
-                            )
-                        else:
-                            success = False
-                            logger.warning(
-                                f"Job exit code was 0 but errors found in log, marking as failed"
-                            )
+                # Rclone a volte termina con successo anche se ci sono stati errori:
+                # il classificatore scandisce il log a blocchi senza caricarlo in memoria.
+                # La scansione viene fatta anche per i job falliti per salvarla nello storico
+                scan = classify_log(job.get('log_file'))
+                if success and scan.verdict == 'error':
+                    success = False
+                    logger.warning(
+                        f"Job exit code was 0 but errors found in log, marking as failed"
+                    )
+                elif success and scan.has_errors:
+                    # Non consideriamo un errore il caso "nothing to transfer"
+                    logger.info(
+                        f"Job reported 'nothing to transfer' - keeping as success"
+                    )
             except Exception as e:
                 logger.error(
                     f"Error reading log file for job completion: {str(e)}")
@@ -551,13 +659,20 @@ class RCloneHandler:
                 logger.error(
                     f"Error updating log file with job result: {str(e)}")
 
+            # Riprende la scansione dall'offset: vengono letti solo i byte appena aggiunti
+            try:
+                scan = classify_log(log_file, scan)
+            except Exception as e:
+                logger.error(f"Error updating log scan for job completion: {str(e)}")
+
+            # Indicizza la parte finale del log per la ricerca (solo i byte non ancora indicizzati)
+            log_index.update_file(log_file)
+        job['log_scan'] = scan
+
         # Aggiorna il database e invia notifica di completamento
         try:
             # Utilizziamo una soluzione più robusta che non richiede un contesto Flask attivo
             # Eseguiamo una chiamata diretta al modulo models importandolo nel contesto attuale
-            import sys
-            import os
-
             # Aggiungiamo la directory principale al path per l'import
             app_dir = os.path.abspath(
                 os.path.join(os.path.dirname(__file__), '..'))
@@ -569,26 +684,31 @@ class RCloneHandler:
             from app import app  # Import diretto dell'app Flask
             from utils.notification_manager import notify_job_completed
 
-            # Utilizziamo il contesto dell'app esplicitamente
-            with app.app_context():
-                # Trova il job nel database
-                history_job = SyncJobHistory.query.filter_by(
+            def finish_history_job(session):
+                # Trova il job nel database e ne aggiorna lo stato (nella transazione del writer)
+                history_job = session.query(SyncJobHistory).filter_by(
                     source=job['source'],
                     target=job['target'],
                     status="running",
                     log_file=job['log_file']).first()
+                if history_job is None:
+                    return None
+                history_job.status = "completed" if success else "error"
+                history_job.end_time = job['end_time']
+                history_job.exit_code = job['exit_code']
+                if scan is not None:
+                    history_job.log_scan = scan
+                return history_job.id
 
-                if history_job:
-                    # Aggiorna lo stato
-                    history_job.status = "completed" if success else "error"
-                    history_job.end_time = job['end_time']
-                    history_job.exit_code = job['exit_code']
-                    db.session.commit()
+            # Utilizziamo il contesto dell'app esplicitamente
+            with app.app_context():
+                history_id = db_writer.call(finish_history_job).result(timeout=WRITE_TIMEOUT)
 
+                if history_id is not None:
                     # Invia notifica di completamento
                     duration = (job['end_time'] -
                                 job['start_time']).total_seconds()
-                    notify_job_completed(history_job.id,
+                    notify_job_completed(history_id,
                                          job['source'],
                                          job['target'],
                                          success=success,
@@ -603,10 +723,21 @@ class RCloneHandler:
         except Exception as e:
             logger.error(f"Error updating job status in database: {str(e)}")
 
-        # Remove from active jobs after a delay
-        time.sleep(
-            60)  # Keep in active jobs list for 1 minute after completion
-        if job_key in self.active_jobs:
+        # Un posto si è liberato: i job in coda possono partire e la banda
+        # del job viene ridistribuita agli altri
+        job_queue.wake()
+        bandwidth_manager.unregister(job['source'], job['target'])
+
+        # Keep in active jobs list for 1 minute after completion
+        job_supervisor.call_later(60, self._evict_job, job_key, job)
+
+    def _evict_job(self, job_key, job):
+        """Remove a completed job from active_jobs
+
+        Rimuove la voce solo se è ancora quella del job completato, non un nuovo
+        job con lo stesso source/target avviato nel frattempo.
+        """
+        if self.active_jobs.get(job_key) is job:
             logger.info(f"Removing job from active_jobs: {job_key}")
             del self.active_jobs[job_key]
 
@@ -645,7 +776,8 @@ class RCloneHandler:
                 'start_time': job['start_time'],
                 'duration': (datetime.now() - job['start_time']).total_seconds(),
                 'recovered': job.get('recovered', False),  # Aggiungiamo il flag per processi recuperati
-                'pid': pid  # Aggiungiamo il PID per tracciamento avanzato
+                'pid': pid,  # Aggiungiamo il PID per tracciamento avanzato
+                'progress': job['progress'].to_dict() if job.get('progress') else None
             })
 
         # Cerchiamo processi rclone attivi nel sistema che non sono nei job attivi
@@ -730,13 +862,13 @@ class RCloneHandler:
                                 logger.warning(
                                     f"Job {db_job.id} ({db_job.source} → {db_job.target}) in stato running senza file di lock, marcato come error"
                                 )
-                                db.session.commit()
+                                db_writer.save(db_job).result(timeout=WRITE_TIMEOUT)
             except Exception as e:
                 logger.error(f"Error getting database running jobs: {str(e)}")
 
         return active_jobs
 
-    def is_job_running(self, source, target):
+    def is_job_running(self, source, target, snapshot=None, db_running=None):
         """Check if a job with the given source and target is running
         
         - Controlla se il job è nei job attivi dell'handler
@@ -745,6 +877,13 @@ class RCloneHandler:
         
         IMPORTANTE: Questa funzione è progettata per essere "READ-ONLY" e non deve
         modificare lo stato di processi attivi o eseguire operazioni distruttive.
+        
+        Args:
+            source: Source path
+            target: Target path
+            snapshot: Optional ProcessSnapshot shared by several checks
+            db_running: Optional known answer to "is there a running history row
+                for source → target" (skips the database query)
         """
         # Import necessari per il contesto esterno alla funzione
         import sys
@@ -769,63 +908,15 @@ class RCloneHandler:
             except Exception as e:
                 logger.error(f"Error checking process status: {str(e)}")
         
-        # 1b. NON rimuoviamo questa parte ma la rendiamo più robusta, in modo che non modifichi processi
-        # Se non troviamo il processo nei job attivi, controlliamo anche i processi di sistema
-        # usando lo stesso filtro migliorato che esclude falsi positivi come journalctl
+        # 1b. Se non troviamo il processo nei job attivi, controlliamo la tabella dei processi
+        # condivisa (letta da /proc), che esclude già falsi positivi come journalctl
         if not process_running:
             try:
-                import subprocess
-                import re
-                
-                # Utilizziamo un timeout più breve per prevenire blocchi
-                ps_output = subprocess.check_output(['ps', 'aux'], universal_newlines=True, timeout=5)
-                lines = ps_output.split('\n')
-                
-                # Utilizziamo un filtro ancora più restrittivo
-                rclone_lines = []
-                for line in lines:
-                    parts = line.split()
-                    if len(parts) > 10:
-                        command = ' '.join(parts[10:])
-                        
-                        # Verifichiamo che sia un vero comando rclone
-                        is_rclone_command = False
-                        
-                        # Caso 1: Il comando è esattamente 'rclone'
-                        if parts[10] == 'rclone' and len(parts) > 11:
-                            # Verifichiamo che ci sia un'operazione rclone valida (sync, copy, check, etc.)
-                            rclone_operations = ['sync', 'copy', 'move', 'check', 'ls', 'lsd', 'lsl', 'md5sum', 'sha1sum', 'size', 'delete', 'mkdir', 'rmdir', 'rcat', 'cat', 'copyto', 'moveto', 'copyurl', 'mount', 'about', 'cleanup', 'dedupe', 'version', 'touch', 'serve']
-                            if parts[11] in rclone_operations:
-                                is_rclone_command = True
-                                
-                        # Caso 2: Il comando è un percorso a rclone (come /usr/bin/rclone)
-                        elif ('/rclone' in parts[10]) and len(parts) > 11:
-                            if parts[10].endswith('/rclone') and parts[11] in ['sync', 'copy', 'move', 'check', 'ls', 'lsd', 'lsl', 'md5sum', 'sha1sum', 'size', 'delete', 'mkdir', 'rmdir', 'rcat', 'cat', 'copyto', 'moveto', 'copyurl', 'mount', 'about', 'cleanup', 'dedupe', 'version', 'touch', 'serve']:
-                                is_rclone_command = True
-                        
-                        if is_rclone_command:
-                            rclone_lines.append(line)
-                
-                # Cerchiamo se uno di questi processi contiene source e target
-                source_pattern = re.escape(source)
-                target_pattern = re.escape(target)
-                # Proviamo prima una corrispondenza esatta
-                exact_pattern = f"{source_pattern}.*{target_pattern}"
-                
-                # Poi proviamo una corrispondenza meno rigorosa con parti del percorso
-                alternative_source = source.split('/')[-1] if '/' in source else source
-                alternative_target = target.split('/')[-1] if '/' in target else target
-                alt_pattern = f"{re.escape(alternative_source)}.*{re.escape(alternative_target)}"
-                
-                for line in rclone_lines:
-                    if re.search(exact_pattern, line) or re.search(alt_pattern, line):
-                        # Abbiamo trovato un processo rclone attivo per questo job
-                        process_running = True
-                        parts = line.split()
-                        if len(parts) > 1:
-                            pid = int(parts[1])
-                            logger.debug(f"Found active rclone process with PID {pid} for job {source} → {target}")
-                        break
+                matches = (snapshot or process_table.snapshot()).find_job(source, target)
+                if matches:
+                    # Abbiamo trovato un processo rclone attivo per questo job
+                    process_running = True
+                    logger.debug(f"Found active rclone process with PID {matches[0].pid} for job {source} → {target}")
             except Exception as e:
                 logger.error(f"Error searching for active rclone processes: {str(e)}")
                 # In caso di errore nell'analisi dei processi, NON modifichiamo lo stato
@@ -851,8 +942,23 @@ class RCloneHandler:
         # MODIFICA IMPORTANTE: NON rimuoviamo lock file in questa funzione
         # Serve solo a verificare, non a modificare lo stato
 
+        # 2b. In modalità rcd il lock file contiene "rc:<jobid>:<PID del daemon>":
+        # chiediamo al daemon, se è ancora quello che ha avviato il job
+        if not process_running and lock_file and self.rc_client is not None:
+            try:
+                with open(lock_file, 'r') as f:
+                    lock_content = f.read().strip()
+                jobid = self.rc_client.job_from_lock(lock_content)
+                if jobid is not None:
+                    status = self.rc_client.job_status(jobid)
+                    process_running = not status.get('finished', True)
+            except Exception as e:
+                logger.debug(f"Error checking rc job for {source} → {target}: {str(e)}")
+
         # 3. Verifica anche nel database
-        if process_running or lock_exists:
+        if db_running is not None:
+            db_status_running = db_running
+        elif process_running or lock_exists:
             try:
                 # Utilizziamo una soluzione più robusta che non richiede un contesto Flask attivo
                 import sys
@@ -987,38 +1093,22 @@ class RCloneHandler:
             active_jobs: Lista dei job attivi corrente
         """
         # Import necessari per questa funzione
-        import subprocess
-        import re
         import os
         import sys
-        import time
         from datetime import datetime
         
         # Troviamo tutti i processi rclone in esecuzione
         try:
-            # Ottieni la lista dei processi in esecuzione con dettagli
-            ps_output = subprocess.check_output(['ps', 'aux'], universal_newlines=True)
-            lines = ps_output.split('\n')
+            # Processi rclone reali dallo snapshot condiviso (non quelli che citano rclone nei parametri)
+            rclone_processes = process_table.rclone_processes()
+            
+            if not rclone_processes:
+                return  # Nessun processo rclone trovato
             
             # Ottieni anche la lista di tutti i log file
             log_files = []
             if os.path.exists(self.log_dir):
                 log_files = [f for f in os.listdir(self.log_dir) if f.startswith('sync_') and f.endswith('.log')]
-            
-            # Filtra solo i processi che sono effettivamente rclone (non quelli che lo contengono nei parametri)
-            rclone_processes = []
-            for line in lines:
-                parts = line.split()
-                if len(parts) > 10:
-                    command = ' '.join(parts[10:])
-                    # Verifica che sia un comando rclone reale e non ad esempio journalctl che monitora rclone
-                    if (parts[10] == 'rclone' or 
-                        '/rclone' in parts[10] or 
-                        (command.startswith('/') and '/rclone' in command.split()[0])):
-                        rclone_processes.append(line)
-            
-            if not rclone_processes:
-                return  # Nessun processo rclone trovatoo
                 
             # Aggiungiamo la directory principale al path per l'import
             app_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -1034,15 +1124,11 @@ class RCloneHandler:
                 # Ottieni tutti i job pianificati dal database
                 scheduled_jobs = ScheduledJob.query.all()
                 
-                for process_line in rclone_processes:
-                    # Estrai PID e comando
-                    parts = process_line.split()
-                    if len(parts) < 12:
-                        continue  # Non abbastanza parti nella linea
-                    
+                for proc in rclone_processes:
                     try:
-                        pid = int(parts[1])
-                        command = ' '.join(parts[10:])  # Comando completo
+                        # PID e comando completo dallo snapshot
+                        pid = proc.pid
+                        command = proc.command
                         
                         # Verifica se questo processo è già nei job attivi OPPURE ha già un pid memorizzato
                         process_already_tracked = False
@@ -1053,9 +1139,7 @@ class RCloneHandler:
                                     process_already_tracked = True
                                     break
                                 # Verifica se sono gli stessi source/target
-                                source_pattern = re.escape(job['source'])
-                                target_pattern = re.escape(job['target'])
-                                if re.search(source_pattern, command) and re.search(target_pattern, command):
+                                if job['source'] in command and job['target'] in command:
                                     process_already_tracked = True
                                     # Aggiorna il PID se non era stato salvato
                                     if 'pid' not in job or job['pid'] is None:
@@ -1075,32 +1159,9 @@ class RCloneHandler:
                             
                             continue  # Processo già tracciato, passa al prossimo
                         
-                        # Cerca di estrarre source e target dal comando
-                        # Cerca pattern: rclone [operazione] source:path target:path
-                        # Nota: questo è un'approssimazione, potrebbe richiedere regolazioni
-                        words = command.split()
-                        source = None
-                        target = None
-                        
-                        # Trova la prima parola dopo 'rclone' che contiene ':'
-                        source_index = -1
-                        for i, word in enumerate(words):
-                            if i > 0 and ':' in word and not word.startswith('-'):
-                                source = word
-                                source_index = i
-                                break
-                        
-                        # Se abbiamo trovato source, cerca target (la prossima parola che contiene ':' o la successiva)
-                        if source_index > 0 and source_index < len(words) - 1:
-                            # Prima cerca se c'è un'altra parola con ':'
-                            for word in words[source_index + 1:]:
-                                if not word.startswith('-') and ((':' in word) or ('/' in word)):
-                                    target = word
-                                    break
-                            
-                            # Se non lo trova, prova a usare la parola immediatamente successiva
-                            if target is None and source_index + 1 < len(words):
-                                target = words[source_index + 1]
+                        # Source e target sono già stati estratti dall'argv del processo
+                        source = proc.source
+                        target = proc.target
                         
                         # Se non siamo riusciti a estrarre source o target, continua
                         if source is None or target is None:
@@ -1155,32 +1216,16 @@ class RCloneHandler:
                                     if time_key not in self._tracked_processes:
                                         self._tracked_processes.add(time_key)
                                         try:
-                                            # Se possiamo trovare informazioni su quando è stato effettivamente avviato il processo
-                                            proc_stat_file = f"/proc/{pid}/stat"
-                                            if os.path.exists(proc_stat_file):
-                                                # Leggi il tempo di avvio dal file stat
-                                                with open(proc_stat_file, 'r') as f:
-                                                    stat_content = f.read().split()
-                                                    if len(stat_content) > 21:  # Assicurati che ci siano abbastanza campi
-                                                        # Campo 22 (indice 21) è il tempo di avvio in clock tick
-                                                        start_time_ticks = int(stat_content[21])
-                                                        # Converti in secondi dal boot
-                                                        with open('/proc/uptime', 'r') as uptime_file:
-                                                            uptime = float(uptime_file.read().split()[0])
-                                                        # Determina clock ticks per secondo (normalmente 100)
-                                                        clock_ticks = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
-                                                        # Calcola quanto tempo fa è stato avviato il processo (in secondi)
-                                                        seconds_since_boot = start_time_ticks / clock_ticks
-                                                        # Calcola il timestamp reale
-                                                        seconds_ago = uptime - seconds_since_boot
-                                                        real_start_time = datetime.now() - timedelta(seconds=seconds_ago)
-                                                        
-                                                        # Aggiorna anche il record nel database per mostrare il tempo reale
-                                                        # anche nella history view
-                                                        existing_history.start_time = real_start_time
-                                                        db.session.commit()
-                                                        
-                                                        logger.info(f"Tempo di avvio reale del processo {pid} calcolato: {real_start_time} e aggiornato nel database")
+                                            # L'ora di avvio reale è già stata calcolata da /proc/<pid>/stat nello snapshot
+                                            if proc.start_time is not None:
+                                                real_start_time = proc.start_time
+                                                
+                                                # Aggiorna anche il record nel database per mostrare il tempo reale
+                                                # anche nella history view
+                                                existing_history.start_time = real_start_time
+                                                db_writer.save(existing_history)
+                                                
+                                                logger.info(f"Tempo di avvio reale del processo {pid} calcolato: {real_start_time} e aggiornato nel database")
                                         except Exception as e:
                                             logger.warning(f"Impossibile determinare il tempo reale di avvio del processo {pid}: {e}")
                                     
@@ -1207,10 +1252,8 @@ class RCloneHandler:
                                 
                                 # Prima tenta di trovare un file di log esistente nel comando
                                 existing_log_file = None
-                                log_path_pattern = re.compile(r"--log-file[= ]([^ ]+)")
-                                log_match = log_path_pattern.search(command)
-                                if log_match:
-                                    cmd_log_file = log_match.group(1)
+                                cmd_log_file = proc.log_file
+                                if cmd_log_file:
                                     if os.path.exists(cmd_log_file):
                                         existing_log_file = cmd_log_file
                                         logger.info(f"Trovato file di log nel comando: {existing_log_file}")
@@ -1299,16 +1342,15 @@ class RCloneHandler:
                                             logger.warning(f"Errore stimando il tempo di inizio: {e}, uso il tempo corrente")
                                             estimated_start_time = now
                                     
-                                    new_history = SyncJobHistory(
+                                    db_writer.insert(
+                                        SyncJobHistory,
                                         source=matched_scheduled_job.source,
                                         target=matched_scheduled_job.target,
                                         status="running",
                                         dry_run=False,  # Assumiamo che non sia in dry-run
                                         start_time=estimated_start_time,
                                         log_file=log_file
-                                    )
-                                    db.session.add(new_history)
-                                    db.session.commit()
+                                    ).result(timeout=WRITE_TIMEOUT)
                                     logger.info(f"Creato nuovo record nella history per processo orfano: {matched_scheduled_job.source} → {matched_scheduled_job.target}")
                                     
                                     # Aggiungi alla lista dei job attivi
@@ -1333,6 +1375,37 @@ class RCloneHandler:
             logger.error(f"Errore durante la ricerca di processi rclone orfani: {str(e)}")
             return
 
+    def probe_hash_capabilities(self, remote):
+        """Return the hash types supported by remote (uncached, see remote_capabilities)
+
+        Args:
+            remote: Remote name without the trailing ':'
+
+        Returns:
+            list: Hash names, e.g. ['md5', 'sha1']; raises if rclone fails
+        """
+        # In modalità rcd fsinfo viene risolto dal daemon, senza avviare processi
+        if self.rc_client is not None:
+            return self.rc_client.fsinfo(f"{remote}:").get('Hashes') or []
+
+        cmd = ["rclone", "backend", "features", f"{remote}:", "--json", "--no-check-certificate"]
+        logger.info(f"Checking hash capabilities: {' '.join(cmd)}")
+
+        # Crea un ambiente senza variabili proxy
+        my_env = os.environ.copy()
+        for proxy_var in ['http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY']:
+            my_env.pop(proxy_var, None)
+
+        process = subprocess.Popen(cmd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   universal_newlines=True,
+                                   env=my_env)
+        stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            raise Exception(f"rclone backend features exited with code {process.returncode}: {stderr.strip()}")
+        return json.loads(stdout).get('Hashes') or []
+
     def save_main_config_file(self, content):
         """Save changes to the main rclone config file"""
         try:
@@ -1352,6 +1425,10 @@ class RCloneHandler:
                 f.write(content)
 
             logger.info(f"Main config file updated: {self.main_config_path}")
+
+            # Le capacità dei remote dipendono dalla configurazione: vanno interrogate di nuovo
+            remote_capabilities.invalidate()
+            remote_capabilities.prewarm(remote_inventory.names(), self.probe_hash_capabilities)
             return True
         except Exception as e:
             logger.error(f"Error saving main config file: {str(e)}")
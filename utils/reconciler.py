@@ -0,0 +1,213 @@
+"""
+Background reconciler for RClone Manager.
+
+Un solo thread per processo si occupa di tutte le riparazioni dello stato
+(job stale, job orfani, job fantasma, orari dei job pianificati) e costruisce
+lo snapshot dei job attivi. Le pagine e le API leggono lo snapshot pubblicato
+invece di scandire processi, lock file e log a ogni richiesta.
+
+Lo snapshot è immutabile e ha un numero di versione che cambia solo quando
+cambia il suo contenuto. L'ETag di /api/active_jobs (e il campo digest del
+corpo) è invece l'hash del contenuto, uguale in tutti i processi: il client
+riceve 304, o ignora la risposta, solo se ha già gli stessi dati. I valori che cambiano di continuo (es.
+l'avanzamento dei job) possono essere esclusi dal confronto o ridotti a una
+granularità più grossa con la funzione version_key di set_builder.
+"""
+import json
+import time
+import hashlib
+import logging
+import threading
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+# Intervallo di ricostruzione dello snapshot (secondi)
+SNAPSHOT_INTERVAL = 3
+
+# Intervallo delle riparazioni dello stato (secondi)
+REPAIR_INTERVAL = 30
+
+# Eventi che causano una ricostruzione immediata dello snapshot
+WAKE_EVENTS = ('job_started', 'job_completed', 'job_cancelled')
+
+
+def _freeze(value):
+    """Return a read-only copy of nested dicts/lists"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class Snapshot:
+    """Immutable, versioned view of the active jobs"""
+
+    __slots__ = ('version', 'etag', 'data', 'body', 'built_at')
+
+    def __init__(self, version, data, digest, built_at):
+        object.__setattr__(self, 'version', version)
+        # Il numero di versione è per processo: l'ETag dipende solo dal contenuto
+        object.__setattr__(self, 'etag', digest[:16])
+        object.__setattr__(self, 'data', _freeze(data))
+        object.__setattr__(self, 'built_at', built_at)
+        # Corpo JSON già serializzato, servito così com'è dalle API
+        payload = dict(data, version=version, digest=digest[:16],
+                       timestamp=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(built_at)))
+        object.__setattr__(self, 'body', json.dumps(payload, default=str).encode('utf-8'))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot is immutable")
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+
+class Reconciler:
+    """Owns state repair and publishes the active jobs snapshot"""
+
+    def __init__(self, interval=SNAPSHOT_INTERVAL, repair_interval=REPAIR_INTERVAL):
+        """Initialize the reconciler (the loop is started by start())
+
+        Args:
+            interval: Seconds between snapshot rebuilds
+            repair_interval: Seconds between runs of the repair functions
+        """
+        self.interval = interval
+        self.repair_interval = repair_interval
+        self._repairs = []
+        self._builder = None
+        self._version_key = None
+        self._snapshot = None
+        self._digest = None
+        self._version = 0
+        # Ricostruzioni serializzate: il reconciler e le richieste possono chiamare run_once
+        self._rebuild_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._repair_requested = False
+        self._ready = threading.Condition()
+        self._thread = None
+        self._last_repair = 0
+
+    def add_repair(self, name, func):
+        """Register a repair function called every repair_interval seconds
+
+        Args:
+            name: Name used in the logs
+            func: Callable without arguments
+        """
+        self._repairs.append((name, func))
+
+    def set_builder(self, func, version_key=None):
+        """Set the callable returning the snapshot content (a JSON-serializable dict)
+
+        Args:
+            func: Callable without arguments returning the snapshot content
+            version_key: Optional callable content -> value compared to decide whether
+                a new version is published (default: the whole content)
+        """
+        self._builder = func
+        self._version_key = version_key
+
+    def start(self):
+        """Start the reconciler thread (only once per process)"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name="reconciler")
+        self._thread.start()
+
+    def wake(self, repair=False):
+        """Rebuild the snapshot as soon as possible
+
+        Args:
+            repair: Also run the repair functions before rebuilding
+        """
+        if repair:
+            self._repair_requested = True
+        self._wake.set()
+
+    def snapshot(self, timeout=10):
+        """Return the current snapshot, waiting for the first one if needed
+
+        Args:
+            timeout: Seconds to wait for the first snapshot
+
+        Returns:
+            Snapshot: The latest snapshot, or None if none was built in time
+        """
+        if self._snapshot is None:
+            with self._ready:
+                self._ready.wait_for(lambda: self._snapshot is not None, timeout)
+        return self._snapshot
+
+    def run_once(self, repair=True):
+        """Run one reconciliation pass in the calling thread
+
+        Args:
+            repair: Whether to run the repair functions
+
+        Returns:
+            Snapshot: The published snapshot
+        """
+        if repair:
+            for name, func in self._repairs:
+                try:
+                    func()
+                except Exception as e:
+                    logger.error(f"Errore nella riparazione '{name}': {str(e)}")
+            self._last_repair = time.monotonic()
+        return self._rebuild()
+
+    def _rebuild(self):
+        # Confronto del digest, incremento della versione e pubblicazione avvengono
+        # sotto lo stesso lock: due ricostruzioni non pubblicano mai dati diversi
+        # con lo stesso numero di versione
+        with self._rebuild_lock:
+            return self._rebuild_locked()
+
+    def _rebuild_locked(self):
+        if self._builder is None:
+            return self._snapshot
+        try:
+            data = self._builder()
+        except Exception as e:
+            logger.error(f"Errore nella costruzione dello snapshot dei job attivi: {str(e)}")
+            return self._snapshot
+
+        # La versione cambia solo se cambia il contenuto: il confronto è sul JSON canonico
+        # (della sola parte rilevante se è impostata version_key)
+        try:
+            versioned = self._version_key(data) if self._version_key is not None else data
+        except Exception as e:
+            logger.error(f"Errore nel calcolo della versione dello snapshot: {str(e)}")
+            versioned = data
+        canonical = json.dumps(versioned, sort_keys=True, default=str).encode('utf-8')
+        digest = hashlib.sha1(canonical).hexdigest()
+        if digest == self._digest:
+            return self._snapshot
+
+        self._version += 1
+        snapshot = Snapshot(self._version, data, digest, time.time())
+        with self._ready:
+            self._snapshot = snapshot
+            self._digest = digest
+            self._ready.notify_all()
+        logger.debug(f"Active jobs snapshot v{self._version} published")
+        return snapshot
+
+    def _run(self):
+        while True:
+            try:
+                repair = (self._repair_requested
+                          or time.monotonic() - self._last_repair >= self.repair_interval)
+                self._repair_requested = False
+                self.run_once(repair=repair)
+            except Exception as e:
+                logger.error(f"Errore nel ciclo del reconciler: {str(e)}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+# Istanza condivisa dal processo
+reconciler = Reconciler()
@@ -0,0 +1,214 @@
+"""
+Persistent cache of the hash capabilities of the rclone remotes.
+
+Prima di ogni job run_custom_job sceglie tra --checksum e --size-only in base
+agli hash comuni a source e target, che si ottengono con
+`rclone backend features <remote>: --json` (o operations/fsinfo in modalità
+rcd). La risposta dipende solo dalla configurazione del remote, quindi viene
+salvata per nome del remote con un TTL in un file JSON nella instance folder,
+condiviso tra i processi (web e scheduler) e tra i riavvii.
+
+Il file registra anche mtime e dimensione di rclone.conf: quando la
+configurazione cambia (save_main_config_file o modifica esterna) tutte le voci
+vengono scartate. I remote mancanti vengono interrogati in parallelo e una
+stessa interrogazione in corso viene condivisa tra i thread che la chiedono.
+"""
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Validità di una risposta (secondi)
+DEFAULT_TTL = 24 * 3600
+
+# Validità di un'interrogazione fallita: si riprova dopo pochi minuti
+FAILURE_TTL = 300
+
+# Interrogazioni contemporanee al massimo
+MAX_PROBES = 8
+
+
+class RemoteCapabilityCache:
+    """Hash capabilities per remote name, with TTL and a JSON file shared by the processes"""
+
+    def __init__(self, path=None, config_path=None, ttl=DEFAULT_TTL):
+        self.path = path
+        self.config_path = config_path
+        self.ttl = ttl
+        self._entries = {}
+        self._file_mtime = None
+        self._config_stamp = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_PROBES, thread_name_prefix="remote-probe")
+
+    def open(self, path, config_path):
+        """Set the cache file and the rclone.conf it depends on, loading the saved entries"""
+        with self._lock:
+            self.path = path
+            self.config_path = config_path
+            self._entries = {}
+            self._file_mtime = None
+            self._refresh()
+
+    def _stat_config(self):
+        """Return (mtime_ns, size) of rclone.conf, or None if it does not exist"""
+        try:
+            stat = os.stat(self.config_path)
+            return [stat.st_mtime_ns, stat.st_size]
+        except (OSError, TypeError):
+            return None
+
+    def _refresh(self):
+        """Reload the file if another process changed it and drop everything if rclone.conf changed
+
+        Da chiamare con self._lock acquisito.
+        """
+        if self.path:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != self._file_mtime:
+                try:
+                    with open(self.path, 'r') as f:
+                        data = json.load(f)
+                    self._file_mtime = mtime
+                    self._config_stamp = data.get('config')
+                    self._entries = data.get('remotes') or {}
+                except Exception as e:
+                    logger.error(f"Error loading remote capability cache {self.path}: {str(e)}")
+
+        stamp = self._stat_config()
+        if stamp != self._config_stamp:
+            if self._entries:
+                logger.info("rclone configuration changed: remote capability cache cleared")
+            self._entries = {}
+            self._config_stamp = stamp
+
+    def _save(self, merge=True):
+        """Write the entries atomically, keeping the newer entries written by other processes
+
+        Da chiamare con self._lock acquisito.
+
+        Args:
+            merge: Merge the entries of the file (False overwrites it, used to invalidate)
+        """
+        if not self.path:
+            return
+        if merge:
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                if data.get('config') == self._config_stamp:
+                    for remote, entry in (data.get('remotes') or {}).items():
+                        current = self._entries.get(remote)
+                        if current is None or entry.get('probed_at', 0) > current.get('probed_at', 0):
+                            self._entries[remote] = entry
+            except (OSError, ValueError):
+                pass
+        try:
+            directory = os.path.dirname(self.path) or '.'
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.remote_capabilities.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'config': self._config_stamp, 'remotes': self._entries}, f)
+            os.replace(tmp_path, self.path)
+            self._file_mtime = os.stat(self.path).st_mtime_ns
+        except Exception as e:
+            logger.error(f"Error saving remote capability cache {self.path}: {str(e)}")
+
+    def _valid(self, entry, now):
+        ttl = self.ttl if entry.get('ok') else FAILURE_TTL
+        return now - entry.get('probed_at', 0) < ttl
+
+    def _probe(self, remote, probe, future):
+        """Run probe(remote) and store its answer (an empty list if it fails)"""
+        try:
+            hashes, ok = sorted(probe(remote) or []), True
+        except Exception as e:
+            logger.warning(f"Error determining hash capability of {remote}: {str(e)}")
+            hashes, ok = [], False
+        with self._lock:
+            self._pending.pop(remote, None)
+            self._entries[remote] = {'hashes': hashes, 'ok': ok, 'probed_at': time.time()}
+            self._save()
+        future.set_result(hashes)
+
+    def hashes(self, remotes, probe, timeout=None):
+        """Return the hash types supported by each remote, probing the missing ones in parallel
+
+        Args:
+            remotes: Remote names (without the trailing ':')
+            probe: Function remote -> list of hash names; it may raise on errors
+            timeout: Seconds to wait for the probes (None waits until they finish)
+
+        Returns:
+            dict: remote -> list of hash names ([] if unknown)
+        """
+        now = time.time()
+        result = {}
+        waiting = {}
+        with self._lock:
+            self._refresh()
+            for remote in set(remotes):
+                entry = self._entries.get(remote)
+                if entry is not None and self._valid(entry, now):
+                    result[remote] = entry['hashes']
+                    continue
+                future = self._pending.get(remote)
+                if future is None:
+                    future = self._pending[remote] = Future()
+                    self._executor.submit(self._probe, remote, probe, future)
+                waiting[remote] = future
+        for remote, future in waiting.items():
+            try:
+                result[remote] = future.result(timeout)
+            except Exception:
+                result[remote] = []
+        return result
+
+    def common_hashes(self, src_remote, tgt_remote, probe):
+        """Return the set of hash types supported by both remotes"""
+        found = self.hashes([src_remote, tgt_remote], probe)
+        return set(found[src_remote]) & set(found[tgt_remote])
+
+    def prewarm(self, remotes, probe):
+        """Probe in the background the remotes missing from the cache (or expired)"""
+        now = time.time()
+        with self._lock:
+            self._refresh()
+            missing = [remote for remote in remotes
+                       if remote not in self._pending
+                       and not (remote in self._entries and self._valid(self._entries[remote], now))]
+            for remote in missing:
+                future = self._pending[remote] = Future()
+                self._executor.submit(self._probe, remote, probe, future)
+        if missing:
+            logger.info(f"Probing hash capabilities of {len(missing)} remotes: {', '.join(missing)}")
+        return missing
+
+    def invalidate(self, remotes=None):
+        """Drop the cached answers of remotes (all of them if None)"""
+        with self._lock:
+            if remotes is None:
+                self._entries = {}
+            else:
+                for remote in remotes:
+                    self._entries.pop(remote, None)
+            self._config_stamp = self._stat_config()
+            self._save(merge=False)
+
+    def snapshot(self):
+        """Return a copy of the cached entries"""
+        with self._lock:
+            self._refresh()
+            return {remote: dict(entry) for remote, entry in self._entries.items()}
+
+
+# Istanza globale condivisa dall'applicazione
+remote_capabilities = RemoteCapabilityCache()
@@ -0,0 +1,200 @@
+"""
+Inventory of the remotes defined in the main rclone config file.
+
+rclone.conf è un file INI: ogni sezione è un remote con il suo `type` e le
+opzioni del backend. Il file viene letto e analizzato una volta e tenuto in
+memoria; ad ogni richiesta un os.stat() confronta mtime e dimensione e lo
+rilegge solo se è cambiato (anche se modificato da un altro processo o a
+mano), senza avviare `rclone listremotes` o `rclone config dump`.
+
+Le opzioni segrete (password, token, chiavi) non vengono mai esposte: nel
+dizionario di un remote compare solo il loro nome in `secrets`.
+"""
+import os
+import re
+import logging
+import threading
+import configparser
+
+logger = logging.getLogger(__name__)
+
+# Opzioni che contengono credenziali (confrontate sul nome, senza distinzione di maiuscole)
+SECRET_OPTION_PATTERN = re.compile(
+    r'(pass|secret|token|key|credentials|password|client_id|sas_url|auth|cookie)', re.IGNORECASE)
+
+# Opzioni descrittive mostrate per ogni remote (se presenti)
+KEY_OPTIONS = (
+    'provider', 'region', 'endpoint', 'location_constraint', 'storage_class',
+    'bucket', 'bucket_policy_only', 'project_number', 'host', 'port', 'user',
+    'url', 'vendor', 'drive_type', 'root_folder_id', 'team_drive', 'account',
+    'env_auth', 'remote', 'upstreams',
+)
+
+# Backend che avvolgono un altro remote (opzione `remote`)
+WRAPPER_TYPES = ('alias', 'crypt', 'cache', 'chunker', 'compress', 'hasher')
+
+# Prefisso di un rclone.conf cifrato con `rclone config encryption`
+ENCRYPTED_MARKER = 'RCLONE_ENCRYPT_V0:'
+
+# Nomi di remote validi per rclone
+REMOTE_NAME_PATTERN = re.compile(r'^[\w.+@ -]+$')
+
+
+def split_remote(path):
+    """Return (remote, path) for "remote:path", or (None, path) for local paths
+
+    Le stringhe di connessione al volo (":s3,provider=AWS:bucket") e i percorsi
+    che iniziano con '/' sono considerati locali/non verificabili.
+    """
+    if not path or path.startswith((':', '/', '.')) or ':' not in path:
+        return None, path
+    remote, rest = path.split(':', 1)
+    # Connection string nel nome (remote,opzione=valore:percorso)
+    remote = remote.split(',', 1)[0]
+    return remote, rest
+
+
+class Remote:
+    """One remote of rclone.conf"""
+
+    def __init__(self, name, options):
+        self.name = name
+        self.type = options.get('type', '')
+        self.options = options
+
+    @property
+    def secrets(self):
+        """Names of the options holding credentials"""
+        return sorted(key for key in self.options if SECRET_OPTION_PATTERN.search(key))
+
+    @property
+    def underlying(self):
+        """Remote wrapped by alias/crypt/... remotes, or None"""
+        if self.type in WRAPPER_TYPES:
+            return split_remote(self.options.get('remote', ''))[0]
+        return None
+
+    def to_dict(self):
+        """Dictionary representation without secret values"""
+        secrets = set(self.secrets)
+        return {
+            'name': self.name,
+            'type': self.type,
+            'options': {key: self.options[key] for key in KEY_OPTIONS
+                        if key in self.options and key not in secrets},
+            'secrets': sorted(secrets),
+            'underlying': self.underlying,
+        }
+
+
+class RemoteInventory:
+    """Parsed rclone.conf, cached in memory and reloaded when the file changes"""
+
+    def __init__(self, config_path=None):
+        self.config_path = config_path
+        self._remotes = {}
+        self._stamp = None
+        self._encrypted = False
+        self._error = None
+        self._lock = threading.Lock()
+
+    def open(self, config_path):
+        """Set the rclone.conf to read"""
+        with self._lock:
+            self.config_path = config_path
+            self._stamp = None
+
+    def _parse(self, content):
+        """Parse the INI content of rclone.conf into Remote objects"""
+        parser = configparser.RawConfigParser(strict=False, interpolation=None,
+                                              default_section='\x00defaults')
+        parser.optionxform = str  # i nomi delle opzioni di rclone sono case-sensitive
+        parser.read_string(content)
+        return {name: Remote(name, dict(parser.items(name))) for name in parser.sections()}
+
+    def _refresh(self):
+        """Reload rclone.conf if its mtime or size changed; return the current remotes"""
+        try:
+            stat = os.stat(self.config_path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except (OSError, TypeError):
+            stamp = None
+        with self._lock:
+            if stamp == self._stamp and self._stamp is not None:
+                return self._remotes
+            remotes, encrypted, error = {}, False, None
+            if stamp is not None:
+                try:
+                    with open(self.config_path, 'r') as f:
+                        content = f.read()
+                    if content.lstrip().startswith(ENCRYPTED_MARKER):
+                        encrypted = True
+                    else:
+                        remotes = self._parse(content)
+                except Exception as e:
+                    error = str(e)
+                    logger.error(f"Error parsing rclone config {self.config_path}: {error}")
+            self._remotes, self._encrypted, self._error, self._stamp = remotes, encrypted, error, stamp
+            return remotes
+
+    @property
+    def available(self):
+        """True if the remote list is known (file present, readable and not encrypted)"""
+        self._refresh()
+        return self._stamp is not None and not self._encrypted and self._error is None
+
+    def names(self):
+        """Return the remote names in config order"""
+        return list(self._refresh())
+
+    def get(self, name):
+        """Return the Remote called name, or None"""
+        return self._refresh().get(name)
+
+    def remote_type(self, name, resolve=False):
+        """Return the backend type of a remote (None if unknown)
+
+        Args:
+            name: Remote name
+            resolve: Follow alias/crypt/... remotes to the backend that stores the data
+        """
+        remotes = self._refresh()
+        remote = remotes.get(name)
+        seen = set()
+        while resolve and remote is not None and remote.underlying in remotes and remote.name not in seen:
+            seen.add(remote.name)
+            remote = remotes[remote.underlying]
+        return remote.type if remote is not None else None
+
+    def validate_path(self, path):
+        """Check that the remote of an rclone path exists
+
+        Args:
+            path: Source or target of a job ("remote:path" or local path)
+
+        Returns:
+            str or None: Error message, None if the path is valid or cannot be checked
+        """
+        remote, _ = split_remote(path)
+        if remote is None or not self.available:
+            return None
+        if remote not in self._remotes:
+            if not REMOTE_NAME_PATTERN.match(remote):
+                return f"Nome del remote non valido: '{remote}'"
+            return f"Il remote '{remote}' non è definito in {self.config_path}"
+        return None
+
+    def to_dict(self):
+        """Inventory summary for the API"""
+        remotes = self._refresh()
+        return {
+            'config_path': self.config_path,
+            'exists': self._stamp is not None,
+            'encrypted': self._encrypted,
+            'error': self._error,
+            'remotes': [remote.to_dict() for remote in remotes.values()],
+        }
+
+
+# Istanza globale condivisa dall'applicazione
+remote_inventory = RemoteInventory()
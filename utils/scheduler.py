@@ -7,6 +7,9 @@ from datetime import datetime, timedelta
 from threading import Thread
 from crontab import CronTab
 
+from utils.db_writer import db_writer, WRITE_TIMEOUT
+from utils.job_queue import job_queue
+
 # Rimuoviamo la dipendenza diretta da Flask
 logger = logging.getLogger(__name__)
 
@@ -58,7 +61,6 @@ class JobScheduler:
         """Loop principale dello scheduler"""
         last_full_check = datetime.now()  # Ultima volta che abbiamo controllato tutti i job
         last_log_time = last_full_check   # Ultima volta che abbiamo registrato il log di debug
-        last_stale_check = last_full_check  # Ultima volta che abbiamo controllato i job stale
         
         while self.running:
             try:
@@ -91,19 +93,8 @@ class JobScheduler:
                         else:
                             logger.info(f"[DEBUG] Nessun job da verificare in questa iterazione")
                         
-                        # Controllo job stale ogni 15 minuti
-                        stale_check_interval = 15 * 60  # 15 minuti in secondi
-                        if (current_time - last_stale_check).total_seconds() > stale_check_interval:
-                            logger.info(f"Esecuzione controllo job stale (ogni {stale_check_interval/60} minuti)")
-                            try:
-                                # Importa la funzione per la pulizia dei job stale
-                                from app import force_cleanup_jobs
-                                # Esegui pulizia solo sui job stale (con timeout di 3 ore)
-                                force_cleanup_jobs(only_stale_jobs=True, inactive_hours=3)
-                                last_stale_check = current_time
-                                logger.info("Controllo job stale completato")
-                            except Exception as e:
-                                logger.error(f"Errore durante il controllo dei job stale: {str(e)}")
+                        # I job stale sono ripuliti dal reconciler (utils/reconciler.py), che gira
+                        # anche in questo processo perché scheduler_runner importa l'app
                         
                         # Controllo completo ogni 5 minuti per assicurarci di non perdere alcun job
                         # Questo è un meccanismo di sicurezza in caso di problemi con i timestamp next_run
@@ -119,7 +110,7 @@ class JobScheduler:
                                 for job in jobs_without_next_run:
                                     job.next_run = self._calculate_next_run(job.cron_expression, current_time)
                                     logger.info(f"Updated missing next_run for job {job.id} ({job.name}) to {job.next_run}")
-                                db.session.commit()
+                                db_writer.commit_changes(db.session)
                             
                             # I job da controllare sono tutti quelli con next_run <= now
                             jobs_to_check = [j for j in all_jobs if j.next_run and j.next_run <= current_time]
@@ -154,8 +145,8 @@ class JobScheduler:
                             # Ottiene il timestamp originale next_run per il log dettagliato
                             original_next_run = job.next_run
                             
-                            # Verifica se c'è già un job in esecuzione con gli stessi source/target
-                            if self._check_if_running(source, target):
+                            # Verifica se c'è già un job in esecuzione (o in coda) con gli stessi source/target
+                            if self._check_if_running(source, target) or job_queue.is_queued(source, target):
                                 logger.warning(f"Skipping job {job_id}: source/target already has a running job")
                                 
                                 # Controlla quanto tempo è passato dall'orario di esecuzione originale
@@ -194,7 +185,7 @@ class JobScheduler:
                                 
                                 # Registra dettagli sul job saltato e sul prossimo tentativo
                                 logger.info(f"Job {job_id} skipped. Was due at {original_next_run}, next attempt at {job.next_run}")
-                                db.session.commit()
+                                db_writer.commit_changes(db.session)
                                 continue
                             
                             # Verifica se il job è già in fase di avvio
@@ -247,56 +238,42 @@ class JobScheduler:
                                 
                                 logger.info(f"Executing scheduled job {job.id} ({job.name}): {source} → {target}")
                                 
-                                # Esegui il job - questo aggiunge anche il job al dizionario active_jobs dell'handler
-                                job_info = self.rclone_handler.run_custom_job(source, target, dry_run=False)
+                                # Accoda il job: il dispatcher lo avvia (run_custom_job, history,
+                                # notifica) appena i limiti di concorrenza lo consentono
+                                queued = job_queue.submit(source, target, dry_run=False, origin='scheduled',
+                                                          scheduled_job_id=job.id, name=job.name)
                                 
                                 # Aggiorna il timestamp dell'ultimo avvio
                                 job.last_run = current_time
                                 job.next_run = self._calculate_next_run(job.cron_expression, current_time)
                                 
-                                # Crea entry nella history (usando i valori ripuliti)
-                                history = SyncJobHistory(
-                                    source=source,  # Usa i valori ripuliti
-                                    target=target,  # Usa i valori ripuliti
-                                    status="running",
-                                    dry_run=False,
-                                    start_time=current_time,
-                                    log_file=job_info.get("log_file")
-                                )
-                                db.session.add(history)
-                                
-                                # Registra i dettagli per il debug
-                                logger.info(f"Scheduled job {job.id} started successfully:")
-                                logger.info(f"  - Lock file: {job_info.get('lock_file')}")
-                                logger.info(f"  - Log file: {job_info.get('log_file')}")
-                                logger.info(f"  - Process PID: {job_info.get('process').pid}")
-                                logger.info(f"  - Next run scheduled at: {job.next_run}")
+                                if queued.status == 'done':
+                                    logger.error(f"Error executing scheduled job {job.id}: {queued.error}")
+                                elif queued.status == 'running':
+                                    logger.info(f"Scheduled job {job.id} started successfully (history {queued.history_id}), "
+                                                f"next run scheduled at: {job.next_run}")
+                                else:
+                                    logger.info(f"Scheduled job {job.id} queued ({queued.blocked_by}), "
+                                                f"next run scheduled at: {job.next_run}")
                                 
-                                # Rimuoviamo il lock file preventivo dopo aver avviato con successo il job
+                                # Rimuoviamo il lock file preventivo: da qui in poi il job è in coda o avviato
                                 try:
                                     if os.path.exists(scheduled_lock_file):
                                         os.remove(scheduled_lock_file)
-                                        logger.info(f"Removed preventive lock file after successful job start: {scheduled_lock_file}")
+                                        logger.info(f"Removed preventive lock file after job submission: {scheduled_lock_file}")
                                 except Exception as e:
                                     logger.error(f"Error removing preventive lock file: {str(e)}")
                                 
                                 # Rimuoviamo il job dalla lista dei job in avvio
                                 if job_key in self.launching_jobs:
                                     del self.launching_jobs[job_key]
-                                
-                                # Notifica l'avvio del job
-                                try:
-                                    from utils.notification_manager import notify_job_started
-                                    notify_job_started(history.id, source, target, is_scheduled=True, dry_run=False)
-                                except Exception as e:
-                                    logger.error(f"Failed to send notification for job start: {str(e)}")
                             except Exception as e:
                                 logger.error(f"Error executing scheduled job {job.id}: {str(e)}")
                                 # Aggiorna comunque i timestamp per ritentare alla prossima esecuzione
                                 job.last_run = current_time
                                 job.next_run = self._calculate_next_run(job.cron_expression, current_time)
                             
-                            db.session.commit()
+                            db_writer.commit_changes(db.session).result(timeout=WRITE_TIMEOUT)
                 except Exception as e:
                     # Registriamo errori di importazione o errori durante l'accesso al database
                     logger.error(f"Error accessing database or importing modules: {str(e)}")
@@ -427,6 +404,7 @@ class JobScheduler:
             # Importiamo app per avere accesso al contesto
             from app import app, db
             from models import ScheduledJob
+            from utils.job_stats import pair_stats
             
             # Eseguiamo il codice all'interno di un contesto dell'applicazione
             with app.app_context():
@@ -434,6 +412,8 @@ class JobScheduler:
                 now = datetime.now()
                 
                 jobs = ScheduledJob.query.all()
+                # Statistiche delle ultime esecuzioni di tutte le coppie in una sola query
+                stats = pair_stats(pairs=[(job.source, job.target) for job in jobs])
                 for job in jobs:
                     # Se next_run è None, calcolalo
                     next_run = job.next_run
@@ -460,7 +440,8 @@ class JobScheduler:
                         'enabled': job.enabled,
                         'last_run': job.last_run,
                         'next_run': next_run,
-                        'time_left': time_left
+                        'time_left': time_left,
+                        'stats': stats.get((job.source, job.target))
                     })
                 
                 return summary